@@ -100,29 +100,31 @@ dataset_settings = {
 }
 
 
+def dataset_type_of(ckpt_path):
+    """The dataset ("lip", "atr" or "pascal") a checkpoint was trained on, from its file name."""
+    for dataset_type in ("lip", "atr", "pascal"):
+        if dataset_type in ckpt_path:
+            return dataset_type
+    raise AssertionError("Dataset type not found in checkpoint path")
+
+
 class SCHP:
     def __init__(self, ckpt_path, device):
-        dataset_type = None
-        if "lip" in ckpt_path:
-            dataset_type = "lip"
-        elif "atr" in ckpt_path:
-            dataset_type = "atr"
-        elif "pascal" in ckpt_path:
-            dataset_type = "pascal"
-        assert dataset_type is not None, "Dataset type not found in checkpoint path"
         self.device = device
-        self.num_classes = dataset_settings[dataset_type]["num_classes"]
-        self.input_size = dataset_settings[dataset_type]["input_size"]
-        self.aspect_ratio = self.input_size[1] * 1.0 / self.input_size[0]
-        self.palette = get_palette(self.num_classes)
-
-        self.label = dataset_settings[dataset_type]["label"]
+        self.setup_dataset(dataset_type_of(ckpt_path))
         self.model = networks.init_model(
             "resnet101", num_classes=self.num_classes, pretrained=None
         ).to(device)
         self.load_ckpt(ckpt_path)
         self.model.eval()
 
+    def setup_dataset(self, dataset_type):
+        self.num_classes = dataset_settings[dataset_type]["num_classes"]
+        self.input_size = dataset_settings[dataset_type]["input_size"]
+        self.aspect_ratio = self.input_size[1] * 1.0 / self.input_size[0]
+        self.palette = get_palette(self.num_classes)
+
+        self.label = dataset_settings[dataset_type]["label"]
         self.transform = transforms.Compose(
             [
                 transforms.ToTensor(),
@@ -136,6 +138,18 @@ class SCHP:
         )
 
     def load_ckpt(self, ckpt_path):
+        if ckpt_path.endswith(".safetensors"):
+            # already converted by `state_dict_from_ckpt`, see `leffa_utils.weight_cache`
+            from safetensors.torch import load_file
+
+            state_dict = load_file(ckpt_path, device=str(self.device))
+        else:
+            state_dict = self.state_dict_from_ckpt(ckpt_path)
+        self.model.load_state_dict(state_dict, strict=False)
+
+    @staticmethod
+    def state_dict_from_ckpt(ckpt_path):
+        """Model state dict of a training checkpoint: `module.` prefix dropped, keys renamed."""
         rename_map = {
             "decoder.conv3.2.weight": "decoder.conv3.3.weight",
             "decoder.conv3.3.weight": "decoder.conv3.4.weight",
@@ -149,14 +163,8 @@ class SCHP:
         new_state_dict = OrderedDict()
         for k, v in state_dict.items():
             name = k[7:]  # remove `module.`
-            new_state_dict[name] = v
-        new_state_dict_ = OrderedDict()
-        for k, v in list(new_state_dict.items()):
-            if k in rename_map:
-                new_state_dict_[rename_map[k]] = v
-            else:
-                new_state_dict_[k] = v
-        self.model.load_state_dict(new_state_dict_, strict=False)
+            new_state_dict[rename_map.get(name, name)] = v
+        return new_state_dict
 
     def _box2cs(self, box):
         x, y, w, h = box[:4]
@@ -179,6 +187,9 @@ class SCHP:
         elif isinstance(image, Image.Image):
             # to cv2 format
             img = np.array(image)
+        elif isinstance(image, np.ndarray):
+            # e.g. a `PreprocessGraph` buffer, read as is
+            img = image
 
         h, w, _ = img.shape
         # Get person center and scale
@@ -204,6 +215,14 @@ class SCHP:
         }
         return input, meta
 
+    def forward(self, image):
+        """Logits [B, H, W, C] at the input size, as a numpy array."""
+        output = self.model(image)
+        # upsample_outputs = self.upsample(output[0][-1])
+        upsample_outputs = self.upsample(output)
+        upsample_outputs = upsample_outputs.permute(0, 2, 3, 1)  # BCHW -> BHWC
+        return upsample_outputs.data.cpu().numpy()
+
     def __call__(self, image_or_path):
         if isinstance(image_or_path, list):
             image_list = []
@@ -217,16 +236,13 @@ class SCHP:
             image, meta = self.preprocess(image_or_path)
             meta_list = [meta]
 
-        output = self.model(image)
-        # upsample_outputs = self.upsample(output[0][-1])
-        upsample_outputs = self.upsample(output)
-        upsample_outputs = upsample_outputs.permute(0, 2, 3, 1)  # BCHW -> BHWC
+        upsample_outputs = self.forward(image)
 
         output_img_list = []
         for upsample_output, meta in zip(upsample_outputs, meta_list):
             c, s, w, h = meta["center"], meta["scale"], meta["width"], meta["height"]
             logits_result = transform_logits(
-                upsample_output.data.cpu().numpy(),
+                upsample_output,
                 c,
                 s,
                 w,
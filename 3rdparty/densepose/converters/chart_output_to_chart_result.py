@@ -15,11 +15,61 @@ from . import resample_fine_and_coarse_segm_to_bbox
 from .base import IntTupleBox, make_int_box
 
 
+def _part_index(labels: torch.Tensor, num_parts: int):
+    """
+    Channel to read at each pixel and where to read it: labels 1..num_parts-1 select their
+    channel, background (0) and any other label keep 0.
+    """
+    valid = (labels > 0) & (labels < num_parts)
+    return torch.where(valid, labels, torch.zeros_like(labels)), valid
+
+
+def _select_parts(values: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
+    """
+    values [1, C, H, W], labels [H, W] -> [H, W] float32 with values[0, labels[i, j], i, j] at
+    part pixels and 0 elsewhere, in one gather.
+    """
+    index, valid = _part_index(labels, values.size(1))
+    selected = torch.gather(values[0], 0, index[None]).squeeze(0).to(torch.float32)
+    return torch.where(valid, selected, torch.zeros_like(selected))
+
+
+def _bilinear_source(out_size: int, in_size: int, device):
+    # source indices and weights of F.interpolate(mode="bilinear", align_corners=False)
+    scale = in_size / out_size
+    src = ((torch.arange(out_size, device=device, dtype=torch.float32) + 0.5) * scale - 0.5)
+    src = src.clamp(min=0)
+    index0 = src.floor().long().clamp(max=in_size - 1)
+    index1 = (index0 + 1).clamp(max=in_size - 1)
+    weight1 = src - index0
+    return index0, index1, 1 - weight1, weight1
+
+
+def _upsample_selected_parts(
+    values: torch.Tensor, labels: torch.Tensor, h: int, w: int
+) -> torch.Tensor:
+    """
+    `_select_parts` of `values` bilinearly upsampled to (h, w), interpolating only the selected
+    channel at each pixel instead of all C. Equal to upsampling first up to float rounding.
+    """
+    _, num_parts, in_h, in_w = values.shape
+    y0, y1, wy0, wy1 = _bilinear_source(h, in_h, values.device)
+    x0, x1, wx0, wx1 = _bilinear_source(w, in_w, values.device)
+    index, valid = _part_index(labels, num_parts)
+    values = values[0].to(torch.float32)
+    y0, y1, wy0, wy1 = y0[:, None], y1[:, None], wy0[:, None], wy1[:, None]
+    top = wx0 * values[index, y0, x0] + wx1 * values[index, y0, x1]
+    bottom = wx0 * values[index, y1, x0] + wx1 * values[index, y1, x1]
+    selected = wy0 * top + wy1 * bottom
+    return torch.where(valid, selected, torch.zeros_like(selected))
+
+
 def resample_uv_tensors_to_bbox(
     u: torch.Tensor,
     v: torch.Tensor,
     labels: torch.Tensor,
     box_xywh_abs: IntTupleBox,
+    upsample_selected: bool = False,
 ) -> torch.Tensor:
     """
     Resamples U and V coordinate estimates for the given bounding box
@@ -30,25 +80,28 @@ def resample_uv_tensors_to_bbox(
         labels (tensor [H, W] of long): labels obtained by resampling segmentation
             outputs for the given bounding box
         box_xywh_abs (tuple of 4 int): bounding box that corresponds to predictor outputs
+        upsample_selected (bool): interpolate only the channel selected by the label at each
+            pixel rather than all C channels; equal up to float rounding instead of bitwise
     Return:
        Resampled U and V coordinates - a tensor [2, H, W] of float
     """
     x, y, w, h = box_xywh_abs
     w = max(int(w), 1)
     h = max(int(h), 1)
+    if upsample_selected:
+        return torch.stack(
+            [_upsample_selected_parts(u, labels, h, w), _upsample_selected_parts(v, labels, h, w)]
+        )
     u_bbox = F.interpolate(u, (h, w), mode="bilinear", align_corners=False)
     v_bbox = F.interpolate(v, (h, w), mode="bilinear", align_corners=False)
-    uv = torch.zeros([2, h, w], dtype=torch.float32, device=u.device)
-    for part_id in range(1, u_bbox.size(1)):
-        uv[0][labels == part_id] = u_bbox[0, part_id][labels == part_id]
-        uv[1][labels == part_id] = v_bbox[0, part_id][labels == part_id]
-    return uv
+    return torch.stack([_select_parts(u_bbox, labels), _select_parts(v_bbox, labels)])
 
 
 def resample_uv_to_bbox(
     predictor_output: DensePoseChartPredictorOutput,
     labels: torch.Tensor,
     box_xywh_abs: IntTupleBox,
+    upsample_selected: bool = False,
 ) -> torch.Tensor:
     """
     Resamples U and V coordinate estimates for the given bounding box
@@ -59,6 +112,7 @@ def resample_uv_to_bbox(
         labels (tensor [H, W] of long): labels obtained by resampling segmentation
             outputs for the given bounding box
         box_xywh_abs (tuple of 4 int): bounding box that corresponds to predictor outputs
+        upsample_selected (bool): see `resample_uv_tensors_to_bbox`
     Return:
        Resampled U and V coordinates - a tensor [2, H, W] of float
     """
@@ -67,6 +121,7 @@ def resample_uv_to_bbox(
         predictor_output.v,
         labels,
         box_xywh_abs,
+        upsample_selected,
     )
 
 
@@ -102,6 +157,7 @@ def resample_confidences_to_bbox(
     predictor_output: DensePoseChartPredictorOutput,
     labels: torch.Tensor,
     box_xywh_abs: IntTupleBox,
+    upsample_selected: bool = False,
 ) -> Dict[str, torch.Tensor]:
     """
     Resamples confidences for the given bounding box
@@ -112,6 +168,7 @@ def resample_confidences_to_bbox(
         labels (tensor [H, W] of long): labels obtained by resampling segmentation
             outputs for the given bounding box
         box_xywh_abs (tuple of 4 int): bounding box that corresponds to predictor outputs
+        upsample_selected (bool): see `resample_uv_tensors_to_bbox`; part-based confidences only
     Return:
        Resampled confidences - a dict of [H, W] tensors of float
     """
@@ -132,24 +189,22 @@ def resample_confidences_to_bbox(
     confidence_names = [
         key for key in confidence_names if getattr(predictor_output, key) is not None
     ]
-    confidence_base = torch.zeros([h, w], dtype=torch.float32, device=predictor_output.u.device)
-
     # assign data from channels that correspond to the labels
     for key in confidence_names:
+        confidence = getattr(predictor_output, key)
+        part_based = confidence.size(1) == predictor_output.u.size(1)
+        if part_based and upsample_selected:
+            confidence_results[key] = _upsample_selected_parts(confidence, labels, h, w)
+            continue
         resampled_confidence = F.interpolate(
-            getattr(predictor_output, key),
+            confidence,
             (h, w),
             mode="bilinear",
             align_corners=False,
         )
-        result = confidence_base.clone()
-        for part_id in range(1, predictor_output.u.size(1)):
-            if resampled_confidence.size(1) != predictor_output.u.size(1):
-                # confidence is not part-based, don't try to fill it part by part
-                continue
-            result[labels == part_id] = resampled_confidence[0, part_id][labels == part_id]
-
-        if resampled_confidence.size(1) != predictor_output.u.size(1):
+        if part_based:
+            result = _select_parts(resampled_confidence, labels)
+        else:
             # confidence is not part-based, fill the data with the first channel
             # (targeted for segmentation confidences that have only 1 channel)
             result = resampled_confidence[0, 0]
@@ -9,6 +9,9 @@ from .chart_result import (
     quantize_densepose_chart_result,
     compress_quantized_densepose_chart_result,
     decompress_compressed_densepose_chart_result,
+    encode_quantized_densepose_chart_result,
+    decode_quantized_densepose_chart_result,
+    fastest_densepose_chart_result_codec,
 )
 from .cse import DensePoseEmbeddingPredictorOutput
 from .data_relative import DensePoseDataRelative
@@ -1,5 +1,7 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
 
+import struct
+import warnings
 from dataclasses import dataclass
 from typing import Any, Optional, Tuple
 import torch
@@ -181,3 +183,150 @@ def decompress_compressed_densepose_chart_result(
     return DensePoseChartResultQuantized(
         labels_uv_uint8=torch.from_numpy(labels_uv_uint8_np_chw.reshape(result.shape_chw))
     )
+
+
+# Binary container for quantized results: a fixed header (magic, codec id, C, H, W)
+# followed by the payload. The "png" codec stores the same PNG as the compressed result
+# above, without the base64 layer; the others store the raw CHW uint8 buffer, optionally
+# compressed. zstd and lz4 are used when their packages are installed.
+_BINARY_MAGIC = b"DPQ1"
+_BINARY_HEADER = struct.Struct("<4sB3I")
+_BINARY_CODECS = ("raw", "png", "zlib", "bz2", "lzma", "zstd", "lz4")
+
+
+def _binary_compressor(codec: str, level: Optional[int]):
+    if codec == "zlib":
+        import zlib
+
+        return lambda data: zlib.compress(data, 1 if level is None else level)
+    if codec == "bz2":
+        import bz2
+
+        return lambda data: bz2.compress(data, 9 if level is None else level)
+    if codec == "lzma":
+        import lzma
+
+        return lambda data: lzma.compress(data, preset=0 if level is None else level)
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress
+    if codec == "lz4":
+        import lz4.frame
+
+        return lambda data: lz4.frame.compress(data, compression_level=0 if level is None else level)
+    raise ValueError(f"Unknown DensePose result codec {codec!r}, expected one of {_BINARY_CODECS}")
+
+
+def _binary_decompressor(codec: str):
+    if codec == "zlib":
+        import zlib
+
+        return zlib.decompress
+    if codec == "bz2":
+        import bz2
+
+        return bz2.decompress
+    if codec == "lzma":
+        import lzma
+
+        return lzma.decompress
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress
+    if codec == "lz4":
+        import lz4.frame
+
+        return lz4.frame.decompress
+    raise ValueError(f"Unknown DensePose result codec {codec!r}, expected one of {_BINARY_CODECS}")
+
+
+def fastest_densepose_chart_result_codec() -> str:
+    """
+    Fast general-purpose codec available in this environment: zstd, then lz4, then zlib
+    """
+    import importlib.util
+
+    for codec, module in (("zstd", "zstandard"), ("lz4", "lz4")):
+        if importlib.util.find_spec(module) is not None:
+            return codec
+    return "zlib"
+
+
+def encode_quantized_densepose_chart_result(
+    result: DensePoseChartResultQuantized, codec: str = "raw", level: Optional[int] = None
+) -> bytes:
+    """
+    Encodes quantized DensePose chart-based result into a self-describing byte string
+
+    Args:
+        result (DensePoseChartResultQuantized): quantized DensePose chart-based result
+        codec (str): one of "raw" (uncompressed), "png", "zlib", "bz2", "lzma",
+            "zstd" or "lz4"; see `fastest_densepose_chart_result_codec`
+        level (int): compression level, codec-specific default if None
+    Return:
+        Header followed by the encoded [3, H, W] uint8 tensor (bytes)
+    """
+    import numpy as np
+
+    labels_uv_uint8_np_chw = np.ascontiguousarray(result.labels_uv_uint8.cpu().numpy())
+    c, h, w = labels_uv_uint8_np_chw.shape
+    if codec == "raw":
+        payload = memoryview(labels_uv_uint8_np_chw).cast("B")
+    elif codec == "png":
+        from io import BytesIO
+        from PIL import Image
+
+        im = Image.fromarray(np.moveaxis(labels_uv_uint8_np_chw, 0, -1))
+        fstream = BytesIO()
+        if level is None:
+            im.save(fstream, format="png", optimize=True)
+        else:
+            im.save(fstream, format="png", compress_level=level)
+        payload = fstream.getbuffer()
+    else:
+        payload = _binary_compressor(codec, level)(labels_uv_uint8_np_chw)
+    header = _BINARY_HEADER.pack(_BINARY_MAGIC, _BINARY_CODECS.index(codec), c, h, w)
+    return b"".join((header, payload))
+
+
+def decode_quantized_densepose_chart_result(data) -> DensePoseChartResultQuantized:
+    """
+    Decodes quantized DensePose chart-based result from a byte string
+
+    The tensor of "raw" results is a view of `data` (zero-copy), other codecs decode
+    into a new buffer without further copies. Views of immutable buffers such as
+    `bytes` are read-only: clone the tensor before modifying it in place.
+
+    Args:
+        data (bytes-like): output of `encode_quantized_densepose_chart_result`
+    Return:
+        Quantized DensePose chart-based result (DensePoseChartResultQuantized)
+    """
+    import numpy as np
+
+    magic, codec_id, c, h, w = _BINARY_HEADER.unpack_from(data)
+    if magic != _BINARY_MAGIC or codec_id >= len(_BINARY_CODECS):
+        raise ValueError("Not an encoded DensePose chart result")
+    codec = _BINARY_CODECS[codec_id]
+    payload = memoryview(data)[_BINARY_HEADER.size :]
+    if codec == "raw":
+        buffer = payload
+    elif codec == "png":
+        from io import BytesIO
+        from PIL import Image
+
+        im = Image.open(BytesIO(payload))
+        labels_uv_uint8_np_chw = np.moveaxis(np.asarray(im, dtype=np.uint8), -1, 0)
+        return DensePoseChartResultQuantized(
+            labels_uv_uint8=torch.from_numpy(labels_uv_uint8_np_chw.reshape(c, h, w))
+        )
+    else:
+        buffer = _binary_decompressor(codec)(payload)
+    labels_uv_uint8_np_chw = np.frombuffer(buffer, dtype=np.uint8, count=c * h * w)
+    with warnings.catch_warnings():
+        # torch warns about sharing read-only memory, which is what zero-copy means here
+        warnings.simplefilter("ignore", UserWarning)
+        labels_uv_uint8 = torch.from_numpy(labels_uv_uint8_np_chw).view(c, h, w)
+    return DensePoseChartResultQuantized(labels_uv_uint8=labels_uv_uint8)
@@ -95,6 +95,11 @@ class DetectionCheckpointer(Checkpointer):
                 if not k.endswith("num_batches_tracked")
             }
             return {"model": model_state, "__author__": "pycls", "matching_heuristics": True}
+        elif filename.endswith(".safetensors"):
+            # model-ready state dict, e.g. written by `leffa_utils.weight_cache`
+            from safetensors.torch import load_file
+
+            return {"model": load_file(self.path_manager.get_local_path(filename))}
 
         loaded = self._torch_load(filename)
         if "model" not in loaded:
@@ -1,19 +1,24 @@
 import os
 import io
+import asyncio
 import base64
 import logging
-from typing import Optional
+from typing import List, Optional
 from pathlib import Path
-import tempfile
 
 import numpy as np
 from PIL import Image
 from fastapi import FastAPI, File, Form, UploadFile, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 import uvicorn
 
+from leffa import runtime, tracing
+from leffa_utils.ingest import ImageTooLarge
+from leffa_utils.preprocess_graph import PreprocessGraph
+from leffa_utils import serving
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,6 +41,19 @@ app.add_middleware(
 leffa_model = None
 leffa_transform = None
 leffa_inference = None
+leffa_executor = None
+
+# Set in the frontend processes of the multi-process topology (LEFFA_INFERENCE_WORKERS, see
+# __main__): requests are then run by the inference worker processes, see leffa_utils.serving
+inference_client = None
+
+# Divide the CPU cores between PyTorch, ONNX Runtime, OpenCV and concurrent requests
+# (LEFFA_CPU_CORES, LEFFA_WORKERS, LEFFA_CPU_AFFINITY)
+runtime.configure()
+
+# Per-stage latency histograms on /metrics; per-request traces work without this
+if os.getenv("LEFFA_TRACING", "0") == "1":
+    tracing.enable()
 
 class TryOnRequest(BaseModel):
     human_image: str  # Base64 encoded image
@@ -44,38 +62,44 @@ class TryOnRequest(BaseModel):
     num_inference_steps: int = 30
     seed: int = 42
     ref_acceleration: bool = False
+    return_trace: bool = False
 
 class TryOnResponse(BaseModel):
     result_image: str  # Base64 encoded output image
     processing_time: float
+    trace: Optional[List[dict]] = None  # Per-stage spans, when requested
+    bytes_copied: Optional[int] = None  # Image bytes copied in preprocessing, with the trace
+
+def ingest_image(source):
+    """Decode an image once to the model's 768x1024 RGB input, see leffa_utils.preprocess_graph"""
+    try:
+        return PreprocessGraph(source, 768, 1024)
+    except ImageTooLarge as e:
+        logger.error(f"Rejected image: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error decoding image: {e}")
+        raise HTTPException(status_code=400, detail="Invalid image data")
 
 def decode_base64_image(encoded_image):
-    """Decode a base64 image to a PIL Image"""
+    """Decode a base64 image to the model's 768x1024 RGB input"""
     try:
         image_data = base64.b64decode(encoded_image.split(',')[1] if ',' in encoded_image else encoded_image)
-        return Image.open(io.BytesIO(image_data))
     except Exception as e:
         logger.error(f"Error decoding base64 image: {e}")
         raise HTTPException(status_code=400, detail="Invalid image data")
+    return ingest_image(image_data)
 
 def encode_pil_to_base64(image):
     """Encode a PIL Image to base64"""
-    buffered = io.BytesIO()
-    image.save(buffered, format="JPEG")
-    return base64.b64encode(buffered.getvalue()).decode("utf-8")
-
-def save_uploaded_file(upload_file: UploadFile) -> str:
-    """Save an uploaded file and return the path"""
-    temp_dir = tempfile.mkdtemp()
-    content = upload_file.file.read()
-    file_path = os.path.join(temp_dir, upload_file.filename)
-    with open(file_path, 'wb') as f:
-        f.write(content)
-    return file_path
+    with tracing.span("encode_image"):
+        buffered = io.BytesIO()
+        image.save(buffered, format="JPEG")
+        return base64.b64encode(buffered.getvalue()).decode("utf-8")
 
 def load_model():
     """Load the Leffa model"""
-    global leffa_model, leffa_transform, leffa_inference
+    global leffa_model, leffa_transform, leffa_inference, leffa_executor
     
     if leffa_model is not None:
         return
@@ -96,54 +120,123 @@ def load_model():
         dtype = "float16" if device == "cuda" else "float32"
         logger.info(f"Using device: {device}, dtype: {dtype}")
         
+        # Attention processor: "sdpa" (default) or "chunked" for hosts without flash kernels
+        attention_processor = os.getenv("LEFFA_ATTENTION_PROCESSOR", "sdpa")
+        attention_memory_budget_mb = os.getenv("LEFFA_ATTENTION_MEMORY_MB")
+        if attention_memory_budget_mb is not None:
+            attention_memory_budget_mb = float(attention_memory_budget_mb)
+        logger.info(f"Using attention processor: {attention_processor}")
+        
         # Load model
         leffa_model = LeffaModel(
             pretrained_model_name_or_path="/app/ckpts/stable-diffusion-inpainting",
             pretrained_model="/app/ckpts/virtual_tryon.pth",
             dtype=dtype,
+            attention_processor=attention_processor,
+            attention_memory_budget_mb=attention_memory_budget_mb,
         )
-        leffa_inference = LeffaInference(model=leffa_model)
+        # CPU-optimized mode: int8 dynamic quantization, channels_last and bf16 autocast
+        autocast_dtype = None
+        if device == "cpu" and os.getenv("LEFFA_CPU_OPTIMIZE", "0") == "1":
+            from leffa.cpu_inference import optimize_for_cpu
+            autocast_dtype = optimize_for_cpu(leffa_model)
+            logger.info(f"CPU optimizations enabled, autocast dtype: {autocast_dtype}")
+        leffa_inference = LeffaInference(model=leffa_model, autocast_dtype=autocast_dtype)
+        
+        # Opt-in compiled denoising loop, warmed for each batch bucket before serving
+        if os.getenv("LEFFA_COMPILE", "0") == "1":
+            batch_buckets = [int(b) for b in os.getenv("LEFFA_COMPILE_BUCKETS", "1").split(",")]
+            leffa_inference.pipe.enable_compile(
+                batch_buckets=batch_buckets,
+                cache_dir=os.getenv("LEFFA_COMPILE_CACHE_DIR", "/app/ckpts/inductor_cache"),
+            )
+            compile_times = leffa_inference.pipe.warmup(leffa_model.height, leffa_model.width)
+            logger.info(f"Compiled batch buckets {compile_times}")
         leffa_transform = LeffaTransform()
         
+        # Opt-in staged execution: transform, VAE encode and reference UNet of upcoming requests
+        # overlap with denoising of the current one
+        if os.getenv("LEFFA_PIPELINED", "0") == "1":
+            from leffa.staged import StagedExecutor
+            leffa_executor = StagedExecutor(leffa_inference, transform=leffa_transform)
+            logger.info("Staged execution enabled")
+        
         logger.info(f"Model loaded in {time.time() - start_time:.2f} seconds")
     except Exception as e:
         logger.error(f"Error loading model: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to load model: {str(e)}")
 
-def virtual_try_on(human_image, garment_image, guidance_scale=2.5, num_inference_steps=30, seed=42, ref_acceleration=False):
-    """Run virtual try-on inference"""
+def build_handler():
+    """Load the model in an inference worker process and return its try-on handler"""
+    load_model()
+    
+    # Opt-in agnostic mask from DensePose and SCHP ("upper", "lower", "overall", ...) instead of
+    # inpainting the whole image
+    automasker = None
+    mask_type = os.getenv("LEFFA_AUTOMASK")
+    if mask_type:
+        import torch
+        from leffa_utils.garment_agnostic_mask_predictor import AutoMasker
+        automasker = AutoMasker(
+            densepose_path="/app/ckpts/densepose",
+            schp_path="/app/ckpts/schp",
+            device="cuda" if torch.cuda.is_available() else "cpu",
+        )
+        logger.info(f"Agnostic masks enabled, mask type: {mask_type}")
+    return serving.TryOnHandler(
+        leffa_inference,
+        leffa_transform,
+        executor=leffa_executor,
+        automasker=automasker,
+        mask_type=mask_type or "upper",
+    )
+
+async def virtual_try_on(human_image, garment_image, guidance_scale=2.5, num_inference_steps=30, seed=42, ref_acceleration=False):
+    """Run virtual try-on inference on the PreprocessGraphs of ingest_image"""
     import time
-    from leffa_utils.utils import resize_and_center
     
     start_time = time.time()
     
     try:
-        # Resize images to the expected input size
-        human_image = resize_and_center(human_image, 768, 1024)
-        garment_image = resize_and_center(garment_image, 768, 1024)
+        inference_kwargs = dict(
+            ref_acceleration=ref_acceleration,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            seed=seed,
+        )
+        if inference_client is not None:
+            # the images go to the worker through shared memory, the result comes back the same way
+            logger.info("Queueing inference on the inference workers...")
+            with tracing.span("inference_worker"):
+                result = await asyncio.wrap_future(
+                    inference_client.submit(human_image.rgb, garment_image.rgb, **inference_kwargs)
+                )
+            processing_time = time.time() - start_time
+            logger.info(f"Processing completed in {processing_time:.2f} seconds")
+            return Image.fromarray(result), processing_time
         
         # Create a default mask and densepose (simple version without SCHP and DensePose)
-        mask = Image.fromarray(np.ones_like(np.array(human_image)) * 255)
-        densepose = Image.fromarray(np.ones_like(np.array(human_image)))
+        mask = np.full((1024, 768), 255, dtype=np.uint8)
+        densepose = np.ones((1024, 768, 3), dtype=np.uint8)
         
         # Transform inputs
         data = {
-            "src_image": [human_image],
-            "ref_image": [garment_image],
+            "src_image": [human_image.rgb],
+            "ref_image": [garment_image.rgb],
             "mask": [mask],
             "densepose": [densepose],
         }
-        data = leffa_transform(data)
-        
-        # Run inference
-        logger.info("Running inference...")
-        output = leffa_inference(
-            data,
-            ref_acceleration=ref_acceleration,
-            num_inference_steps=num_inference_steps,
-            guidance_scale=guidance_scale,
-            seed=seed,
-        )
+        if leffa_executor is not None:
+            # the executor transforms; other requests are served while this one is queued
+            logger.info("Queueing inference...")
+            output = await asyncio.wrap_future(leffa_executor.submit(data, **inference_kwargs))
+        else:
+            with tracing.span("leffa_transform"):
+                data = leffa_transform(data)
+            
+            # Run inference
+            logger.info("Running inference...")
+            output = leffa_inference(data, **inference_kwargs)
         
         # Get the generated image
         gen_image = output["generated_image"][0]
@@ -157,39 +250,54 @@ def virtual_try_on(human_image, garment_image, guidance_scale=2.5, num_inference
 
 @app.on_event("startup")
 async def startup_event():
-    """Load model on startup"""
-    load_model()
+    """Load model on startup, unless inference runs in worker processes"""
+    if inference_client is None:
+        load_model()
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "ok", "model_loaded": leffa_model is not None}
+    return {"status": "ok", "model_loaded": leffa_model is not None or inference_client is not None}
+
+@app.get("/metrics")
+async def metrics():
+    """Per-stage latency histograms in the Prometheus text format"""
+    return PlainTextResponse(
+        tracing.render_prometheus(), media_type="text/plain; version=0.0.4"
+    )
 
 @app.post("/try-on", response_model=TryOnResponse)
 async def try_on(request: TryOnRequest):
     """Process a virtual try-on request with base64 encoded images"""
     try:
-        # Decode images
-        human_image = decode_base64_image(request.human_image)
-        garment_image = decode_base64_image(request.garment_image)
-        
-        # Run virtual try-on
-        result_image, processing_time = virtual_try_on(
-            human_image, 
-            garment_image,
-            guidance_scale=request.guidance_scale,
-            num_inference_steps=request.num_inference_steps,
-            seed=request.seed,
-            ref_acceleration=request.ref_acceleration
-        )
-        
-        # Encode result image
-        result_base64 = encode_pil_to_base64(result_image)
+        with tracing.trace(enabled=request.return_trace) as spans:
+            # Decode images
+            human_image = decode_base64_image(request.human_image)
+            garment_image = decode_base64_image(request.garment_image)
+            
+            # Run virtual try-on
+            result_image, processing_time = await virtual_try_on(
+                human_image, 
+                garment_image,
+                guidance_scale=request.guidance_scale,
+                num_inference_steps=request.num_inference_steps,
+                seed=request.seed,
+                ref_acceleration=request.ref_acceleration
+            )
+            
+            # Encode result image
+            result_base64 = encode_pil_to_base64(result_image)
         
         return TryOnResponse(
             result_image=f"data:image/jpeg;base64,{result_base64}",
-            processing_time=processing_time
+            processing_time=processing_time,
+            trace=spans,
+            bytes_copied=(
+                human_image.bytes_copied + garment_image.bytes_copied if spans is not None else None
+            ),
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing try-on request: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -201,42 +309,55 @@ async def try_on_upload(
     guidance_scale: float = Form(2.5),
     num_inference_steps: int = Form(30),
     seed: int = Form(42),
-    ref_acceleration: bool = Form(False)
+    ref_acceleration: bool = Form(False),
+    return_trace: bool = Form(False)
 ):
     """Process a virtual try-on request with uploaded files"""
     try:
-        # Save uploaded files
-        human_path = save_uploaded_file(human_image)
-        garment_path = save_uploaded_file(garment_image)
-        
-        # Load images
-        human_img = Image.open(human_path)
-        garment_img = Image.open(garment_path)
-        
-        # Run virtual try-on
-        result_image, processing_time = virtual_try_on(
-            human_img, 
-            garment_img,
-            guidance_scale=guidance_scale,
-            num_inference_steps=num_inference_steps,
-            seed=seed,
-            ref_acceleration=ref_acceleration
-        )
-        
-        # Clean up temporary files
-        os.remove(human_path)
-        os.remove(garment_path)
+        with tracing.trace(enabled=return_trace) as spans:
+            # Decode the uploads in place, without temporary files
+            human_img = ingest_image(human_image.file)
+            garment_img = ingest_image(garment_image.file)
+            
+            # Run virtual try-on
+            result_image, processing_time = await virtual_try_on(
+                human_img, 
+                garment_img,
+                guidance_scale=guidance_scale,
+                num_inference_steps=num_inference_steps,
+                seed=seed,
+                ref_acceleration=ref_acceleration
+            )
+            
+            # Encode result image
+            result_base64 = encode_pil_to_base64(result_image)
         
-        # Encode result image
-        result_base64 = encode_pil_to_base64(result_image)
-        
-        return {
+        response = {
             "result_image": f"data:image/jpeg;base64,{result_base64}",
             "processing_time": processing_time
         }
+        if spans is not None:
+            response["trace"] = spans
+            response["bytes_copied"] = human_img.bytes_copied + garment_img.bytes_copied
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing try-on upload: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
-    uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=False) 
\ No newline at end of file
+    # LEFFA_INFERENCE_WORKERS ("2", "cpu:0-7 cpu:8-15", "cuda:0 cuda:1") moves the model into that
+    # many inference processes, shared by LEFFA_FRONTENDS HTTP processes
+    inference_workers = os.getenv("LEFFA_INFERENCE_WORKERS")
+    if inference_workers:
+        serving.serve(
+            "server:app",
+            "server:build_handler",
+            serving.parse_worker_specs(inference_workers),
+            frontends=int(os.getenv("LEFFA_FRONTENDS", "1")),
+            port=8000,
+            concurrency=int(os.getenv("LEFFA_WORKER_CONCURRENCY", "1")),
+        )
+    else:
+        uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=False) 
\ No newline at end of file
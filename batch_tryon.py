@@ -0,0 +1,136 @@
+"""
+Offline catalog try-on: render every (person, garment) pair of a manifest with one model load.
+
+DataLoader worker processes decode, resize and mask the pairs while the main process runs
+batched `LeffaInference` calls, and finished images are written on background threads. Progress
+is checkpointed to `<output>/progress-<i>-of-<n>.jsonl`, so rerunning the same command resumes
+where a killed run stopped. `--shard i/n` processes every n-th pair, for splitting a manifest
+across processes or machines. See `leffa_utils.batch` for the manifest format.
+
+    python batch_tryon.py pairs.csv --output ./catalog --batch-size 4 --num-workers 8 \\
+        --shard 0/2
+"""
+import argparse
+import logging
+import os
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from leffa import runtime
+from leffa_utils.batch import (
+    AsyncWriter,
+    ProgressLog,
+    TryOnDataset,
+    collate,
+    parse_shard,
+    read_manifest,
+    shard,
+)
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def load_inference(ckpt_dir, cpu_optimize=False):
+    from leffa.inference import LeffaInference
+    from leffa.model import LeffaModel
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = "float16" if device == "cuda" else "float32"
+    model = LeffaModel(
+        pretrained_model_name_or_path=os.path.join(ckpt_dir, "stable-diffusion-inpainting"),
+        pretrained_model=os.path.join(ckpt_dir, "virtual_tryon.pth"),
+        dtype=dtype,
+    )
+    autocast_dtype = None
+    if device == "cpu" and cpu_optimize:
+        from leffa.cpu_inference import optimize_for_cpu
+
+        autocast_dtype = optimize_for_cpu(model)
+    return LeffaInference(model=model, autocast_dtype=autocast_dtype)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("manifest", help="CSV or JSONL file of person/garment pairs")
+    parser.add_argument("--output", default="./tryon_outputs")
+    parser.add_argument("--ckpts", default="./ckpts")
+    parser.add_argument("--shard", default="0/1", help="i/n: process every n-th pair from i")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--num-workers", type=int, default=4, help="DataLoader processes")
+    parser.add_argument("--mask", choices=["full", "agnostic"], default="full",
+                        help="mask for pairs without one in the manifest")
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--guidance-scale", type=float, default=2.5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--ref-acceleration", action="store_true")
+    parser.add_argument("--cpu-optimize", action="store_true",
+                        help="int8/bf16 CPU optimizations, see leffa.cpu_inference")
+    parser.add_argument("--format", choices=["jpg", "png"], default="jpg")
+    parser.add_argument("--writer-threads", type=int, default=2)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    shard_index, shard_count = parse_shard(args.shard)
+    os.makedirs(args.output, exist_ok=True)
+    progress = ProgressLog(os.path.join(
+        args.output, "progress-{}-of-{}.jsonl".format(shard_index, shard_count)))
+    pairs = [
+        pair for pair in shard(read_manifest(args.manifest), shard_index, shard_count)
+        if pair.id not in progress.done
+    ]
+    logger.info("Shard {}/{}: {} pairs to render, {} already done".format(
+        shard_index, shard_count, len(pairs), len(progress.done)))
+    if not pairs:
+        progress.close()
+        return
+
+    runtime.configure()
+    inference = load_inference(args.ckpts, args.cpu_optimize)
+
+    dataset = TryOnDataset(pairs, mask=args.mask, ckpt_dir=args.ckpts)
+    loader = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        collate_fn=collate,
+        pin_memory=torch.cuda.is_available(),
+        prefetch_factor=2 if args.num_workers > 0 else None,
+        persistent_workers=False,
+        # preprocessing models in forked workers cannot use the CUDA context of this process
+        multiprocessing_context=(
+            "spawn" if args.num_workers > 0 and args.mask == "agnostic" else None),
+    )
+    writer = AsyncWriter(args.output, progress, num_threads=args.writer_threads,
+                         image_format=args.format)
+
+    start, rendered, bytes_copied = time.perf_counter(), 0, 0
+    try:
+        for batch in loader:
+            for pair_id, error in batch["failed"]:
+                logger.error("Skipping {}: {}".format(pair_id, error))
+                progress.record(pair_id, status="failed", error=error)
+            if not batch["id"]:
+                continue
+            output = inference(
+                batch,
+                ref_acceleration=args.ref_acceleration,
+                num_inference_steps=args.steps,
+                guidance_scale=args.guidance_scale,
+                seed=args.seed,
+            )
+            for pair_id, image in zip(batch["id"], output["generated_image"]):
+                writer.submit(pair_id, image)
+            rendered += len(batch["id"])
+            bytes_copied += batch["bytes_copied"]
+            elapsed = time.perf_counter() - start
+            logger.info("{}/{} pairs, {:.2f} s/pair, {:.1f} MB copied/pair in preprocessing".format(
+                rendered, len(pairs), elapsed / rendered, bytes_copied / rendered / 2 ** 20))
+    finally:
+        writer.close()
+        progress.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""
+Parity and per-mask latency of the LUT/uint8 `get_agnostic_mask_hd` and `get_agnostic_mask_dc`.
+
+`legacy_get_agnostic_mask_hd` and `legacy_get_agnostic_mask_dc` are verbatim copies of the
+float32/PIL implementations they replaced. Both run on the synthetic ATR parse of
+`benchmarks.synthetic` (plus a neck) with jittered OpenPose keypoints, some with a missing wrist
+or elbow. Arms are rasterized by OpenCV instead of PIL, so masks with drawn arms can differ on a
+few edge pixels; `exact` counts bit-identical masks and `agreement` is the worst pixel agreement.
+
+    python -m benchmarks.agnostic_mask --poses 8
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+import torch
+from numpy.linalg import lstsq
+from PIL import Image, ImageDraw
+
+from benchmarks.common import format_table
+from benchmarks.synthetic import _POSE_TEMPLATE, synthetic_parsing
+from leffa_utils.utils import (
+    extend_arm_mask,
+    get_agnostic_mask_dc,
+    get_agnostic_mask_hd,
+    get_agnostic_masks,
+    hole_fill,
+    label_map,
+    refine_mask,
+)
+
+
+def legacy_get_agnostic_mask_hd(model_parse, keypoint, category, size=(384, 512), model_type="hd"):
+    # model_type = "hd"
+    ##############################
+    width, height = size
+    im_parse = model_parse.resize((width, height), Image.NEAREST)
+    parse_array = np.array(im_parse)
+
+    if model_type == 'hd':
+        arm_width = 60
+    elif model_type == 'dc':
+        arm_width = 45
+    else:
+        raise ValueError("model_type must be \'hd\' or \'dc\'!")
+
+    parse_head = (parse_array == 1).astype(np.float32) + \
+                 (parse_array == 3).astype(np.float32) + \
+                 (parse_array == 11).astype(np.float32)
+
+    parser_mask_fixed = (parse_array == label_map["left_shoe"]).astype(np.float32) + \
+                        (parse_array == label_map["right_shoe"]).astype(np.float32) + \
+                        (parse_array == label_map["hat"]).astype(np.float32) + \
+                        (parse_array == label_map["sunglasses"]).astype(np.float32) + \
+                        (parse_array == label_map["bag"]).astype(np.float32)
+
+    parser_mask_changeable = (
+        parse_array == label_map["background"]).astype(np.float32)
+
+    arms_left = (parse_array == 14).astype(np.float32)
+    arms_right = (parse_array == 15).astype(np.float32)
+
+    if category == 'dresses':
+        parse_mask = (parse_array == 7).astype(np.float32) + \
+                     (parse_array == 4).astype(np.float32) + \
+                     (parse_array == 5).astype(np.float32) + \
+                     (parse_array == 6).astype(np.float32)
+
+        parser_mask_changeable += np.logical_and(
+            parse_array, np.logical_not(parser_mask_fixed))
+
+    elif category == 'upper_body':
+        parse_mask = (parse_array == 4).astype(np.float32) + \
+            (parse_array == 7).astype(np.float32)
+        parser_mask_fixed_lower_cloth = (parse_array == label_map["skirt"]).astype(np.float32) + \
+                                        (parse_array == label_map["pants"]).astype(
+                                            np.float32)
+        parser_mask_fixed += parser_mask_fixed_lower_cloth
+        parser_mask_changeable += np.logical_and(
+            parse_array, np.logical_not(parser_mask_fixed))
+    elif category == 'lower_body':
+        parse_mask = (parse_array == 6).astype(np.float32) + \
+                     (parse_array == 12).astype(np.float32) + \
+                     (parse_array == 13).astype(np.float32) + \
+                     (parse_array == 5).astype(np.float32)
+        parser_mask_fixed += (parse_array == label_map["upper_clothes"]).astype(np.float32) + \
+                             (parse_array == 14).astype(np.float32) + \
+                             (parse_array == 15).astype(np.float32)
+        parser_mask_changeable += np.logical_and(
+            parse_array, np.logical_not(parser_mask_fixed))
+    else:
+        raise NotImplementedError
+
+    # Load pose points
+    pose_data = keypoint["pose_keypoints_2d"]
+    pose_data = np.array(pose_data)
+    pose_data = pose_data.reshape((-1, 2))
+
+    im_arms_left = Image.new('L', (width, height))
+    im_arms_right = Image.new('L', (width, height))
+    arms_draw_left = ImageDraw.Draw(im_arms_left)
+    arms_draw_right = ImageDraw.Draw(im_arms_right)
+    if category == 'dresses' or category == 'upper_body':
+        shoulder_right = np.multiply(tuple(pose_data[2][:2]), height / 512.0)
+        shoulder_left = np.multiply(tuple(pose_data[5][:2]), height / 512.0)
+        elbow_right = np.multiply(tuple(pose_data[3][:2]), height / 512.0)
+        elbow_left = np.multiply(tuple(pose_data[6][:2]), height / 512.0)
+        wrist_right = np.multiply(tuple(pose_data[4][:2]), height / 512.0)
+        wrist_left = np.multiply(tuple(pose_data[7][:2]), height / 512.0)
+        ARM_LINE_WIDTH = int(arm_width / 512 * height)
+        size_left = [shoulder_left[0] - ARM_LINE_WIDTH // 2, shoulder_left[1] - ARM_LINE_WIDTH //
+                     2, shoulder_left[0] + ARM_LINE_WIDTH // 2, shoulder_left[1] + ARM_LINE_WIDTH // 2]
+        size_right = [shoulder_right[0] - ARM_LINE_WIDTH // 2, shoulder_right[1] - ARM_LINE_WIDTH // 2, shoulder_right[0] + ARM_LINE_WIDTH // 2,
+                      shoulder_right[1] + ARM_LINE_WIDTH // 2]
+
+        if wrist_right[0] <= 1. and wrist_right[1] <= 1.:
+            im_arms_right = arms_right
+        else:
+            wrist_right = extend_arm_mask(wrist_right, elbow_right, 1.2)
+            arms_draw_right.line(np.concatenate((shoulder_right, elbow_right, wrist_right)).astype(
+                np.uint16).tolist(), 'white', ARM_LINE_WIDTH, 'curve')
+            arms_draw_right.arc(size_right, 0, 360,
+                                'white', ARM_LINE_WIDTH // 2)
+
+        if wrist_left[0] <= 1. and wrist_left[1] <= 1.:
+            im_arms_left = arms_left
+        else:
+            wrist_left = extend_arm_mask(wrist_left, elbow_left, 1.2)
+            arms_draw_left.line(np.concatenate((wrist_left, elbow_left, shoulder_left)).astype(
+                np.uint16).tolist(), 'white', ARM_LINE_WIDTH, 'curve')
+            arms_draw_left.arc(size_left, 0, 360, 'white', ARM_LINE_WIDTH // 2)
+
+        hands_left = np.logical_and(np.logical_not(im_arms_left), arms_left)
+        hands_right = np.logical_and(np.logical_not(im_arms_right), arms_right)
+        parser_mask_fixed += hands_left + hands_right
+
+    parser_mask_fixed = cv2.erode(parser_mask_fixed, np.ones(
+        (5, 5), np.uint16), iterations=1)
+
+    parser_mask_fixed = np.logical_or(parser_mask_fixed, parse_head)
+    parse_mask = cv2.dilate(parse_mask, np.ones(
+        (10, 10), np.uint16), iterations=5)
+    if category == 'dresses' or category == 'upper_body':
+        neck_mask = (parse_array == 18).astype(np.float32)
+        neck_mask = cv2.dilate(neck_mask, np.ones(
+            (5, 5), np.uint16), iterations=1)
+        neck_mask = np.logical_and(neck_mask, np.logical_not(parse_head))
+        parse_mask = np.logical_or(parse_mask, neck_mask)
+        arm_mask = cv2.dilate(np.logical_or(im_arms_left, im_arms_right).astype(
+            'float32'), np.ones((5, 5), np.uint16), iterations=4)
+        parse_mask += np.logical_or(parse_mask, arm_mask)
+
+    parse_mask = np.logical_and(
+        parser_mask_changeable, np.logical_not(parse_mask))
+
+    parse_mask_total = np.logical_or(parse_mask, parser_mask_fixed)
+    inpaint_mask = 1 - parse_mask_total
+    img = np.where(inpaint_mask, 255, 0)
+    dst = hole_fill(img.astype(np.uint8))
+    dst = refine_mask(dst)
+    inpaint_mask = dst / 255 * 1
+    mask = Image.fromarray(inpaint_mask.astype(np.uint8) * 255)
+
+    return mask
+
+
+def legacy_get_agnostic_mask_dc(model_parse, keypoint, category, size=(384, 512)):
+    parse_array = np.array(model_parse)
+    pose_data = keypoint["pose_keypoints_2d"]
+    pose_data = np.array(pose_data)
+    pose_data = pose_data.reshape((-1, 2))
+
+    parse_shape = (parse_array > 0).astype(np.float32)
+
+    parse_head = (parse_array == 1).astype(np.float32) + \
+        (parse_array == 2).astype(np.float32) + \
+        (parse_array == 3).astype(np.float32) + \
+        (parse_array == 11).astype(np.float32) + \
+        (parse_array == 18).astype(np.float32)
+
+    parser_mask_fixed = (parse_array == label_map["hair"]).astype(np.float32) + \
+                        (parse_array == label_map["left_shoe"]).astype(np.float32) + \
+                        (parse_array == label_map["right_shoe"]).astype(np.float32) + \
+                        (parse_array == label_map["hat"]).astype(np.float32) + \
+                        (parse_array == label_map["sunglasses"]).astype(np.float32) + \
+                        (parse_array == label_map["scarf"]).astype(np.float32) + \
+                        (parse_array == label_map["bag"]).astype(np.float32)
+
+    parser_mask_changeable = (
+        parse_array == label_map["background"]).astype(np.float32)
+
+    arms = (parse_array == 14).astype(np.float32) + \
+        (parse_array == 15).astype(np.float32)
+
+    if category == 'dresses':
+        label_cat = 7
+        parse_mask = (parse_array == 7).astype(np.float32) + \
+            (parse_array == 12).astype(np.float32) + \
+            (parse_array == 13).astype(np.float32)
+        parser_mask_changeable += np.logical_and(
+            parse_array, np.logical_not(parser_mask_fixed))
+
+    elif category == 'upper_body':
+        label_cat = 4
+        parse_mask = (parse_array == 4).astype(np.float32)
+
+        parser_mask_fixed += (parse_array == label_map["skirt"]).astype(np.float32) + \
+            (parse_array == label_map["pants"]).astype(np.float32)
+
+        parser_mask_changeable += np.logical_and(
+            parse_array, np.logical_not(parser_mask_fixed))
+    elif category == 'lower_body':
+        label_cat = 6
+        parse_mask = (parse_array == 6).astype(np.float32) + \
+            (parse_array == 12).astype(np.float32) + \
+            (parse_array == 13).astype(np.float32)
+
+        parser_mask_fixed += (parse_array == label_map["upper_clothes"]).astype(np.float32) + \
+            (parse_array == 14).astype(np.float32) + \
+            (parse_array == 15).astype(np.float32)
+        parser_mask_changeable += np.logical_and(
+            parse_array, np.logical_not(parser_mask_fixed))
+
+    parse_head = torch.from_numpy(parse_head)  # [0,1]
+    parse_mask = torch.from_numpy(parse_mask)  # [0,1]
+    parser_mask_fixed = torch.from_numpy(parser_mask_fixed)
+    parser_mask_changeable = torch.from_numpy(parser_mask_changeable)
+
+    # dilation
+    parse_without_cloth = np.logical_and(
+        parse_shape, np.logical_not(parse_mask))
+    parse_mask = parse_mask.cpu().numpy()
+
+    width = size[0]
+    height = size[1]
+
+    im_arms = Image.new('L', (width, height))
+    arms_draw = ImageDraw.Draw(im_arms)
+    if category == 'dresses' or category == 'upper_body':
+        shoulder_right = tuple(np.multiply(pose_data[2, :2], height / 512.0))
+        shoulder_left = tuple(np.multiply(pose_data[5, :2], height / 512.0))
+        elbow_right = tuple(np.multiply(pose_data[3, :2], height / 512.0))
+        elbow_left = tuple(np.multiply(pose_data[6, :2], height / 512.0))
+        wrist_right = tuple(np.multiply(pose_data[4, :2], height / 512.0))
+        wrist_left = tuple(np.multiply(pose_data[7, :2], height / 512.0))
+        if wrist_right[0] <= 1. and wrist_right[1] <= 1.:
+            if elbow_right[0] <= 1. and elbow_right[1] <= 1.:
+                arms_draw.line(
+                    [wrist_left, elbow_left, shoulder_left, shoulder_right], 'white', 30, 'curve')
+            else:
+                arms_draw.line([wrist_left, elbow_left, shoulder_left, shoulder_right, elbow_right], 'white', 30,
+                               'curve')
+        elif wrist_left[0] <= 1. and wrist_left[1] <= 1.:
+            if elbow_left[0] <= 1. and elbow_left[1] <= 1.:
+                arms_draw.line([shoulder_left, shoulder_right,
+                               elbow_right, wrist_right], 'white', 30, 'curve')
+            else:
+                arms_draw.line([elbow_left, shoulder_left, shoulder_right, elbow_right, wrist_right], 'white', 30,
+                               'curve')
+        else:
+            arms_draw.line([wrist_left, elbow_left, shoulder_left, shoulder_right, elbow_right, wrist_right], 'white',
+                           30, 'curve')
+
+        if height > 512:
+            im_arms = cv2.dilate(np.float32(im_arms), np.ones(
+                (10, 10), np.uint16), iterations=5)
+        elif height > 256:
+            im_arms = cv2.dilate(np.float32(im_arms), np.ones(
+                (5, 5), np.uint16), iterations=5)
+        hands = np.logical_and(np.logical_not(im_arms), arms)
+        parse_mask += im_arms
+        parser_mask_fixed += hands
+
+    # delete neck
+    parse_head_2 = torch.clone(parse_head)
+    if category == 'dresses' or category == 'upper_body':
+        points = []
+        points.append(np.multiply(pose_data[2, :2], height / 512.0))
+        points.append(np.multiply(pose_data[5, :2], height / 512.0))
+        x_coords, y_coords = zip(*points)
+        A = np.vstack([x_coords, np.ones(len(x_coords))]).T
+        m, c = lstsq(A, y_coords, rcond=None)[0]
+        for i in range(parse_array.shape[1]):
+            y = i * m + c
+            parse_head_2[int(y - 20 * (height / 512.0)):, i] = 0
+
+    parser_mask_fixed = np.logical_or(
+        parser_mask_fixed, np.array(parse_head_2, dtype=np.uint16))
+    parse_mask += np.logical_or(parse_mask, np.logical_and(np.array(parse_head, dtype=np.uint16),
+                                                           np.logical_not(np.array(parse_head_2, dtype=np.uint16))))
+
+    if height > 512:
+        parse_mask = cv2.dilate(parse_mask, np.ones(
+            (20, 20), np.uint16), iterations=5)
+    elif height > 256:
+        parse_mask = cv2.dilate(parse_mask, np.ones(
+            (10, 10), np.uint16), iterations=5)
+    else:
+        parse_mask = cv2.dilate(parse_mask, np.ones(
+            (5, 5), np.uint16), iterations=5)
+    parse_mask = np.logical_and(
+        parser_mask_changeable, np.logical_not(parse_mask))
+    parse_mask_total = np.logical_or(parse_mask, parser_mask_fixed)
+    inpaint_mask = 1 - parse_mask_total
+    img = np.where(inpaint_mask, 255, 0)
+    img = hole_fill(img.astype(np.uint8))
+    inpaint_mask = img / 255 * 1
+    mask = Image.fromarray(inpaint_mask.astype(np.uint8) * 255)
+    return mask
+
+
+def synthetic_inputs(num_poses, width=384, height=512, seed=0):
+    """The synthetic ATR parse with a neck, and jittered keypoints in 384x512 coordinates."""
+    atr = np.array(synthetic_parsing(height, width)[2])
+    atr[int(0.18 * height):int(0.2 * height), int(0.46 * width):int(0.54 * width)] = 18
+    rng = np.random.RandomState(seed)
+    keypoints = []
+    for i in range(num_poses):
+        pose = _POSE_TEMPLATE * [width, height] + rng.normal(0, 6, _POSE_TEMPLATE.shape)
+        pose = pose * (512.0 / height)
+        if i % 4 == 1:
+            pose[4] = 0  # right wrist missing
+        elif i % 4 == 2:
+            pose[[6, 7]] = 0  # left elbow and wrist missing
+        keypoints.append({"pose_keypoints_2d": pose.tolist()})
+    return Image.fromarray(atr), keypoints
+
+
+def milliseconds(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--poses", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    parse, keypoints = synthetic_inputs(args.poses)
+    methods = {
+        "hd": (legacy_get_agnostic_mask_hd, get_agnostic_mask_hd),
+        "dc": (legacy_get_agnostic_mask_dc, get_agnostic_mask_dc),
+    }
+    rows = []
+    for method, (legacy, current) in methods.items():
+        for category in ("upper_body", "lower_body", "dresses"):
+            exact, agreement = 0, 1.0
+            for keypoint in keypoints:
+                expected = np.array(legacy(parse, keypoint, category))
+                actual = np.array(current(parse, keypoint, category))
+                exact += int(np.array_equal(expected, actual))
+                agreement = min(agreement, float((expected == actual).mean()))
+            legacy_ms = milliseconds(
+                lambda: [legacy(parse, k, category) for k in keypoints], args.repeat) / len(keypoints)
+            current_ms = milliseconds(
+                lambda: [current(parse, k, category) for k in keypoints], args.repeat) / len(keypoints)
+            batch_ms = milliseconds(
+                lambda: get_agnostic_masks([parse] * len(keypoints), keypoints, category,
+                                           method=method, num_workers=args.workers),
+                args.repeat) / len(keypoints)
+            rows.append(
+                {
+                    "method": method,
+                    "category": category,
+                    "exact": "{}/{}".format(exact, len(keypoints)),
+                    "agreement": "{:.5f}".format(agreement),
+                    "legacy_ms": "{:.2f}".format(legacy_ms),
+                    "ms": "{:.2f}".format(current_ms),
+                    "batch_ms": "{:.2f}".format(batch_ms),
+                    "speedup": "{:.2f}".format(legacy_ms / current_ms),
+                }
+            )
+            print(rows[-1], flush=True)
+
+    print()
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
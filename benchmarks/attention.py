@@ -0,0 +1,86 @@
+"""
+Peak memory and throughput of the self-attention processors on the reference-concat sequence.
+
+Builds one top-level `attn1` of the SD1.5 generative UNet (320 channels, 8 heads) and feeds it
+the doubled latent + reference sequence used at each resolution, comparing `AttnProcessor2_0`
+with `ChunkedAttnProcessor` at a few memory budgets.
+
+    python -m benchmarks.attention --device cpu --resolutions 512x384 768x576 1024x768
+"""
+import argparse
+
+import torch
+from diffusers.models.attention_processor import Attention
+
+from benchmarks.common import format_table, peak_memory_bytes, time_fn
+from leffa.model import AttnProcessor2_0, ChunkedAttnProcessor
+
+
+def build_attention(processor, channels=320, heads=8, device="cpu", dtype=torch.float32):
+    attn = Attention(
+        query_dim=channels,
+        heads=heads,
+        dim_head=channels // heads,
+        bias=False,
+        upcast_attention=False,
+        out_bias=True,
+    )
+    attn.set_processor(processor)
+    return attn.to(device=device, dtype=dtype).eval()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16", "bfloat16"])
+    parser.add_argument("--batch-size", type=int, default=2, help="2 = one image with CFG")
+    parser.add_argument("--resolutions", nargs="+", default=["512x384", "768x576", "1024x768"])
+    parser.add_argument("--budgets-mb", nargs="+", type=float, default=[64, 256, 1024])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    dtype = getattr(torch, args.dtype)
+    processors = [("sdpa", AttnProcessor2_0())]
+    processors += [
+        ("chunked@{:g}MB".format(budget), ChunkedAttnProcessor(memory_budget_mb=budget))
+        for budget in args.budgets_mb
+    ]
+
+    rows = []
+    for resolution in args.resolutions:
+        height, width = (int(x) for x in resolution.split("x"))
+        # latent tokens + the same number of reference tokens
+        tokens = 2 * (height // 8) * (width // 8)
+        hidden_states = torch.randn(
+            args.batch_size, tokens, 320, device=args.device, dtype=dtype)
+        for name, processor in processors:
+            attn = build_attention(processor, device=args.device, dtype=dtype)
+
+            def run():
+                with torch.no_grad():
+                    attn(hidden_states)
+
+            try:
+                peak = peak_memory_bytes(run, args.device)
+                seconds = time_fn(run, args.device, warmup=1, repeat=args.repeat)
+                peak_mb = "{:.0f}".format(peak / 2**20)
+                throughput = "{:.2f}".format(1.0 / seconds)
+            except (RuntimeError, MemoryError) as e:
+                peak_mb = throughput = "failed ({})".format(type(e).__name__)
+            rows.append(
+                {
+                    "resolution": resolution,
+                    "tokens": tokens,
+                    "processor": name,
+                    "peak_mb": peak_mb,
+                    "calls/s": throughput,
+                }
+            )
+            print(rows[-1], flush=True)
+
+    print()
+    print(format_table(rows, ["resolution", "tokens", "processor", "peak_mb", "calls/s"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import multiprocessing
+import resource
+import time
+
+import torch
+
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def time_fn(fn, device="cpu", warmup=1, repeat=3):
+    """Return the mean wall time of `fn()` in seconds after `warmup` untimed calls."""
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    synchronize(device)
+    return (time.perf_counter() - start) / repeat
+
+
+def _current_rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def _peak_rss_child(fn, conn):
+    try:
+        baseline = _current_rss_bytes()
+        fn()
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        conn.send(max(peak - baseline, 0))
+    except BaseException as e:  # report failures (e.g. OOM) to the parent
+        conn.send(e)
+    finally:
+        conn.close()
+
+
+def peak_memory_bytes(fn, device="cpu"):
+    """
+    Peak memory allocated while running `fn()`.
+
+    On CUDA this is the allocator high-water mark. On CPU `fn` runs in a forked child and the
+    growth of its resident set size over the pre-call RSS is reported, so the parent's own
+    high-water mark does not hide smaller runs.
+    """
+    if torch.device(device).type == "cuda":
+        synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        before = torch.cuda.memory_allocated(device)
+        fn()
+        synchronize(device)
+        return torch.cuda.max_memory_allocated(device) - before
+
+    ctx = multiprocessing.get_context("fork")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_peak_rss_child, args=(fn, child_conn))
+    process.start()
+    child_conn.close()
+    result = parent_conn.recv()
+    process.join()
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def format_table(rows, columns):
+    widths = [
+        max(len(str(column)), *(len(str(row[column])) for row in rows))
+        for column in columns
+    ]
+    lines = ["  ".join(str(c).ljust(w) for c, w in zip(columns, widths))]
+    for row in rows:
+        lines.append("  ".join(str(row[c]).ljust(w) for c, w in zip(columns, widths)))
+    return "\n".join(lines)
@@ -0,0 +1,93 @@
+"""
+Compile time and steady-state step latency of the compiled denoising loop.
+
+Builds `LeffaPipeline` twice on the same model, eager and with `enable_compile`, warms every batch
+bucket and then times `--steps` denoising steps per bucket. A second run with the same
+`--cache-dir` shows the warm-start compile time from the on-disk cache.
+
+    python -m benchmarks.compiled_pipeline --device cpu --buckets 1 2 --steps 4
+"""
+import argparse
+import time
+
+import torch
+
+from benchmarks.common import synchronize
+from leffa.model import LeffaModel
+from leffa.pipeline import LeffaPipeline
+
+
+def step_latency(pipeline, batch_size, height, width, steps, device, ref_acceleration):
+    inputs = dict(
+        src_image=torch.rand(batch_size, 3, height, width) * 2 - 1,
+        ref_image=torch.rand(batch_size, 3, height, width) * 2 - 1,
+        mask=torch.ones(batch_size, 1, height, width),
+        densepose=torch.rand(batch_size, 3, height, width) * 2 - 1,
+        ref_acceleration=ref_acceleration,
+    )
+    # the difference between an N-step and a 1-step call isolates the per-step cost
+    synchronize(device)
+    start = time.perf_counter()
+    pipeline(num_inference_steps=1, **inputs)
+    synchronize(device)
+    single = time.perf_counter() - start
+    start = time.perf_counter()
+    pipeline(num_inference_steps=steps + 1, **inputs)
+    synchronize(device)
+    return (time.perf_counter() - start - single) / steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--pretrained-model-name-or-path", default="./ckpts/stable-diffusion-inpainting"
+    )
+    parser.add_argument("--pretrained-model", default="./ckpts/virtual_tryon.pth")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--width", type=int, default=768)
+    parser.add_argument("--buckets", nargs="+", type=int, default=[1])
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--cache-dir", default="./ckpts/inductor_cache")
+    parser.add_argument("--mode", default=None, help="torch.compile mode")
+    parser.add_argument("--ref-acceleration", action="store_true")
+    args = parser.parse_args()
+
+    model = LeffaModel(
+        pretrained_model_name_or_path=args.pretrained_model_name_or_path,
+        pretrained_model=args.pretrained_model,
+        height=args.height,
+        width=args.width,
+        dtype="float16" if args.device == "cuda" else "float32",
+    ).to(args.device).eval()
+
+    eager = LeffaPipeline(model, device=args.device)
+    compiled = LeffaPipeline(model, device=args.device)
+    compiled.enable_compile(
+        batch_buckets=args.buckets, cache_dir=args.cache_dir, mode=args.mode)
+    compile_seconds = compiled.warmup(
+        args.height, args.width, ref_acceleration=args.ref_acceleration)
+
+    for batch_size in args.buckets:
+        eager_step = step_latency(
+            eager, batch_size, args.height, args.width, args.steps, args.device,
+            args.ref_acceleration,
+        )
+        compiled_step = step_latency(
+            compiled, batch_size, args.height, args.width, args.steps, args.device,
+            args.ref_acceleration,
+        )
+        print(
+            "batch {}: compile+warmup {:.1f}s, eager {:.3f}s/step, compiled {:.3f}s/step "
+            "({:.2f}x)".format(
+                batch_size,
+                compile_seconds[batch_size],
+                eager_step,
+                compiled_step,
+                eager_step / compiled_step,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
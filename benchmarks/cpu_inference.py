@@ -0,0 +1,121 @@
+"""
+Accuracy and throughput of the CPU inference mode against the fp32 baseline.
+
+Runs the same try-on twice on CPU: once with the plain float32 `LeffaModel` and once after
+`leffa.cpu_inference.optimize_for_cpu` (int8 dynamic quantization, channels_last, bf16 autocast
+where supported). Reports seconds per denoising step and SSIM (and LPIPS, if the `lpips`
+package is installed) of the optimized result against the fp32 one.
+
+    python -m benchmarks.cpu_inference --steps 10
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from leffa.cpu_inference import optimize_for_cpu
+from leffa.inference import LeffaInference
+from leffa.model import LeffaModel
+from leffa.transform import LeffaTransform
+from leffa_utils.utils import resize_and_center
+
+
+def ssim(image_a, image_b):
+    from skimage.metrics import structural_similarity
+
+    return structural_similarity(
+        np.asarray(image_a), np.asarray(image_b), channel_axis=2, data_range=255
+    )
+
+
+def lpips_distance(image_a, image_b):
+    try:
+        import lpips
+    except ImportError:
+        return None
+
+    def to_tensor(image):
+        array = np.asarray(image).astype(np.float32) / 127.5 - 1.0
+        return torch.from_numpy(array).permute(2, 0, 1)[None]
+
+    with torch.no_grad():
+        return lpips.LPIPS(net="alex", verbose=False)(
+            to_tensor(image_a), to_tensor(image_b)
+        ).item()
+
+
+def run(args, optimize):
+    model = LeffaModel(
+        pretrained_model_name_or_path=args.pretrained_model_name_or_path,
+        pretrained_model=args.pretrained_model,
+        dtype="float32",
+    )
+    autocast_dtype = None
+    if optimize:
+        autocast_dtype = optimize_for_cpu(
+            model, quantize=not args.no_quantize, bf16=args.bf16, num_threads=args.threads
+        )
+    elif args.threads:
+        torch.set_num_threads(args.threads)
+    inference = LeffaInference(model=model, autocast_dtype=autocast_dtype)
+
+    human = resize_and_center(Image.open(args.human), 768, 1024)
+    garment = resize_and_center(Image.open(args.garment), 768, 1024)
+    data = LeffaTransform()(
+        {
+            "src_image": [human],
+            "ref_image": [garment],
+            "mask": [Image.fromarray(np.ones_like(np.array(human)) * 255)],
+            "densepose": [Image.fromarray(np.ones_like(np.array(human)))],
+        }
+    )
+    start = time.perf_counter()
+    output = inference(
+        data,
+        num_inference_steps=args.steps,
+        guidance_scale=2.5,
+        seed=args.seed,
+        ref_acceleration=args.ref_acceleration,
+    )
+    seconds = time.perf_counter() - start
+    return output["generated_image"][0], seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--pretrained-model-name-or-path", default="./ckpts/stable-diffusion-inpainting"
+    )
+    parser.add_argument("--pretrained-model", default="./ckpts/virtual_tryon.pth")
+    parser.add_argument("--human", default="./human.jpg")
+    parser.add_argument("--garment", default="./garment.jpg")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--ref-acceleration", action="store_true")
+    parser.add_argument("--no-quantize", action="store_true")
+    parser.add_argument(
+        "--bf16", type=lambda x: x.lower() in ("1", "true", "yes"), default=None,
+        help="force bf16 autocast on/off (default: auto-detect)",
+    )
+    args = parser.parse_args()
+
+    baseline, baseline_seconds = run(args, optimize=False)
+    optimized, optimized_seconds = run(args, optimize=True)
+
+    print("fp32      : {:.2f}s total, {:.2f}s/step".format(
+        baseline_seconds, baseline_seconds / args.steps))
+    print("optimized : {:.2f}s total, {:.2f}s/step ({:.2f}x)".format(
+        optimized_seconds, optimized_seconds / args.steps, baseline_seconds / optimized_seconds))
+    print("SSIM vs fp32 : {:.4f}".format(ssim(baseline, optimized)))
+    distance = lpips_distance(baseline, optimized)
+    if distance is not None:
+        print("LPIPS vs fp32: {:.4f}".format(distance))
+    else:
+        print("LPIPS vs fp32: skipped (pip install lpips)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Latency of the single-person DensePose mode against the full multi-person path.
+
+Runs `DensePosePredictor.predict_iuv` on a synthetic image once as before (all detections through
+the DensePose head and `DensePoseResultExtractor`) and with `single_person=True` for a few RPN
+proposal caps. Without `--weights` the R50-FPN network gets random weights and a box classifier
+biased towards "person", so every proposal survives as a detection like on a crowded image; the
+labels are then meaningless but the cost of each stage is realistic. Agreement is the fraction of
+pixels of the IUV image equal to the full path's.
+
+    python -m benchmarks.densepose --proposals 1000 100 20
+"""
+import argparse
+import os
+
+import numpy as np
+import torch
+
+from benchmarks.common import format_table, time_fn
+
+DEFAULT_CONFIG = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    "preprocess", "humanparsing", "mhp_extension", "detectron2", "projects", "DensePose",
+    "configs", "densepose_rcnn_R_50_FPN_s1x.yaml",
+)
+
+
+def build_predictor(config, weights, seed, **kwargs):
+    from leffa_utils.densepose_predictor import DensePosePredictor
+
+    torch.manual_seed(seed)
+    predictor = DensePosePredictor(config_path=config, weights_path=weights, **kwargs)
+    if not weights:
+        box_predictor = predictor.predictor.model.roi_heads.box_predictor
+        with torch.no_grad():
+            box_predictor.cls_score.weight.mul_(0.01)
+            box_predictor.cls_score.bias.zero_()
+            box_predictor.cls_score.bias[0] = 5.0
+            box_predictor.bbox_pred.weight.zero_()
+            box_predictor.bbox_pred.bias.zero_()
+    return predictor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--weights", default="", help="checkpoint; random weights if empty")
+    parser.add_argument("--proposals", nargs="+", type=int, default=[1000, 100])
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--width", type=int, default=768)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    image = np.random.RandomState(0).randint(
+        0, 256, (args.height, args.width, 3), dtype=np.uint8)
+
+    full = build_predictor(args.config, args.weights, seed=0)
+    with torch.no_grad():
+        detections = len(full.predictor(image)["instances"])
+    expected = full.predict_iuv(image)
+    full_seconds = time_fn(lambda: full.predict_iuv(image), repeat=args.repeat)
+    rows = [
+        {
+            "path": "full",
+            "proposals": full.predictor.cfg.MODEL.RPN.POST_NMS_TOPK_TEST,
+            "detections": detections,
+            "ms": "{:.0f}".format(full_seconds * 1000),
+            "speedup": "1.00",
+            "agreement": "1.000",
+        }
+    ]
+    print(rows[-1], flush=True)
+    for max_proposals in args.proposals:
+        single = build_predictor(
+            args.config, args.weights, seed=0, single_person=True, max_proposals=max_proposals)
+        iuv = single.predict_iuv(image)
+        seconds = time_fn(lambda: single.predict_iuv(image), repeat=args.repeat)
+        rows.append(
+            {
+                "path": "single_person",
+                "proposals": single.predictor.cfg.MODEL.RPN.POST_NMS_TOPK_TEST,
+                "detections": 1,
+                "ms": "{:.0f}".format(seconds * 1000),
+                "speedup": "{:.2f}".format(full_seconds / seconds),
+                "agreement": "{:.3f}".format((iuv == expected).mean()),
+            }
+        )
+        print(rows[-1], flush=True)
+
+    print()
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Latency of `BatchedPredictor` against per-image `DefaultPredictor` calls on the DensePose model.
+
+Both run the same single-person DensePose R50-FPN model (random weights unless `--weights`, see
+`benchmarks.densepose`) on `--images` random images: `DefaultPredictor.__call__` resizes each
+image with PIL and runs one forward per image, `predict_batch` uploads the batch, resizes on the
+device and runs one forward per `--batch-size` images. Agreement is the fraction of images with
+the same top detection box (within a pixel) and the fraction of equal part labels inside it.
+
+    python -m benchmarks.densepose_batch --images 8 --batch-size 4
+"""
+import argparse
+
+import numpy as np
+import torch
+from detectron2.engine.defaults import DefaultPredictor
+
+from benchmarks.common import format_table, time_fn
+from benchmarks.densepose import DEFAULT_CONFIG, build_predictor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--weights", default="", help="checkpoint; random weights if empty")
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--batch-size", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--width", type=int, default=768)
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    from leffa_utils.densepose_single_person import top_person_chart
+
+    rng = np.random.RandomState(0)
+    images = [
+        rng.randint(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+        for _ in range(args.images)
+    ]
+    predictor = build_predictor(
+        args.config, args.weights, seed=0, single_person=True).predictor
+
+    def per_image():
+        with torch.no_grad():
+            return [DefaultPredictor.__call__(predictor, image) for image in images]
+
+    expected = [top_person_chart(p["instances"], with_uv=False) for p in per_image()]
+    baseline = time_fn(per_image, repeat=args.repeat)
+    rows = [{"path": "DefaultPredictor", "batch_size": 1,
+             "ms_per_image": "{:.0f}".format(baseline * 1000 / args.images),
+             "speedup": "1.00", "same_box": "-", "label_agreement": "-"}]
+    print(rows[-1], flush=True)
+    for batch_size in args.batch_size:
+        charts = [
+            top_person_chart(p["instances"], with_uv=False)
+            for p in predictor.predict_batch(images, batch_size)
+        ]
+        same_box, agreement = 0, []
+        for chart, reference in zip(charts, expected):
+            if chart is None or reference is None:
+                same_box += chart is reference
+                continue
+            if np.abs(np.subtract(chart[2], reference[2])).max() <= 1:
+                same_box += 1
+                if chart[0].shape == reference[0].shape:
+                    agreement.append((chart[0] == reference[0]).float().mean().item())
+        seconds = time_fn(lambda: predictor.predict_batch(images, batch_size), repeat=args.repeat)
+        rows.append(
+            {
+                "path": "BatchedPredictor",
+                "batch_size": batch_size,
+                "ms_per_image": "{:.0f}".format(seconds * 1000 / args.images),
+                "speedup": "{:.2f}".format(baseline / seconds),
+                "same_box": "{}/{}".format(same_box, args.images),
+                "label_agreement": "{:.4f}".format(np.mean(agreement)) if agreement else "nan",
+            }
+        )
+        print(rows[-1], flush=True)
+
+    print()
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
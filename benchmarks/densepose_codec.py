@@ -0,0 +1,90 @@
+"""
+Size and encode/decode throughput of DensePose quantized result codecs.
+
+Compares the base64 PNG of `compress_quantized_densepose_chart_result` against the binary
+container of `encode_quantized_densepose_chart_result` with each available codec. The input is
+a synthetic [3, H, W] result shaped like a person chart: background outside an ellipse, blocky
+part labels and smooth U/V ramps inside it. `MB/s` is over the raw CHW size.
+
+    python -m benchmarks.densepose_codec --height 1024 --width 768
+"""
+import argparse
+import importlib.util
+
+import numpy as np
+import torch
+
+from benchmarks.common import format_table, time_fn
+
+from densepose.structures.chart_result import (  # isort: skip
+    DensePoseChartResultQuantized,
+    compress_quantized_densepose_chart_result,
+    decode_quantized_densepose_chart_result,
+    decompress_compressed_densepose_chart_result,
+    encode_quantized_densepose_chart_result,
+)
+
+OPTIONAL_CODECS = {"zstd": "zstandard", "lz4": "lz4"}
+
+
+def synthetic_result(height, width, seed=0):
+    rng = np.random.RandomState(seed)
+    ys, xs = np.mgrid[0:height, 0:width]
+    person = ((ys / height - 0.5) / 0.48) ** 2 + ((xs / width - 0.5) / 0.3) ** 2 < 1
+    blocks = rng.randint(1, 25, (height // 64 + 1, width // 64 + 1))
+    labels = blocks[ys // 64, xs // 64] * person
+    u = (xs % 64) * 4 * person
+    v = (ys % 64) * 4 * person
+    labels_uv = np.stack([labels, u, v]).astype(np.uint8)
+    return DensePoseChartResultQuantized(labels_uv_uint8=torch.from_numpy(labels_uv))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--width", type=int, default=768)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    result = synthetic_result(args.height, args.width)
+    raw_megabytes = result.labels_uv_uint8.numel() / 1e6
+    expected = result.labels_uv_uint8
+
+    formats = [("png+base64", None)] + [
+        (codec, codec)
+        for codec in ("raw", "png", "zlib", "bz2", "lzma", "zstd", "lz4")
+        if codec not in OPTIONAL_CODECS
+        or importlib.util.find_spec(OPTIONAL_CODECS[codec]) is not None
+    ]
+    rows = []
+    for name, codec in formats:
+        if codec is None:
+            encode = lambda: compress_quantized_densepose_chart_result(result)  # noqa: E731
+            decode = decompress_compressed_densepose_chart_result
+            size = len(encode().labels_uv_str)
+        else:
+            encode = lambda: encode_quantized_densepose_chart_result(result, codec)  # noqa: E731
+            decode = decode_quantized_densepose_chart_result
+            size = len(encode())
+        encoded = encode()
+        exact = torch.equal(decode(encoded).labels_uv_uint8, expected)
+        encode_seconds = time_fn(encode, repeat=args.repeat)
+        decode_seconds = time_fn(lambda: decode(encoded), repeat=args.repeat)
+        rows.append(
+            {
+                "format": name,
+                "bytes": size,
+                "ratio": "{:.1f}".format(raw_megabytes * 1e6 / size),
+                "exact": exact,
+                "encode_MB_s": "{:.0f}".format(raw_megabytes / encode_seconds),
+                "decode_MB_s": "{:.0f}".format(raw_megabytes / decode_seconds),
+            }
+        )
+        print(rows[-1], flush=True)
+
+    print()
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Latency and parity of `DensePosePredictor.predict_all` against separate `predict_iuv` and
+`predict_seg` calls.
+
+The previous `predict_iuv` / `predict_seg` are reproduced below (`legacy_*`): each ran the model
+and the generic extractor, and segmentation went through the `Visualizer` canvas. `predict_all`
+runs the model once and derives the IUV image, the segmentation and the part-label map from the
+same chart results. Random weights unless `--weights` (see `benchmarks.densepose`); `exact` is
+whether both outputs are bit-identical.
+
+    python -m benchmarks.densepose_outputs --height 512 --width 384
+"""
+import argparse
+
+import numpy as np
+import torch
+from densepose.vis.densepose_results import DensePoseResultsFineSegmentationVisualizer
+
+from benchmarks.common import format_table, time_fn
+from benchmarks.densepose import DEFAULT_CONFIG, build_predictor
+
+
+def legacy_iuv(predictor, image):
+    outputs = predictor.predict(image)
+    position = [int(x) for x in outputs[1][0].cpu().numpy().tolist()]
+    labels, uv = outputs[0][0].labels, outputs[0][0].uv
+
+    img_i = labels[None, ...]
+    img_uv = uv
+    img_uv = (img_uv - img_uv.min()) / (img_uv.max() - img_uv.min())
+    img_uv *= 255
+    img_iuv = torch.cat([img_i, img_uv], dim=0)
+    img_iuv = img_iuv.permute(1, 2, 0)
+    img_iuv = img_iuv.cpu().numpy()
+
+    x1, y1, w, h = position
+    x2 = x1 + w
+    y2 = y1 + h
+    image_iuv = np.zeros(image.shape, dtype=image.dtype)
+    image_iuv[y1:y2, x1:x2, :] = img_iuv
+    image_iuv = image_iuv[:, :, [0, 2, 1]]
+    return image_iuv
+
+
+def legacy_seg(predictor, image):
+    outputs = predictor.predict(image)
+    image_seg = np.zeros(image.shape, dtype=image.dtype)
+    DensePoseResultsFineSegmentationVisualizer().visualize(image_seg, outputs)
+    return image_seg
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--weights", default="", help="checkpoint; random weights if empty")
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--width", type=int, default=768)
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    image = np.random.RandomState(0).randint(
+        0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    rows = []
+    for single_person in (False, True):
+        predictor = build_predictor(
+            args.config, args.weights, seed=0, single_person=single_person, max_proposals=100)
+        with torch.no_grad():
+            detections = len(predictor.predictor(image)["instances"])
+        outputs = predictor.predict_all(image)
+        exact = (
+            np.array_equal(outputs.iuv, legacy_iuv(predictor, image))
+            and np.array_equal(outputs.seg, legacy_seg(predictor, image))
+        )
+        legacy_seconds = time_fn(
+            lambda: (legacy_iuv(predictor, image), legacy_seg(predictor, image)),
+            repeat=args.repeat,
+        )
+        seconds = time_fn(lambda: predictor.predict_all(image), repeat=args.repeat)
+        rows.append(
+            {
+                "single_person": single_person,
+                "detections": detections,
+                "exact": exact,
+                "legacy_ms": "{:.0f}".format(legacy_seconds * 1000),
+                "predict_all_ms": "{:.0f}".format(seconds * 1000),
+                "speedup": "{:.2f}".format(legacy_seconds / seconds),
+            }
+        )
+        print(rows[-1], flush=True)
+
+    print()
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Microbenchmark of DensePose U/V and confidence resampling to the box, per box size.
+
+`legacy_*` are the previous implementations, which upsample all 25 part channels and then assign
+each part through two boolean masks. The current ones select each pixel's part channel with one
+gather (bit-identical), or with `upsample_selected=True` interpolate only that channel (equal up
+to float rounding; `max_abs_diff`). Inputs are random head outputs at the 112x112 DensePose head
+resolution with random labels.
+
+    python -m benchmarks.densepose_uv_resample --sizes 64 256 512 1024
+"""
+import argparse
+
+import torch
+from torch.nn import functional as F
+
+from benchmarks.common import format_table, time_fn
+
+from densepose.converters.chart_output_to_chart_result import (  # isort: skip
+    resample_confidences_to_bbox,
+    resample_uv_tensors_to_bbox,
+)
+from densepose.structures import (  # isort: skip
+    DensePoseChartPredictorOutput,
+    decorate_predictor_output_class_with_confidences,
+)
+
+
+def legacy_resample_uv_tensors_to_bbox(u, v, labels, box_xywh_abs):
+    x, y, w, h = box_xywh_abs
+    w = max(int(w), 1)
+    h = max(int(h), 1)
+    u_bbox = F.interpolate(u, (h, w), mode="bilinear", align_corners=False)
+    v_bbox = F.interpolate(v, (h, w), mode="bilinear", align_corners=False)
+    uv = torch.zeros([2, h, w], dtype=torch.float32, device=u.device)
+    for part_id in range(1, u_bbox.size(1)):
+        uv[0][labels == part_id] = u_bbox[0, part_id][labels == part_id]
+        uv[1][labels == part_id] = v_bbox[0, part_id][labels == part_id]
+    return uv
+
+
+def legacy_resample_confidences_to_bbox(predictor_output, labels, box_xywh_abs, names):
+    x, y, w, h = box_xywh_abs
+    w = max(int(w), 1)
+    h = max(int(h), 1)
+    confidence_base = torch.zeros([h, w], dtype=torch.float32, device=predictor_output.u.device)
+    results = {}
+    for key in names:
+        resampled_confidence = F.interpolate(
+            getattr(predictor_output, key), (h, w), mode="bilinear", align_corners=False)
+        result = confidence_base.clone()
+        for part_id in range(1, predictor_output.u.size(1)):
+            if resampled_confidence.size(1) != predictor_output.u.size(1):
+                continue
+            result[labels == part_id] = resampled_confidence[0, part_id][labels == part_id]
+        if resampled_confidence.size(1) != predictor_output.u.size(1):
+            result = resampled_confidence[0, 0]
+        results[key] = result
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[64, 256, 512, 1024],
+                        help="box heights; widths are 3/4 of them")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    generator = torch.Generator().manual_seed(0)
+
+    def head_output(channels):
+        return torch.randn(1, channels, 112, 112, generator=generator).to(args.device)
+
+    # a part-based and a single-channel confidence, as in the confidence-aware heads
+    output = decorate_predictor_output_class_with_confidences(DensePoseChartPredictorOutput)(
+        coarse_segm=head_output(2), fine_segm=head_output(25), u=head_output(25),
+        v=head_output(25), sigma_2=head_output(25), fine_segm_confidence=head_output(1),
+    )
+    names = ["sigma_2", "fine_segm_confidence"]
+
+    rows = []
+    for height in args.sizes:
+        box = (0, 0, height * 3 // 4, height)
+        labels = torch.randint(0, 25, (height, height * 3 // 4), generator=generator).to(
+            args.device)
+
+        def legacy():
+            return (
+                legacy_resample_uv_tensors_to_bbox(output.u, output.v, labels, box),
+                legacy_resample_confidences_to_bbox(output, labels, box, names),
+            )
+
+        def gather(upsample_selected=False):
+            confidences = resample_confidences_to_bbox(output, labels, box, upsample_selected)
+            return (
+                resample_uv_tensors_to_bbox(output.u, output.v, labels, box, upsample_selected),
+                {key: confidences[key] for key in names},
+            )
+
+        expected_uv, expected_confidences = legacy()
+        uv, confidences = gather()
+        selected_uv, selected_confidences = gather(upsample_selected=True)
+        exact = torch.equal(uv, expected_uv) and all(
+            torch.equal(confidences[key], expected_confidences[key]) for key in names)
+        max_abs_diff = max(
+            [(selected_uv - expected_uv).abs().max().item()]
+            + [(selected_confidences[key] - expected_confidences[key]).abs().max().item()
+               for key in names]
+        )
+        legacy_seconds = time_fn(legacy, args.device, repeat=args.repeat)
+        gather_seconds = time_fn(gather, args.device, repeat=args.repeat)
+        selected_seconds = time_fn(
+            lambda: gather(upsample_selected=True), args.device, repeat=args.repeat)
+        rows.append(
+            {
+                "box": "{}x{}".format(height * 3 // 4, height),
+                "exact": exact,
+                "legacy_ms": "{:.2f}".format(legacy_seconds * 1000),
+                "gather_ms": "{:.2f}".format(gather_seconds * 1000),
+                "speedup": "{:.1f}".format(legacy_seconds / gather_seconds),
+                "selected_ms": "{:.2f}".format(selected_seconds * 1000),
+                "selected_speedup": "{:.1f}".format(legacy_seconds / selected_seconds),
+                "max_abs_diff": "{:.1e}".format(max_abs_diff),
+            }
+        )
+        print(rows[-1], flush=True)
+
+    print()
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
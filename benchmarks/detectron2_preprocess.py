@@ -0,0 +1,87 @@
+"""
+Latency and parity of detectron2 inference preprocessing: resize, normalize and pad.
+
+Three paths turn `--images` uint8 images into the padded, normalized batch the DensePose R50-FPN
+backbone sees:
+
+- `pil`: `DefaultPredictor`'s `ResizeShortestEdge` (PIL) per image, then
+  `GeneralizedRCNN.preprocess_image`;
+- `tensor`: `BatchedPredictor.resize` per image on the device, then `preprocess_image`;
+- `fused`: `BatchedPredictor.preprocess`, one resize call for equally sized images and one
+  in-place normalization of the padded batch.
+
+`max_diff` is the largest difference from `pil` in uint8 gray levels (resize rounding),
+`agreement` the fraction of values equal to `pil`'s and `exact` whether the batch equals
+`tensor`'s. On CPU the resize runs Pillow's uint8 kernel, on CUDA a float one rounded to uint8.
+
+    python -m benchmarks.detectron2_preprocess --images 4 --device cuda
+"""
+import argparse
+
+import numpy as np
+import torch
+
+from benchmarks.common import format_table, time_fn
+from benchmarks.densepose import DEFAULT_CONFIG, build_predictor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--images", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--width", type=int, default=768)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    predictor = build_predictor(args.config, "", seed=0, single_person=True).predictor
+    predictor.model.to(args.device)
+    model = predictor.model
+    rng = np.random.RandomState(0)
+
+    def pil(images):
+        inputs = []
+        for image in images:
+            image = predictor.aug.get_transform(image).apply_image(image)
+            inputs.append({"image": torch.as_tensor(image.astype("float32").transpose(2, 0, 1))})
+        return model.preprocess_image(inputs).tensor
+
+    def tensor(images):
+        inputs = [{"image": predictor.resize(image)} for image in predictor.upload(images)]
+        return model.preprocess_image(inputs).tensor
+
+    def fused(images):
+        return predictor.preprocess(images).tensor
+
+    rows = []
+    with torch.no_grad():
+        for num_images in args.images:
+            images = [
+                rng.randint(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+                for _ in range(num_images)
+            ]
+            reference, expected = pil(images), tensor(images)
+            std = model.pixel_std.max().item()
+            for name, fn in (("pil", pil), ("tensor", tensor), ("fused", fused)):
+                batch = fn(images)
+                difference = (batch - reference).abs() * std
+                seconds = time_fn(lambda: fn(images), args.device, repeat=args.repeat)
+                rows.append(
+                    {
+                        "images": num_images,
+                        "path": name,
+                        "ms": "{:.1f}".format(seconds * 1000),
+                        "max_diff": "{:.0f}".format(difference.max().item()),
+                        "agreement": "{:.4f}".format((difference < 0.5).float().mean().item()),
+                        "exact": torch.equal(batch, expected),
+                    }
+                )
+                print(rows[-1], flush=True)
+
+    print()
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
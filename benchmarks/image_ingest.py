@@ -0,0 +1,100 @@
+"""
+Decode latency and peak memory of `leffa_utils.ingest` against a full decode on large photos.
+
+Synthetic photos of `--megapixels` (4:3, smooth content with noise, rotated by EXIF orientation
+6 as phone cameras write them) are encoded as JPEG and PNG. `full` opens the bytes, decodes
+them in full, applies the orientation and calls `resize_and_center(..., 768, 1024)`; `ingest`
+is `leffa_utils.ingest.ingest`. `peak_mb` is the resident set growth of one call in a forked
+child (see `benchmarks.common.peak_memory_bytes`). `psnr` compares the 768x1024 result with a
+Lanczos downscale of the full decode; `full`'s bicubic OpenCV resize aliases at these ratios,
+so `ingest` is usually the closer of the two.
+
+    python -m benchmarks.image_ingest --megapixels 12 24 48
+"""
+import argparse
+import ctypes
+import io
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from benchmarks.common import format_table, peak_memory_bytes, time_fn
+from leffa_utils.ingest import ingest
+from leffa_utils.utils import resize_and_center
+
+
+def synthetic_photo(megapixels, fmt, seed=0):
+    rng = np.random.RandomState(seed)
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    small = Image.fromarray(rng.randint(0, 256, (height // 64, width // 64, 3), dtype=np.uint8))
+    image = np.asarray(small.resize((width, height), Image.BICUBIC), dtype=np.int16)
+    image = np.clip(image + rng.randint(-8, 9, image.shape[:2], dtype=np.int16)[..., None], 0, 255)
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buffer = io.BytesIO()
+    Image.fromarray(image.astype(np.uint8)).save(buffer, fmt, quality=90, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def full(data):
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    return resize_and_center(image, 768, 1024)
+
+
+def lanczos(data):
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    scale = min(768 / image.width, 1024 / image.height)
+    width, height = int(image.width * scale), int(image.height * scale)
+    canvas = Image.new("RGB", (768, 1024), (255, 255, 255))
+    offset = ((768 - width) // 2, (1024 - height) // 2)
+    canvas.paste(image.resize((width, height), Image.LANCZOS), offset)
+    return canvas
+
+
+def peak_mb(fn):
+    # hand the heap freed by earlier runs back to the OS, or the child reuses it unmeasured
+    ctypes.CDLL("libc.so.6").malloc_trim(0)
+    return peak_memory_bytes(fn) / 2 ** 20
+
+
+def psnr(a, b):
+    mse = np.mean((np.asarray(a, np.float64) - np.asarray(b, np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--megapixels", nargs="+", type=float, default=[12, 24, 48])
+    parser.add_argument("--formats", nargs="+", default=["JPEG", "PNG"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = []
+    for fmt in args.formats:
+        for megapixels in args.megapixels:
+            data = synthetic_photo(megapixels, fmt)
+            reference = lanczos(data)
+            baseline = None
+            for name, fn in (("full", full), ("ingest", ingest)):
+                seconds = time_fn(lambda: fn(data), repeat=args.repeat)
+                baseline = baseline or seconds
+                rows.append(
+                    {
+                        "format": fmt,
+                        "megapixels": megapixels,
+                        "path": name,
+                        "ms": "{:.1f}".format(seconds * 1000),
+                        "speedup": "{:.2f}".format(baseline / seconds),
+                        "peak_mb": "{:.0f}".format(peak_mb(lambda: fn(data))),
+                        "psnr": "{:.1f}".format(psnr(fn(data), reference)),
+                    }
+                )
+                print(rows[-1], flush=True)
+
+    print()
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Parity and CPU throughput of the ONNX Runtime mask preprocessors against eager PyTorch.
+
+Exports random-weight SCHP-ATR, SCHP-LIP and DensePose R50-FPN models (see
+`benchmarks.densepose` for how the DensePose classifier is biased to produce detections) with
+`leffa_utils.onnx_export`, then runs the same images through both backends. Parity is the
+largest output difference relative to the largest output magnitude, and the fraction of equal
+labels; throughput is images/s with the PyTorch model called from one thread and with a
+`SessionPool` of `--pool-size` sessions serving as many threads.
+
+    python -m benchmarks.onnx_backend --images 8 --pool-size 1 2
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from benchmarks.common import format_table
+from benchmarks.densepose import DEFAULT_CONFIG, build_predictor
+from benchmarks.synthetic import synthetic_images
+
+
+def random_schp(dataset_type, seed=0):
+    from SCHP import SCHP, networks  # type: ignore
+
+    torch.manual_seed(seed)
+    schp = SCHP.__new__(SCHP)
+    schp.device = "cpu"
+    schp.setup_dataset(dataset_type)
+    schp.model = networks.init_model("resnet101", num_classes=schp.num_classes, pretrained=None)
+    schp.model.eval()
+    return schp
+
+
+def relative_difference(actual, expected):
+    return float(np.abs(actual - expected).max() / np.abs(expected).max())
+
+
+def images_per_second(fn, images, threads):
+    start = time.perf_counter()
+    if threads == 1:
+        for image in images:
+            fn(image)
+    else:
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(fn, images))
+    return len(images) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="DensePose config")
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--pool-size", nargs="+", type=int, default=[1, 2])
+    args = parser.parse_args()
+
+    from leffa_utils.densepose_single_person import top_person_chart
+    from leffa_utils.onnx_export import export_densepose, export_schp, schp_onnx_name
+    from leffa_utils.onnx_runtime import DensePoseOnnxPredictor, SCHPOnnx
+
+    human = synthetic_images()[0]
+    images = [human] * args.images
+    bgr = np.asarray(human)[:, :, ::-1]
+    rows = []
+    with tempfile.TemporaryDirectory() as root:
+        for dataset_type in ("atr", "lip"):
+            schp = random_schp(dataset_type)
+            path = export_schp(schp, os.path.join(root, schp_onnx_name(dataset_type)))
+            image, _ = schp.preprocess(human)
+            with torch.no_grad():
+                expected = schp.forward(image)
+                torch_ips = images_per_second(schp, images, 1)
+            for pool_size in args.pool_size:
+                onnx_schp = SCHPOnnx(path, pool_size=pool_size)
+                logits = onnx_schp.forward(image)
+                rows.append(
+                    {
+                        "model": "schp_" + dataset_type,
+                        "pool_size": pool_size,
+                        "max_rel_diff": "{:.1e}".format(relative_difference(logits, expected)),
+                        "label_agreement": "{:.4f}".format(
+                            (logits.argmax(-1) == expected.argmax(-1)).mean()),
+                        "torch_img_s": "{:.2f}".format(torch_ips),
+                        "onnx_img_s": "{:.2f}".format(
+                            images_per_second(onnx_schp, images, pool_size)),
+                    }
+                )
+                print(rows[-1], flush=True)
+
+        predictor = build_predictor(args.config, "", seed=0).predictor
+        path = export_densepose(predictor.model, os.path.join(root, "densepose.onnx"))
+        expected = predictor(bgr)["instances"]
+        expected_chart = top_person_chart(expected, with_uv=False)
+        torch_ips = images_per_second(lambda image: predictor(image), [bgr] * args.images, 1)
+        for pool_size in args.pool_size:
+            onnx_predictor = DensePoseOnnxPredictor(predictor.cfg, path, pool_size=pool_size)
+            instances = onnx_predictor(bgr)["instances"]
+            chart = top_person_chart(instances, with_uv=False)
+            agreement = float("nan")
+            if chart is not None and expected_chart is not None and chart[2] == expected_chart[2]:
+                agreement = (chart[0] == expected_chart[0]).float().mean().item()
+            rows.append(
+                {
+                    "model": "densepose ({} vs {} det)".format(len(instances), len(expected)),
+                    "pool_size": pool_size,
+                    "max_rel_diff": "{:.1e}".format(
+                        relative_difference(
+                            instances.pred_densepose.fine_segm.numpy(),
+                            expected.pred_densepose.fine_segm.numpy(),
+                        ) if len(instances) == len(expected) else float("nan")),
+                    "label_agreement": "{:.4f}".format(agreement),
+                    "torch_img_s": "{:.2f}".format(torch_ips),
+                    "onnx_img_s": "{:.2f}".format(
+                        images_per_second(onnx_predictor, [bgr] * args.images, pool_size)),
+                }
+            )
+            print(rows[-1], flush=True)
+
+    print()
+    print("threads: torch {}, cpus {}".format(torch.get_num_threads(), os.cpu_count()))
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
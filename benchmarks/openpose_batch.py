@@ -0,0 +1,83 @@
+"""
+Throughput of batched OpenPose (`OpenPose.predict_batch`) against one `__call__` per image.
+
+Uses the real `bodypose_model` architecture with random weights (no checkpoint needed) and the
+heatmaps of `SyntheticPoseNet` for decoding, so the forward cost is realistic and the
+post-processing sees a normal person. Checks that both paths return the same keypoints.
+
+    python -m benchmarks.openpose_batch --images 32 --batch-sizes 1 8 16 --fast
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from benchmarks.synthetic import SyntheticPoseNet, openpose_body_module
+
+
+class RandomWeightPoseNet(torch.nn.Module):
+    """Runs the real network for its cost, but returns the synthetic maps for decoding."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.synthetic = SyntheticPoseNet()
+
+    def forward(self, x):
+        self.model(x)
+        return self.synthetic(x)
+
+
+def build_openpose(fast, device):
+    body_module = openpose_body_module()
+    from preprocess.openpose.annotator.openpose import OpenposeDetector
+    from preprocess.openpose.annotator.openpose.model import bodypose_model
+    from preprocess.openpose.run_openpose import OpenPose
+
+    body = body_module.Body.__new__(body_module.Body)
+    body.fast = fast
+    body.model = RandomWeightPoseNet(bodypose_model().to(device).eval())
+    detector = OpenposeDetector.__new__(OpenposeDetector)
+    detector.body_estimation = body
+    openpose = OpenPose.__new__(OpenPose)
+    openpose.preprocessor = detector
+    return openpose
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 16])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--fast", action="store_true", help="stride-resolution decoding")
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    openpose = build_openpose(args.fast, device)
+    rng = np.random.RandomState(0)
+    images = [
+        Image.fromarray(rng.randint(0, 256, (1024, 768, 3), dtype=np.uint8))
+        for _ in range(args.images)
+    ]
+
+    start = time.perf_counter()
+    expected = [openpose(image) for image in images]
+    sequential = time.perf_counter() - start
+    print("sequential     : {:.2f} images/s".format(len(images) / sequential))
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        keypoints = openpose.predict_batch(
+            images, batch_size=batch_size, num_workers=args.workers)
+        seconds = time.perf_counter() - start
+        print(
+            "batch {:<9d}: {:.2f} images/s ({:.2f}x), identical keypoints: {}".format(
+                batch_size, len(images) / seconds, sequential / seconds, keypoints == expected
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
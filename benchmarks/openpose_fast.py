@@ -0,0 +1,77 @@
+"""
+Latency, peak memory and keypoint agreement of the OpenPose stride-resolution fast path.
+
+Runs `Body` with `SyntheticPoseNet` in place of the network, once through the image-size path
+(`predict_maps` + `decode_body_pose`) and once with `fast=True` (`predict_maps_lowres` +
+`decode_body_pose_lowres`). Keypoint error is the distance from each keypoint of the full path to
+the nearest keypoint of the same part from the fast path, in image pixels.
+
+    python -m benchmarks.openpose_fast --people 1 4
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.common import format_table, peak_memory_bytes, time_fn
+from benchmarks.synthetic import synthetic_body_estimator
+
+
+def keypoints_by_part(candidate, subset):
+    keypoints = {}
+    for person in subset:
+        for part in range(18):
+            if person[part] >= 0:
+                keypoints.setdefault(part, []).append(candidate[int(person[part]), :2])
+    return {part: np.array(points) for part, points in keypoints.items()}
+
+
+def keypoint_errors(reference, other):
+    errors = []
+    for part, points in reference.items():
+        if part not in other:
+            continue
+        distances = np.linalg.norm(points[:, None] - other[part][None], axis=2)
+        errors.extend(distances.min(axis=1))
+    return np.array(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--people", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--width", type=int, default=384)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = []
+    image = np.zeros((args.height, args.width, 3), dtype=np.uint8)
+    for num_people in args.people:
+        body = synthetic_body_estimator(num_people)
+        results = {}
+        for name, fast in (("full", False), ("fast", True)):
+            body.fast = fast
+            results[name] = body(image)
+            rows.append(
+                {
+                    "people": num_people,
+                    "path": name,
+                    "detected": len(results[name][1]),
+                    "ms": "{:.1f}".format(time_fn(lambda: body(image), repeat=args.repeat) * 1000),
+                    "peak_mb": "{:.1f}".format(peak_memory_bytes(lambda: body(image)) / 2**20),
+                    "mean_err_px": "",
+                    "max_err_px": "",
+                }
+            )
+        errors = keypoint_errors(
+            keypoints_by_part(*results["full"]), keypoints_by_part(*results["fast"]))
+        if len(errors):
+            rows[-1]["mean_err_px"] = "{:.2f}".format(errors.mean())
+            rows[-1]["max_err_px"] = "{:.2f}".format(errors.max())
+        print(rows[-2], rows[-1], flush=True)
+
+    print()
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
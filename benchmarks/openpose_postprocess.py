@@ -0,0 +1,224 @@
+"""
+OpenPose body post-processing latency: vectorized decoding against the original loop.
+
+Feeds the heatmaps and PAFs of `SyntheticPoseNet` (optionally with noise, which adds spurious
+peaks and limb candidates) through `decode_body_pose` and through `legacy_decode_body_pose`, a
+verbatim copy of the original `Body.__call__` decoding, checks that both return identical
+candidates and subsets, and reports their latency.
+
+    python -m benchmarks.openpose_postprocess --people 1 4 12
+"""
+import argparse
+import math
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from benchmarks.common import format_table, time_fn
+from benchmarks.synthetic import openpose_body_module, synthetic_body_estimator
+
+
+def legacy_decode_body_pose(heatmap_avg, paf_avg, image_height):
+    """The decoding of the original `Body.__call__`, kept verbatim as the parity reference."""
+    thre1 = 0.1
+    thre2 = 0.05
+    all_peaks = []
+    peak_counter = 0
+
+    for part in range(18):
+        map_ori = heatmap_avg[:, :, part]
+        one_heatmap = gaussian_filter(map_ori, sigma=3)
+
+        map_left = np.zeros(one_heatmap.shape)
+        map_left[1:, :] = one_heatmap[:-1, :]
+        map_right = np.zeros(one_heatmap.shape)
+        map_right[:-1, :] = one_heatmap[1:, :]
+        map_up = np.zeros(one_heatmap.shape)
+        map_up[:, 1:] = one_heatmap[:, :-1]
+        map_down = np.zeros(one_heatmap.shape)
+        map_down[:, :-1] = one_heatmap[:, 1:]
+
+        peaks_binary = np.logical_and.reduce(
+            (one_heatmap >= map_left, one_heatmap >= map_right, one_heatmap >= map_up, one_heatmap >= map_down,
+             one_heatmap > thre1))
+        peaks = list(zip(np.nonzero(peaks_binary)[1], np.nonzero(peaks_binary)[0]))  # note reverse
+        peaks_with_score = [x + (map_ori[x[1], x[0]],) for x in peaks]
+        peak_id = range(peak_counter, peak_counter + len(peaks))
+        peaks_with_score_and_id = [peaks_with_score[i] + (peak_id[i],) for i in range(len(peak_id))]
+
+        all_peaks.append(peaks_with_score_and_id)
+        peak_counter += len(peaks)
+
+    # find connection in the specified sequence, center 29 is in the position 15
+    limbSeq = [[2, 3], [2, 6], [3, 4], [4, 5], [6, 7], [7, 8], [2, 9], [9, 10], \
+               [10, 11], [2, 12], [12, 13], [13, 14], [2, 1], [1, 15], [15, 17], \
+               [1, 16], [16, 18], [3, 17], [6, 18]]
+    # the middle joints heatmap correpondence
+    mapIdx = [[31, 32], [39, 40], [33, 34], [35, 36], [41, 42], [43, 44], [19, 20], [21, 22], \
+              [23, 24], [25, 26], [27, 28], [29, 30], [47, 48], [49, 50], [53, 54], [51, 52], \
+              [55, 56], [37, 38], [45, 46]]
+
+    connection_all = []
+    special_k = []
+    mid_num = 10
+
+    for k in range(len(mapIdx)):
+        score_mid = paf_avg[:, :, [x - 19 for x in mapIdx[k]]]
+        candA = all_peaks[limbSeq[k][0] - 1]
+        candB = all_peaks[limbSeq[k][1] - 1]
+        nA = len(candA)
+        nB = len(candB)
+        indexA, indexB = limbSeq[k]
+        if (nA != 0 and nB != 0):
+            connection_candidate = []
+            for i in range(nA):
+                for j in range(nB):
+                    vec = np.subtract(candB[j][:2], candA[i][:2])
+                    norm = math.sqrt(vec[0] * vec[0] + vec[1] * vec[1])
+                    norm = max(0.001, norm)
+                    vec = np.divide(vec, norm)
+
+                    startend = list(zip(np.linspace(candA[i][0], candB[j][0], num=mid_num), \
+                                        np.linspace(candA[i][1], candB[j][1], num=mid_num)))
+
+                    vec_x = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 0] \
+                                      for I in range(len(startend))])
+                    vec_y = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 1] \
+                                      for I in range(len(startend))])
+
+                    score_midpts = np.multiply(vec_x, vec[0]) + np.multiply(vec_y, vec[1])
+                    score_with_dist_prior = sum(score_midpts) / len(score_midpts) + min(
+                        0.5 * image_height / norm - 1, 0)
+                    criterion1 = len(np.nonzero(score_midpts > thre2)[0]) > 0.8 * len(score_midpts)
+                    criterion2 = score_with_dist_prior > 0
+                    if criterion1 and criterion2:
+                        connection_candidate.append(
+                            [i, j, score_with_dist_prior, score_with_dist_prior + candA[i][2] + candB[j][2]])
+
+            connection_candidate = sorted(connection_candidate, key=lambda x: x[2], reverse=True)
+            connection = np.zeros((0, 5))
+            for c in range(len(connection_candidate)):
+                i, j, s = connection_candidate[c][0:3]
+                if (i not in connection[:, 3] and j not in connection[:, 4]):
+                    connection = np.vstack([connection, [candA[i][3], candB[j][3], s, i, j]])
+                    if (len(connection) >= min(nA, nB)):
+                        break
+
+            connection_all.append(connection)
+        else:
+            special_k.append(k)
+            connection_all.append([])
+
+    # last number in each row is the total parts number of that person
+    # the second last number in each row is the score of the overall configuration
+    subset = -1 * np.ones((0, 20))
+    candidate = np.array([item for sublist in all_peaks for item in sublist])
+
+    for k in range(len(mapIdx)):
+        if k not in special_k:
+            partAs = connection_all[k][:, 0]
+            partBs = connection_all[k][:, 1]
+            indexA, indexB = np.array(limbSeq[k]) - 1
+
+            for i in range(len(connection_all[k])):  # = 1:size(temp,1)
+                found = 0
+                subset_idx = [-1, -1]
+                for j in range(len(subset)):  # 1:size(subset,1):
+                    if subset[j][indexA] == partAs[i] or subset[j][indexB] == partBs[i]:
+                        subset_idx[found] = j
+                        found += 1
+
+                if found == 1:
+                    j = subset_idx[0]
+                    if subset[j][indexB] != partBs[i]:
+                        subset[j][indexB] = partBs[i]
+                        subset[j][-1] += 1
+                        subset[j][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
+                elif found == 2:  # if found 2 and disjoint, merge them
+                    j1, j2 = subset_idx
+                    membership = ((subset[j1] >= 0).astype(int) + (subset[j2] >= 0).astype(int))[:-2]
+                    if len(np.nonzero(membership == 2)[0]) == 0:  # merge
+                        subset[j1][:-2] += (subset[j2][:-2] + 1)
+                        subset[j1][-2:] += subset[j2][-2:]
+                        subset[j1][-2] += connection_all[k][i][2]
+                        subset = np.delete(subset, j2, 0)
+                    else:  # as like found == 1
+                        subset[j1][indexB] = partBs[i]
+                        subset[j1][-1] += 1
+                        subset[j1][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
+
+                # if find no partA in the subset, create a new subset
+                elif not found and k < 17:
+                    row = -1 * np.ones(20)
+                    row[indexA] = partAs[i]
+                    row[indexB] = partBs[i]
+                    row[-1] = 2
+                    row[-2] = sum(candidate[connection_all[k][i, :2].astype(int), 2]) + connection_all[k][i][2]
+                    subset = np.vstack([subset, row])
+    # delete some rows of subset which has few parts occur
+    deleteIdx = []
+    for i in range(len(subset)):
+        if subset[i][-1] < 4 or subset[i][-2] / subset[i][-1] < 0.4:
+            deleteIdx.append(i)
+    subset = np.delete(subset, deleteIdx, axis=0)
+
+    # subset: n*20 array, 0-17 is the index in candidate, 18 is the total score, 19 is the total parts
+    # candidate: x, y, score, id
+    return candidate, subset
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--people", nargs="+", type=int, default=[1, 4, 12])
+    parser.add_argument("--noise", type=float, default=0.1, help="PAF noise std (0 = clean maps)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    body_module = openpose_body_module()
+    decode_body_pose = body_module.decode_body_pose
+
+    rows = []
+    for num_people in args.people:
+        # keep people roughly 96px wide at 512px height, like a catalog or crowd photo
+        height, width = 512, max(384, 96 * num_people)
+        body = synthetic_body_estimator(num_people)
+        heatmap, paf = body.predict_maps(np.zeros((height, width, 3), dtype=np.uint8))
+        if args.noise:
+            rng = np.random.RandomState(args.seed)
+            heatmap = heatmap + rng.rand(*heatmap.shape) * args.noise
+            paf = paf + rng.randn(*paf.shape) * args.noise
+
+        candidate, subset = decode_body_pose(heatmap, paf, height)
+        legacy_candidate, legacy_subset = legacy_decode_body_pose(heatmap, paf, height)
+        identical = np.array_equal(candidate, legacy_candidate) and np.array_equal(
+            subset, legacy_subset)
+
+        legacy = time_fn(
+            lambda: legacy_decode_body_pose(heatmap, paf, height), repeat=args.repeat)
+        vectorized = time_fn(lambda: decode_body_pose(heatmap, paf, height), repeat=args.repeat)
+        # peak finding is shared by both; the rest is limb scoring and person assembly
+        peaks = time_fn(lambda: body_module.find_peaks(heatmap), repeat=args.repeat)
+        rows.append(
+            {
+                "people": num_people,
+                "size": "{}x{}".format(height, width),
+                "candidates": len(candidate),
+                "detected": len(subset),
+                "legacy_ms": "{:.1f}".format(legacy * 1000),
+                "vectorized_ms": "{:.1f}".format(vectorized * 1000),
+                "peaks_ms": "{:.1f}".format(peaks * 1000),
+                "speedup": "{:.2f}x".format(legacy / vectorized),
+                "matching_speedup": "{:.2f}x".format(
+                    max(legacy - peaks, 1e-9) / max(vectorized - peaks, 1e-9)),
+                "identical": identical,
+            }
+        )
+        print(rows[-1], flush=True)
+
+    print()
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
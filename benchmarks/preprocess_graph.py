@@ -0,0 +1,100 @@
+"""
+Latency, parity and copied bytes of `PreprocessGraph` against per-consumer preprocessing.
+
+A synthetic person photo (JPEG) goes through the three consumers of a request: `AutoMasker`
+(DensePose and both SCHP parsers, random-weight checkpoints as in `benchmarks.weight_cache`),
+OpenPose (random weights, see `benchmarks.openpose_batch`) and `LeffaTransform`. `separate`
+hands each consumer the PIL image, as before, and runs the models one after another; `graph`
+decodes once into a `PreprocessGraph`, feeds each consumer from its shared buffers and runs
+DensePose and SCHP concurrently. `identical` checks that the mask, keypoints and transformed
+tensors are equal; `copied_mb` is the graph's own allocations (`PreprocessGraph.copies`).
+
+    python -m benchmarks.preprocess_graph --repeat 2
+"""
+import argparse
+import io
+import os
+import tempfile
+
+import numpy as np
+import torch
+from PIL import Image
+
+from benchmarks.common import format_table, time_fn
+from benchmarks.openpose_batch import build_openpose
+from benchmarks.weight_cache import write_densepose_checkpoint, write_schp_checkpoints
+from leffa.transform import LeffaTransform
+from leffa_utils.garment_agnostic_mask_predictor import AutoMasker
+from leffa_utils.ingest import ingest
+from leffa_utils.preprocess_graph import PreprocessGraph
+
+
+def synthetic_photo(width=3024, height=4032, seed=0):
+    rng = np.random.RandomState(seed)
+    small = Image.fromarray(rng.randint(0, 256, (height // 64, width // 64, 3), dtype=np.uint8))
+    buffer = io.BytesIO()
+    small.resize((width, height), Image.BICUBIC).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        densepose_dir = os.path.join(root, "densepose")
+        schp_dir = os.path.join(root, "schp")
+        os.makedirs(densepose_dir)
+        os.makedirs(schp_dir)
+        write_densepose_checkpoint(densepose_dir)
+        write_schp_checkpoints(schp_dir)
+        automasker = AutoMasker(densepose_dir, schp_dir, device="cpu")
+    openpose = build_openpose(fast=False, device="cpu")
+    transform = LeffaTransform()
+    person, garment = synthetic_photo(seed=0), synthetic_photo(seed=1)
+    mask = np.full((1024, 768), 255, dtype=np.uint8)
+
+    def separate():
+        image, garment_image = ingest(person), ingest(garment)
+        masked = automasker(image, "upper")["mask"]
+        keypoints = openpose(image.resize((384, 512)))
+        data = transform({"src_image": [image], "ref_image": [garment_image],
+                          "mask": [Image.fromarray(mask)], "densepose": [image]})
+        return masked, keypoints, data, None
+
+    def graph():
+        graph, garment_graph = PreprocessGraph(person), PreprocessGraph(garment)
+        masked = automasker(graph, "upper")["mask"]
+        keypoints = openpose(graph.resized(384, 512))
+        data = transform({"src_image": [graph.rgb], "ref_image": [garment_graph.rgb],
+                          "mask": [mask], "densepose": [graph.rgb]})
+        return masked, keypoints, data, graph.bytes_copied + garment_graph.bytes_copied
+
+    with torch.no_grad():
+        expected = separate()
+        rows = []
+        for name, fn in (("separate", separate), ("graph", graph)):
+            masked, keypoints, data, copied = fn()
+            identical = (
+                np.array_equal(np.asarray(masked), np.asarray(expected[0]))
+                and keypoints == expected[1]
+                and all(torch.equal(data[k], expected[2][k]) for k in expected[2])
+            )
+            seconds = time_fn(fn, repeat=args.repeat)
+            rows.append(
+                {
+                    "path": name,
+                    "s": "{:.2f}".format(seconds),
+                    "identical": identical,
+                    "copied_mb": "-" if copied is None else "{:.1f}".format(copied / 2 ** 20),
+                }
+            )
+            print(rows[-1], flush=True)
+
+    print()
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
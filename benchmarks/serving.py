@@ -0,0 +1,152 @@
+"""
+Throughput of `InferencePool` by number of inference workers, and the cost of moving images.
+
+`in-process` calls a `TryOnHandler` on the tiny random-weight model (see `benchmarks.synthetic`)
+for `--requests` random requests one after another; `pool` runs the same requests through an
+`InferencePool` of each `--workers` spec ("2" splits the physical cores between two workers,
+see `parse_worker_specs`) and reports requests/s and whether every result equals the in-process
+one (requests reseed the global RNG, so results do not depend on the worker that ran them).
+Workers scale with spare cores (or GPUs), so on a host with few cores the pool rows only show
+the queueing overhead. `transport` sends 1024x768 images to a worker that returns the person
+image: through the pool's shared-memory slots, and pickled over a multiprocessing queue.
+
+    python -m benchmarks.serving --requests 8 --steps 4 --workers 1 2
+"""
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+import torch
+
+from benchmarks.common import format_table
+from leffa_utils.serving import InferencePool, TryOnHandler, parse_worker_specs
+
+HEIGHT, WIDTH = 256, 192
+
+
+def tiny_handler():
+    from benchmarks.synthetic import build_tiny_leffa_model
+    from leffa.inference import LeffaInference
+    from leffa.transform import LeffaTransform
+
+    model = build_tiny_leffa_model(height=HEIGHT, width=WIDTH)
+    handler = TryOnHandler(LeffaInference(model), LeffaTransform(height=HEIGHT, width=WIDTH))
+
+    def seeded(person, garment, **kwargs):
+        # the initial noise comes from the global RNG, so a result would depend on the requests
+        # its process ran before; reseed to compare results across any number of workers
+        torch.manual_seed(kwargs["seed"])
+        return handler(person, garment, **kwargs)
+
+    return seeded
+
+
+def echo_handler():
+    return lambda person, garment, **kwargs: person
+
+
+def _pickle_echo(requests, responses):
+    while True:
+        message = requests.get()
+        if message is None:
+            return
+        responses.put(message[0])
+
+
+def random_requests(num_requests, height, width, seed=0):
+    rng = np.random.RandomState(seed)
+    return [
+        (rng.randint(0, 256, (height, width, 3), dtype=np.uint8),
+         rng.randint(0, 256, (height, width, 3), dtype=np.uint8))
+        for _ in range(num_requests)
+    ]
+
+
+def transport_rows(repeat):
+    person, garment = random_requests(1, 1024, 768)[0]
+    rows = []
+
+    with InferencePool("benchmarks.serving:echo_handler") as pool:
+        client = pool.client()
+        client.submit(person, garment).result()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            assert np.array_equal(client.submit(person, garment).result(), person)
+        rows.append({"transport": "shared memory",
+                     "ms": "{:.2f}".format((time.perf_counter() - start) * 1000 / repeat)})
+
+    context = multiprocessing.get_context("spawn")
+    requests, responses = context.Queue(), context.Queue()
+    process = context.Process(target=_pickle_echo, args=(requests, responses), daemon=True)
+    process.start()
+    requests.put((person, garment))
+    responses.get()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        requests.put((person, garment))
+        assert np.array_equal(responses.get(), person)
+    rows.append({"transport": "pickled queue",
+                 "ms": "{:.2f}".format((time.perf_counter() - start) * 1000 / repeat)})
+    requests.put(None)
+    process.join()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--workers", nargs="+", default=["1", "2"],
+                        help="worker specs per run, e.g. 2 or 'cpu:0-3 cpu:4-7'")
+    parser.add_argument("--transport-repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    requests = random_requests(args.requests, HEIGHT, WIDTH)
+    kwargs = [dict(num_inference_steps=args.steps, seed=i) for i in range(args.requests)]
+
+    handler = tiny_handler()
+    handler(*requests[0], **kwargs[0])
+    start = time.perf_counter()
+    expected = [handler(*request, **k) for request, k in zip(requests, kwargs)]
+    baseline = args.requests / (time.perf_counter() - start)
+    rows = [{"path": "in-process", "workers": "-", "req_s": "{:.3f}".format(baseline),
+             "speedup": "1.00", "identical": "-"}]
+    print(rows[-1], flush=True)
+
+    for workers in args.workers:
+        specs = parse_worker_specs(workers)
+        with InferencePool("benchmarks.serving:tiny_handler", specs, height=HEIGHT,
+                           width=WIDTH) as pool:
+            client = pool.client()
+            # one warm-up request per worker
+            for future in [client.submit(*requests[0], **kwargs[0]) for _ in specs]:
+                future.result()
+            start = time.perf_counter()
+            futures = [client.submit(*request, **k) for request, k in zip(requests, kwargs)]
+            results = [future.result() for future in futures]
+            req_s = args.requests / (time.perf_counter() - start)
+        rows.append(
+            {
+                "path": "pool",
+                "workers": " ".join(
+                    spec.device if spec.cpus is None else "cpu:{}".format(
+                        ",".join(map(str, spec.cpus)))
+                    for spec in specs
+                ),
+                "req_s": "{:.3f}".format(req_s),
+                "speedup": "{:.2f}".format(req_s / baseline),
+                "identical": str(all(np.array_equal(a, b) for a, b in zip(results, expected))),
+            }
+        )
+        print(rows[-1], flush=True)
+
+    print()
+    print("cpus: {}".format(multiprocessing.cpu_count()))
+    print(format_table(rows, list(rows[0])))
+    print()
+    print(format_table(transport_rows(args.transport_repeat), ["transport", "ms"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Throughput of `StagedExecutor` against sequential `LeffaInference` calls, and output parity.
+
+Runs `--requests` random requests through both on the tiny random-weight model (or the real one
+with `--real`), alternating `ref_acceleration`, and reports requests/s and whether every
+generated image is identical. Overlap needs spare compute: several GPUs or streams, or CPU cores
+for each stage.
+
+    python -m benchmarks.staged_executor --requests 8 --steps 10
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from benchmarks.common import format_table, synchronize
+from benchmarks.synthetic import build_tiny_leffa_model
+from leffa.inference import LeffaInference
+from leffa.staged import StagedExecutor
+
+
+def random_requests(num_requests, height, width, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+
+    def image(channels):
+        return torch.rand(1, channels, height, width, generator=generator) * 2 - 1
+
+    return [
+        dict(src_image=image(3), ref_image=image(3), mask=(image(1) > 0).float(),
+             densepose=image(3))
+        for _ in range(num_requests)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--real", action="store_true", help="load ./ckpts instead of tiny weights")
+    parser.add_argument("--reference-device", default=None,
+                        help="device for the reference UNet, e.g. cuda:1")
+    parser.add_argument("--feature-queue-size", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.real:
+        from leffa.model import LeffaModel
+
+        model = LeffaModel(
+            pretrained_model_name_or_path="./ckpts/stable-diffusion-inpainting",
+            pretrained_model="./ckpts/virtual_tryon.pth",
+            dtype="float16" if torch.cuda.is_available() else "float32",
+        )
+        height, width = 1024, 768
+    else:
+        model = build_tiny_leffa_model()
+        height, width = 256, 192
+    inference = LeffaInference(model)
+    if args.reference_device is not None:
+        inference.pipe.place_reference_unet(args.reference_device)
+    kwargs = [
+        dict(num_inference_steps=args.steps, seed=i, ref_acceleration=i % 2 == 1)
+        for i in range(args.requests)
+    ]
+
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    expected = [
+        inference(data, **k)["generated_image"]
+        for data, k in zip(random_requests(args.requests, height, width), kwargs)
+    ]
+    synchronize(inference.device)
+    sequential = time.perf_counter() - start
+
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    with StagedExecutor(inference, feature_queue_size=args.feature_queue_size) as executor:
+        futures = [
+            executor.submit(data, **k)
+            for data, k in zip(random_requests(args.requests, height, width), kwargs)
+        ]
+        staged = [future.result()["generated_image"] for future in futures]
+    synchronize(inference.device)
+    pipelined = time.perf_counter() - start
+
+    identical = all(
+        np.array_equal(np.asarray(a), np.asarray(b))
+        for images, other in zip(expected, staged)
+        for a, b in zip(images, other)
+    )
+    rows = [
+        {"executor": "sequential", "req_s": "{:.3f}".format(args.requests / sequential),
+         "identical": "-"},
+        {"executor": "staged", "req_s": "{:.3f}".format(args.requests / pipelined),
+         "identical": str(identical)},
+    ]
+    print()
+    print("threads: torch {}".format(torch.get_num_threads()))
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
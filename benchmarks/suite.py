@@ -0,0 +1,235 @@
+"""
+Checkpoint-free CPU benchmark suite with JSON baselines.
+
+Every case runs on synthetic inputs (see `benchmarks.synthetic`), so the suite needs no
+downloads: the tiny random-weight `LeffaModel` through `LeffaPipeline` (steps/sec, peak memory
+and per-stage latency from `leffa.tracing`), `LeffaTransform`, `AutoMasker.cloth_agnostic_mask`,
+SCHP's `transform_logits` and the OpenPose post-processing for one and four people.
+
+    python -m benchmarks.suite --save main          # writes benchmarks/baselines/main.json
+    python -m benchmarks.suite --compare main      # exits 1 if a case got slower than allowed
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+import torch
+
+from benchmarks.common import format_table, peak_memory_bytes
+from benchmarks.synthetic import (
+    build_tiny_leffa_model,
+    synthetic_body_estimator,
+    synthetic_images,
+    synthetic_parsing,
+)
+from leffa import tracing
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+
+
+def measure(fn, warmup=1, repeat=5):
+    """Median and min wall time of `fn()` in milliseconds over `repeat` calls."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return {"median_ms": statistics.median(samples), "min_ms": min(samples)}
+
+
+def bench_pipeline(args):
+    from leffa.pipeline import LeffaPipeline
+
+    model = build_tiny_leffa_model(height=args.height, width=args.width)
+    pipeline = LeffaPipeline(model, device="cpu")
+    inputs = dict(
+        src_image=torch.rand(1, 3, args.height, args.width) * 2 - 1,
+        ref_image=torch.rand(1, 3, args.height, args.width) * 2 - 1,
+        mask=torch.ones(1, 1, args.height, args.width),
+        densepose=torch.rand(1, 3, args.height, args.width) * 2 - 1,
+        num_inference_steps=args.steps,
+        repaint=True,
+    )
+
+    def run():
+        with torch.no_grad():
+            pipeline(**inputs)
+
+    result = measure(run, repeat=args.repeat)
+    result["steps_per_sec"] = args.steps * 1000.0 / result["median_ms"]
+    result["peak_mb"] = peak_memory_bytes(run) / 2**20
+
+    # per-stage latency: median over the traced calls of each stage's mean span duration
+    stages = {}
+    for _ in range(args.repeat):
+        with tracing.trace() as spans:
+            run()
+        durations = {}
+        for span in spans:
+            durations.setdefault(span["name"], []).append(span["duration_ms"])
+        for name, values in durations.items():
+            stages.setdefault(name, []).append(sum(values) / len(values))
+    result["stages_ms"] = {name: statistics.median(v) for name, v in sorted(stages.items())}
+    return result
+
+
+def bench_transform(args):
+    from leffa.transform import LeffaTransform
+
+    human, garment, mask, densepose = synthetic_images()
+    transform = LeffaTransform()
+    batch = {"src_image": [human], "ref_image": [garment], "mask": [mask], "densepose": [densepose]}
+    return measure(lambda: transform(batch), repeat=args.repeat)
+
+
+def bench_cloth_agnostic_mask(args):
+    from leffa_utils.garment_agnostic_mask_predictor import AutoMasker
+
+    densepose, lip, atr = synthetic_parsing()
+    return measure(
+        lambda: AutoMasker.cloth_agnostic_mask(densepose, lip, atr, part="upper"),
+        repeat=args.repeat,
+    )
+
+
+def bench_transform_logits(args):
+    from SCHP.utils.transforms import transform_logits
+
+    # SCHP-LIP output (473x473, 20 classes) warped back onto a 768x1024 image
+    input_size = [473, 473]
+    width, height = 768, 1024
+    logits = np.random.RandomState(0).randn(473, 473, 20).astype(np.float32)
+    center = np.array([(width - 1) * 0.5, (height - 1) * 0.5], dtype=np.float32)
+    scale = np.array([height - 1, height - 1], dtype=np.float32)
+    return measure(
+        lambda: transform_logits(logits, center, scale, width, height, input_size),
+        repeat=args.repeat,
+    )
+
+
+def bench_openpose(num_people):
+    def bench(args):
+        body = synthetic_body_estimator(num_people)
+        image = np.zeros((512, 384, 3), dtype=np.uint8)
+        return measure(lambda: body(image), repeat=args.repeat)
+
+    return bench
+
+
+CASES = {
+    "pipeline": bench_pipeline,
+    "leffa_transform": bench_transform,
+    "cloth_agnostic_mask": bench_cloth_agnostic_mask,
+    "transform_logits": bench_transform_logits,
+    "openpose_postprocess_1p": bench_openpose(1),
+    "openpose_postprocess_4p": bench_openpose(4),
+}
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(__file__),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "num_threads": torch.get_num_threads(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Rows comparing median latencies with the baseline; `regressed` marks slowdowns."""
+    rows = []
+    for case, result in results.items():
+        reference = baseline["results"].get(case)
+        if reference is None:
+            continue
+        ratio = result["median_ms"] / reference["median_ms"]
+        rows.append(
+            {
+                "case": case,
+                "baseline_ms": "{:.2f}".format(reference["median_ms"]),
+                "current_ms": "{:.2f}".format(result["median_ms"]),
+                "ratio": "{:.2f}".format(ratio),
+                "regressed": "yes" if ratio > 1.0 + tolerance else "",
+            }
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--height", type=int, default=256)
+    parser.add_argument("--width", type=int, default=192)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--save", metavar="NAME", help="write results to baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="compare with baselines/NAME.json")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2,
+        help="allowed relative slowdown of a case's median before --compare fails",
+    )
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+
+    results = {}
+    for case in args.cases:
+        results[case] = CASES[case](args)
+        print(case, json.dumps(results[case]), flush=True)
+
+    rows = [
+        {
+            "case": case,
+            "median_ms": "{:.2f}".format(result["median_ms"]),
+            "min_ms": "{:.2f}".format(result["min_ms"]),
+        }
+        for case, result in results.items()
+    ]
+    print()
+    print(format_table(rows, ["case", "median_ms", "min_ms"]))
+
+    report = {
+        "environment": environment(),
+        "config": {k: getattr(args, k) for k in ("repeat", "steps", "height", "width")},
+        "results": results,
+    }
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, args.save + ".json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print("\nSaved baseline to {}".format(path))
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, args.compare + ".json")) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.tolerance)
+        print("\nAgainst {} ({}):".format(args.compare, baseline["environment"].get("commit")))
+        print(format_table(rows, ["case", "baseline_ms", "current_ms", "ratio", "regressed"]))
+        if any(row["regressed"] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Checkpoint-free stand-ins for the benchmark suite: a tiny random-weight `LeffaModel`, synthetic
+DensePose/SCHP label maps of a standing person and an OpenPose network replacement that renders
+heatmaps and part affinity fields for a given number of people.
+"""
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+
+from leffa.model import LeffaModel
+
+# SD1.5-inpainting layout (VAE downsamples by 8, UNet has attention blocks on both paths) at a
+# fraction of the width, so every code path of the real model runs in milliseconds
+TINY_UNET_CONFIG = {
+    "_class_name": "UNet2DConditionModel",
+    "in_channels": 9,
+    "out_channels": 4,
+    "block_out_channels": [32, 64],
+    "down_block_types": ["CrossAttnDownBlock2D", "DownBlock2D"],
+    "up_block_types": ["UpBlock2D", "CrossAttnUpBlock2D"],
+    "layers_per_block": 1,
+    "cross_attention_dim": 32,
+    "attention_head_dim": 8,
+    "norm_num_groups": 8,
+    "sample_size": 16,
+}
+TINY_VAE_CONFIG = {
+    "_class_name": "AutoencoderKL",
+    "in_channels": 3,
+    "out_channels": 3,
+    "latent_channels": 4,
+    "block_out_channels": [32, 32, 32, 32],
+    "down_block_types": ["DownEncoderBlock2D"] * 4,
+    "up_block_types": ["UpDecoderBlock2D"] * 4,
+    "layers_per_block": 1,
+    "norm_num_groups": 8,
+    "sample_size": 64,
+    "scaling_factor": 0.18215,
+}
+TINY_SCHEDULER_CONFIG = {
+    "_class_name": "DDPMScheduler",
+    "beta_start": 0.00085,
+    "beta_end": 0.012,
+    "beta_schedule": "scaled_linear",
+    "num_train_timesteps": 1000,
+    "prediction_type": "epsilon",
+    "steps_offset": 1,
+    "clip_sample": False,
+}
+
+
+def write_tiny_config(directory):
+    """Write a diffusers-style config tree (scheduler/, vae/, unet/) into `directory`."""
+    for subfolder, name, config in (
+        ("scheduler", "scheduler_config.json", TINY_SCHEDULER_CONFIG),
+        ("vae", "config.json", TINY_VAE_CONFIG),
+        ("unet", "config.json", TINY_UNET_CONFIG),
+    ):
+        os.makedirs(os.path.join(directory, subfolder), exist_ok=True)
+        with open(os.path.join(directory, subfolder, name), "w") as f:
+            json.dump(config, f)
+    return directory
+
+
+def build_tiny_leffa_model(height=256, width=192, seed=0, **kwargs):
+    """A float32 `LeffaModel` with the tiny config and seeded random weights."""
+    torch.manual_seed(seed)
+    with tempfile.TemporaryDirectory() as root:
+        # the directory name selects the SD1.5 scheduler settings in `LeffaModel.build_models`
+        config_dir = write_tiny_config(os.path.join(root, "stable-diffusion-inpainting"))
+        model = LeffaModel(
+            pretrained_model_name_or_path=config_dir,
+            pretrained_model="",
+            height=height,
+            width=width,
+            dtype="float32",
+            **kwargs,
+        )
+    return model.eval()
+
+
+def synthetic_images(height=1024, width=768, seed=0):
+    """Random person/garment RGB images plus an all-white mask and a flat DensePose image."""
+    rng = np.random.RandomState(seed)
+    human = Image.fromarray(rng.randint(0, 256, (height, width, 3), dtype=np.uint8))
+    garment = Image.fromarray(rng.randint(0, 256, (height, width, 3), dtype=np.uint8))
+    mask = Image.fromarray(np.full((height, width, 3), 255, dtype=np.uint8))
+    densepose = Image.fromarray(np.ones((height, width, 3), dtype=np.uint8))
+    return human, garment, mask, densepose
+
+
+# (top, bottom, left, right) as fractions of the image, drawn in order
+_BODY_BOXES = {
+    "face": (0.08, 0.18, 0.42, 0.58),
+    "torso": (0.2, 0.52, 0.34, 0.66),
+    "right big arm": (0.2, 0.36, 0.24, 0.33),
+    "left big arm": (0.2, 0.36, 0.67, 0.76),
+    "right forearm": (0.36, 0.5, 0.22, 0.31),
+    "left forearm": (0.36, 0.5, 0.69, 0.78),
+    "right hand": (0.5, 0.56, 0.21, 0.3),
+    "left hand": (0.5, 0.56, 0.7, 0.79),
+    "right thigh": (0.52, 0.72, 0.36, 0.49),
+    "left thigh": (0.52, 0.72, 0.51, 0.64),
+    "right leg": (0.72, 0.9, 0.37, 0.48),
+    "left leg": (0.72, 0.9, 0.52, 0.63),
+    "right foot": (0.9, 0.95, 0.36, 0.48),
+    "left foot": (0.9, 0.95, 0.52, 0.64),
+}
+_ATR_LABELS = {
+    "face": "Face", "torso": "Upper-clothes", "right big arm": "Right-arm",
+    "left big arm": "Left-arm", "right forearm": "Right-arm", "left forearm": "Left-arm",
+    "right hand": "Right-arm", "left hand": "Left-arm", "right thigh": "Pants",
+    "left thigh": "Pants", "right leg": "Right-leg", "left leg": "Left-leg",
+    "right foot": "Right-shoe", "left foot": "Left-shoe",
+}
+
+
+def synthetic_parsing(height=1024, width=768):
+    """
+    DensePose I-map, SCHP-LIP and SCHP-ATR label images of one box-shaped standing person, in the
+    formats `AutoMasker.cloth_agnostic_mask` consumes.
+    """
+    from leffa_utils.garment_agnostic_mask_predictor import (
+        ATR_MAPPING,
+        DENSE_INDEX_MAP,
+        LIP_MAPPING,
+    )
+
+    densepose = np.zeros((height, width), dtype=np.uint8)
+    atr = np.zeros((height, width), dtype=np.uint8)
+    lip = np.zeros((height, width), dtype=np.uint8)
+    # hair above the face
+    top, bottom, left, right = (int(f * n) for f, n in zip(
+        (0.04, 0.1, 0.4, 0.6), (height, height, width, width)))
+    atr[top:bottom, left:right] = ATR_MAPPING["Hair"]
+    lip[top:bottom, left:right] = LIP_MAPPING["Hair"]
+    for part, (top, bottom, left, right) in _BODY_BOXES.items():
+        rows = slice(int(top * height), int(bottom * height))
+        cols = slice(int(left * width), int(right * width))
+        densepose[rows, cols] = DENSE_INDEX_MAP[part][0]
+        atr[rows, cols] = ATR_MAPPING[_ATR_LABELS[part]]
+        lip[rows, cols] = LIP_MAPPING[_ATR_LABELS[part]]
+    return Image.fromarray(densepose), Image.fromarray(lip), Image.fromarray(atr)
+
+
+# COCO-18 keypoints of a standing person in a unit box (x, y), in OpenPose order
+_POSE_TEMPLATE = np.array([
+    [0.5, 0.1], [0.5, 0.22], [0.35, 0.22], [0.28, 0.38], [0.25, 0.52], [0.65, 0.22],
+    [0.72, 0.38], [0.75, 0.52], [0.42, 0.52], [0.41, 0.72], [0.4, 0.92], [0.58, 0.52],
+    [0.59, 0.72], [0.6, 0.92], [0.46, 0.08], [0.54, 0.08], [0.42, 0.1], [0.58, 0.1],
+])
+# the limb table and PAF channel pairs of annotator/openpose/body.py
+_LIMB_SEQ = [[2, 3], [2, 6], [3, 4], [4, 5], [6, 7], [7, 8], [2, 9], [9, 10],
+             [10, 11], [2, 12], [12, 13], [13, 14], [2, 1], [1, 15], [15, 17],
+             [1, 16], [16, 18], [3, 17], [6, 18]]
+_MAP_IDX = [[31, 32], [39, 40], [33, 34], [35, 36], [41, 42], [43, 44], [19, 20], [21, 22],
+            [23, 24], [25, 26], [27, 28], [29, 30], [47, 48], [49, 50], [53, 54], [51, 52],
+            [55, 56], [37, 38], [45, 46]]
+
+
+class SyntheticPoseNet(nn.Module):
+    """
+    Stands in for `bodypose_model`: returns (PAFs, heatmaps) at 1/8 of the input resolution with
+    Gaussian keypoints and unit-vector limb fields for `num_people` side-by-side people, so the
+    OpenPose post-processing sees realistic peak and candidate counts.
+    """
+
+    stride = 8
+
+    def __init__(self, num_people=1, sigma=1.5, limb_width=1.0):
+        super().__init__()
+        self.num_people = num_people
+        self.sigma = sigma
+        self.limb_width = limb_width
+
+    def render(self, height, width):
+        heatmaps = np.zeros((19, height, width), dtype=np.float32)
+        pafs = np.zeros((38, height, width), dtype=np.float32)
+        ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+        person_width = width / self.num_people
+        for person in range(self.num_people):
+            keypoints = _POSE_TEMPLATE * [person_width, height] + [person * person_width, 0]
+            for part, (x, y) in enumerate(keypoints):
+                heatmaps[part] = np.maximum(
+                    heatmaps[part],
+                    np.exp(-((xs - x) ** 2 + (ys - y) ** 2) / (2 * self.sigma ** 2)),
+                )
+            for (a, b), (cx, cy) in zip(_LIMB_SEQ, _MAP_IDX):
+                start, end = keypoints[a - 1], keypoints[b - 1]
+                vec = end - start
+                length = max(np.linalg.norm(vec), 1e-3)
+                unit = vec / length
+                along = (xs - start[0]) * unit[0] + (ys - start[1]) * unit[1]
+                across = np.abs((xs - start[0]) * unit[1] - (ys - start[1]) * unit[0])
+                on_limb = (along >= 0) & (along <= length) & (across <= self.limb_width)
+                pafs[cx - 19][on_limb] = unit[0]
+                pafs[cy - 19][on_limb] = unit[1]
+        heatmaps[18] = np.clip(1.0 - heatmaps[:18].max(axis=0), 0.0, 1.0)
+        return pafs, heatmaps
+
+    def forward(self, x):
+        pafs, heatmaps = self.render(x.shape[2] // self.stride, x.shape[3] // self.stride)
+        batch_size = x.shape[0]
+        return (
+            torch.from_numpy(pafs)[None].expand(batch_size, -1, -1, -1).to(x.device),
+            torch.from_numpy(heatmaps)[None].expand(batch_size, -1, -1, -1).to(x.device),
+        )
+
+
+def openpose_body_module():
+    """Import annotator/openpose/body.py the way run_openpose.py makes it importable."""
+    # the annotator package imports itself as a top-level module
+    openpose_root = os.path.join(os.path.dirname(os.path.dirname(__file__)), "preprocess", "openpose")
+    if openpose_root not in sys.path:
+        sys.path.insert(0, openpose_root)
+    from preprocess.openpose.annotator.openpose import body
+
+    return body
+
+
+def synthetic_body_estimator(num_people=1):
+    """An OpenPose `Body` whose network is `SyntheticPoseNet`, without loading a checkpoint."""
+    Body = openpose_body_module().Body
+    body = Body.__new__(Body)
+    body.fast = False
+    body.model = SyntheticPoseNet(num_people).eval()
+    return body
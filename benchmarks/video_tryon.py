@@ -0,0 +1,103 @@
+"""
+Per-frame cost and temporal stability of `VideoTryOn` against rendering every frame as a still.
+
+A synthetic clip (a textured figure walking across a fixed background) is rendered by the tiny
+random-weight model (see `benchmarks.synthetic`) with random-weight DensePose (see
+`benchmarks.densepose`). The still baseline runs DensePose and `LeffaInference` with all
+`--steps` on every frame; the video mode runs DensePose on keyframes only, reuses the garment
+encoding and reference features, and warm-starts frames after the first with `--strength` of
+the steps. `flicker` is the mean absolute difference between consecutive generated frames
+(0-255); the clip itself moves by 2 pixels per frame.
+
+    python -m benchmarks.video_tryon --frames 8 --keyframe-interval 4 --strength 0.5
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from benchmarks.common import format_table
+from benchmarks.densepose import DEFAULT_CONFIG, build_predictor
+from benchmarks.synthetic import build_tiny_leffa_model
+from leffa.inference import LeffaInference
+from leffa.transform import LeffaTransform
+from leffa_utils.video import VideoMasks, VideoTryOn
+
+HEIGHT, WIDTH = 256, 192
+
+
+def synthetic_clip(num_frames, seed=0):
+    rng = np.random.RandomState(seed)
+    background = rng.randint(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+    figure = (rng.randint(0, 256, (180, 80, 3)) // 4 + 100).astype(np.uint8)
+    for i in range(num_frames):
+        frame = background.copy()
+        frame[40:220, 40 + 2 * i:120 + 2 * i] = figure
+        yield Image.fromarray(frame)
+
+
+def flicker(images):
+    images = [np.asarray(image, dtype=np.float32) for image in images]
+    return float(np.mean([np.abs(a - b).mean() for a, b in zip(images, images[1:])]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=8)
+    parser.add_argument("--keyframe-interval", type=int, default=4)
+    parser.add_argument("--strength", type=float, default=0.5)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    inference = LeffaInference(build_tiny_leffa_model())
+    densepose = build_predictor(DEFAULT_CONFIG, "", seed=0)
+    garment = next(synthetic_clip(1, seed=1))
+    transform = LeffaTransform(height=HEIGHT, width=WIDTH)
+
+    start = time.perf_counter()
+    masks = VideoMasks(densepose, keyframe_interval=1)
+    stills = []
+    for frame in synthetic_clip(args.frames):
+        mask, densepose_image, _ = masks(np.array(frame))
+        data = transform(
+            {"src_image": [frame], "ref_image": [garment], "mask": [Image.fromarray(mask)],
+             "densepose": [Image.fromarray(densepose_image)]}
+        )
+        stills.append(inference(
+            data, num_inference_steps=args.steps, ref_acceleration=True)["generated_image"][0])
+    still_seconds = (time.perf_counter() - start) / args.frames
+
+    start = time.perf_counter()
+    tryon = VideoTryOn(
+        inference,
+        VideoMasks(densepose, keyframe_interval=args.keyframe_interval),
+        height=HEIGHT,
+        width=WIDTH,
+        num_inference_steps=args.steps,
+        strength=args.strength,
+    )
+    video = list(tryon(synthetic_clip(args.frames), garment))
+    video_seconds = (time.perf_counter() - start) / args.frames
+
+    warm_steps = min(max(int(args.steps * args.strength), 1), args.steps)
+    rows = [
+        {"mode": "stills", "keyframes": args.frames,
+         "steps_per_frame": "{:.1f}".format(args.steps),
+         "s_per_frame": "{:.2f}".format(still_seconds), "speedup": "1.00",
+         "flicker": "{:.1f}".format(flicker(stills))},
+        {"mode": "video", "keyframes": -(-args.frames // args.keyframe_interval),
+         "steps_per_frame": "{:.1f}".format(
+             (args.steps + warm_steps * (args.frames - 1)) / args.frames),
+         "s_per_frame": "{:.2f}".format(video_seconds),
+         "speedup": "{:.2f}".format(still_seconds / video_seconds),
+         "flicker": "{:.1f}".format(flicker(video))},
+    ]
+    print()
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
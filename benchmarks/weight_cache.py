@@ -0,0 +1,144 @@
+"""
+Startup time of `DensePosePredictor` and `AutoMasker` with and without pre-converted weights.
+
+Writes random-weight checkpoints in the formats of the released ones to a temporary directory: a
+detectron2 model zoo pickle for DensePose R50-FPN and SCHP training checkpoints (`module.`
+prefixes, pre-rename keys) for ATR and LIP. Each model is then constructed from the original
+checkpoints and again after `leffa_utils.weight_cache` converted them. `identical` is whether
+every parameter and buffer of the loaded models is equal.
+
+    python -m benchmarks.weight_cache --repeat 2
+"""
+import argparse
+import os
+import pickle
+import shutil
+import tempfile
+
+import torch
+
+from benchmarks.common import format_table, time_fn
+from benchmarks.densepose import DEFAULT_CONFIG
+from leffa_utils.weight_cache import (
+    DENSEPOSE_CONFIG,
+    DENSEPOSE_WEIGHTS,
+    SCHP_CHECKPOINTS,
+    cached_weights_path,
+    convert_densepose,
+    convert_schp,
+)
+
+# inverse of the renames in `SCHP.state_dict_from_ckpt`, applied in reverse order
+SCHP_TRAINING_NAMES = [
+    ("fushion.4.", "fushion.3."),
+    ("decoder.conv3.3.weight", "decoder.conv3.2.weight"),
+    ("decoder.conv3.4.", "decoder.conv3.3."),
+]
+
+
+def write_densepose_checkpoint(directory, seed=0):
+    from densepose import add_densepose_config
+    from detectron2.config import get_cfg
+    from detectron2.modeling import build_model
+
+    config_dir = os.path.dirname(DEFAULT_CONFIG)
+    for name in (DENSEPOSE_CONFIG, "Base-DensePose-RCNN-FPN.yaml"):
+        shutil.copy(os.path.join(config_dir, name), directory)
+    torch.manual_seed(seed)
+    cfg = get_cfg()
+    add_densepose_config(cfg)
+    cfg.merge_from_file(os.path.join(directory, DENSEPOSE_CONFIG))
+    cfg.MODEL.DEVICE = "cpu"
+    state_dict = build_model(cfg).state_dict()
+    with open(os.path.join(directory, DENSEPOSE_WEIGHTS), "wb") as f:
+        pickle.dump(
+            {"model": {k: v.numpy() for k, v in state_dict.items()},
+             "__author__": "Detectron2 Model Zoo"},
+            f,
+        )
+
+
+def write_schp_checkpoints(directory, seed=0):
+    from SCHP import dataset_settings, dataset_type_of, networks  # type: ignore
+
+    torch.manual_seed(seed)
+    for checkpoint in SCHP_CHECKPOINTS:
+        num_classes = dataset_settings[dataset_type_of(checkpoint)]["num_classes"]
+        model = networks.init_model("resnet101", num_classes=num_classes, pretrained=None)
+        state_dict = {}
+        for name, tensor in model.state_dict().items():
+            for new, old in SCHP_TRAINING_NAMES:
+                if name.startswith(new):
+                    name = old + name[len(new):]
+                    break
+            state_dict["module." + name] = tensor
+        torch.save({"state_dict": state_dict}, os.path.join(directory, checkpoint))
+
+
+def state_dicts_equal(a, b):
+    a, b = a.state_dict(), b.state_dict()
+    return a.keys() == b.keys() and all(torch.equal(a[k], b[k]) for k in a)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    from leffa_utils.densepose_predictor import DensePosePredictor
+    from leffa_utils.garment_agnostic_mask_predictor import AutoMasker
+
+    with tempfile.TemporaryDirectory() as root:
+        densepose_dir = os.path.join(root, "densepose")
+        schp_dir = os.path.join(root, "schp")
+        os.makedirs(densepose_dir)
+        os.makedirs(schp_dir)
+        write_densepose_checkpoint(densepose_dir)
+        write_schp_checkpoints(schp_dir)
+        config = os.path.join(densepose_dir, DENSEPOSE_CONFIG)
+        weights = os.path.join(densepose_dir, DENSEPOSE_WEIGHTS)
+        builders = {
+            "DensePosePredictor": lambda: DensePosePredictor(config, weights).predictor.model,
+            "AutoMasker": lambda: AutoMasker(densepose_dir, schp_dir, device="cpu"),
+        }
+
+        def models(built):
+            if isinstance(built, AutoMasker):
+                return [built.densepose_processor.predictor.model,
+                        built.schp_processor_atr.model, built.schp_processor_lip.model]
+            return [built]
+
+        expected, original = {}, {}
+        for name, build in builders.items():
+            expected[name] = models(build())
+            original[name] = time_fn(build, repeat=args.repeat)
+
+        convert_densepose(config, weights)
+        for checkpoint in SCHP_CHECKPOINTS:
+            convert_schp(os.path.join(schp_dir, checkpoint))
+        rows = []
+        for name, build in builders.items():
+            identical = all(
+                state_dicts_equal(a, b) for a, b in zip(models(build()), expected[name]))
+            seconds = time_fn(build, repeat=args.repeat)
+            rows.append(
+                {
+                    "model": name,
+                    "original_s": "{:.2f}".format(original[name]),
+                    "converted_s": "{:.2f}".format(seconds),
+                    "speedup": "{:.2f}".format(original[name] / seconds),
+                    "identical": identical,
+                }
+            )
+            print(rows[-1], flush=True)
+        for path in [weights] + [os.path.join(schp_dir, c) for c in SCHP_CHECKPOINTS]:
+            print("{}: {} MiB, converted {} MiB".format(
+                os.path.basename(path), os.path.getsize(path) // 2**20,
+                os.path.getsize(cached_weights_path(path)) // 2**20))
+
+    print()
+    print(format_table(rows, list(rows[0])))
+
+
+if __name__ == "__main__":
+    main()
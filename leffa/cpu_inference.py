@@ -0,0 +1,106 @@
+import logging
+from typing import Optional
+
+import torch
+import torch.nn as nn
+from torch.ao.nn.quantized import dynamic as nnqd
+from torch.ao.quantization import per_channel_dynamic_qconfig
+
+from leffa.diffusion_model.attention_gen import (
+    BasicTransformerBlock as GenerativeTransformerBlock,
+)
+from leffa.diffusion_model.attention_ref import (
+    BasicTransformerBlock as ReferenceTransformerBlock,
+)
+from leffa.runtime import budget
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class DynamicInt8Linear(nn.Module):
+    """
+    Drop-in replacement for the (LoRA-compatible) Linear layers of a transformer block, backed by
+    a dynamically quantized int8 kernel. Inputs are computed in float32 and the output is cast
+    back, so the layer also works inside a bf16 autocast region.
+    """
+
+    def __init__(self, linear: nn.Linear):
+        super().__init__()
+        float_linear = nn.Linear(
+            linear.in_features, linear.out_features, bias=linear.bias is not None
+        )
+        float_linear.weight.data = linear.weight.data.float()
+        if linear.bias is not None:
+            float_linear.bias.data = linear.bias.data.float()
+        float_linear.qconfig = per_channel_dynamic_qconfig
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+        self.linear = nnqd.Linear.from_float(float_linear)
+
+    def forward(self, hidden_states, *args, **kwargs):
+        # extra args (LoRA `scale`) are accepted for call compatibility and ignored
+        return self.linear(hidden_states.float()).to(hidden_states.dtype)
+
+
+def quantize_transformer_linears(unet: nn.Module) -> int:
+    """
+    Replace every Linear inside the attention_gen/attention_ref transformer blocks (attention
+    projections and feed-forwards) with `DynamicInt8Linear`. Returns the number of replaced layers.
+    """
+    num_replaced = 0
+    for block in unet.modules():
+        if not isinstance(block, (GenerativeTransformerBlock, ReferenceTransformerBlock)):
+            continue
+        for parent in list(block.modules()):
+            for name, child in list(parent.named_children()):
+                if isinstance(child, nn.Linear):
+                    setattr(parent, name, DynamicInt8Linear(child))
+                    num_replaced += 1
+    return num_replaced
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether the host CPU has native bf16 dot products (AVX512-BF16 or AMX)."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def optimize_for_cpu(
+    model: nn.Module,
+    quantize: bool = True,
+    bf16: Optional[bool] = None,
+    channels_last: bool = True,
+    num_threads: Optional[int] = None,
+) -> Optional[torch.dtype]:
+    """
+    Prepare a float32 `LeffaModel` for CPU inference in place.
+
+    - dynamic int8 quantization of the Linear layers in both UNets' transformer blocks
+    - `channels_last` layout for the convolutions of the UNets and the VAE
+    - intra-op threads set to `num_threads`, or the per-worker share of the `leffa.runtime`
+      thread budget
+
+    Returns the dtype to autocast the forward pass to (`torch.bfloat16` when `bf16` is True, or
+    when it is None and the CPU supports bf16 natively), else None. Pass it to
+    `LeffaInference(autocast_dtype=...)`.
+    """
+    model.eval()
+    if quantize:
+        num_quantized = quantize_transformer_linears(model.unet)
+        num_quantized += quantize_transformer_linears(model.unet_encoder)
+        logger.info("Quantized {} Linear layers to int8".format(num_quantized))
+    if channels_last:
+        for module in (model.unet, model.unet_encoder, model.vae):
+            module.to(memory_format=torch.channels_last)
+
+    num_threads = num_threads or budget().torch_threads
+    torch.set_num_threads(num_threads)
+    logger.info("Using {} intra-op threads".format(num_threads))
+
+    if bf16 is None:
+        bf16 = cpu_supports_bf16()
+    return torch.bfloat16 if bf16 else None
@@ -16,13 +16,16 @@ class LeffaInference(object):
     def __init__(
         self,
         model: nn.Module,
+        autocast_dtype: Optional[torch.dtype] = None,
     ) -> None:
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # e.g. torch.bfloat16 on CPUs with native bf16, see leffa.cpu_inference
+        self.autocast_dtype = autocast_dtype
 
         self.model = model.to(self.device)
         self.model.eval()
 
-        self.pipe = LeffaPipeline(model=self.model)
+        self.pipe = LeffaPipeline(model=self.model, device=self.device)
 
     def to_gpu(self, data: Dict[str, Any]) -> Dict[str, Any]:
         for k, v in data.items():
@@ -30,6 +33,21 @@ class LeffaInference(object):
                 data[k] = v.to(self.device)
         return data
 
+    def autocast(self):
+        # autocast state is per thread; every thread running the model enters it
+        return torch.autocast(
+            device_type=torch.device(self.device).type,
+            dtype=self.autocast_dtype,
+            enabled=self.autocast_dtype is not None,
+        )
+
+    def outputs(self, data: Dict[str, Any], images) -> Dict[str, Any]:
+        outputs = {}
+        outputs["src_image"] = (data["src_image"] + 1.0) / 2.0
+        outputs["ref_image"] = (data["ref_image"] + 1.0) / 2.0
+        outputs["generated_image"] = images
+        return outputs
+
     def __call__(self, data: Dict[str, Any], **kwargs) -> Dict[str, Any]:
         data = self.to_gpu(data)
 
@@ -39,23 +57,20 @@ class LeffaInference(object):
         seed = kwargs.get("seed", 42)
         repaint = kwargs.get("repaint", False)
         generator = torch.Generator(self.pipe.device).manual_seed(seed)
-        images = self.pipe(
-            src_image=data["src_image"],
-            ref_image=data["ref_image"],
-            mask=data["mask"],
-            densepose=data["densepose"],
-            ref_acceleration=ref_acceleration,
-            num_inference_steps=num_inference_steps,
-            guidance_scale=guidance_scale,
-            generator=generator,
-            repaint=repaint,
-        )[0]
+        with self.autocast():
+            images = self.pipe(
+                src_image=data["src_image"],
+                ref_image=data["ref_image"],
+                mask=data["mask"],
+                densepose=data["densepose"],
+                ref_acceleration=ref_acceleration,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                generator=generator,
+                repaint=repaint,
+            )[0]
 
         # images = [pil_to_tensor(image) for image in images]
         # images = torch.stack(images)
 
-        outputs = {}
-        outputs["src_image"] = (data["src_image"] + 1.0) / 2.0
-        outputs["ref_image"] = (data["ref_image"] + 1.0) / 2.0
-        outputs["generated_image"] = images
-        return outputs
+        return self.outputs(data, images)
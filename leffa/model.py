@@ -1,4 +1,6 @@
 import logging
+import math
+from typing import Optional
 
 import torch
 import torch.nn as nn
@@ -24,6 +26,8 @@ class LeffaModel(nn.Module):
         height: int = 1024,
         width: int = 768,
         dtype: str = "float16",
+        attention_processor: str = "sdpa",  # sdpa or chunked
+        attention_memory_budget_mb: Optional[float] = None,
     ):
         super().__init__()
 
@@ -34,6 +38,8 @@ class LeffaModel(nn.Module):
             pretrained_model_name_or_path,
             pretrained_model,
             new_in_channels,
+            attention_processor,
+            attention_memory_budget_mb,
         )
 
         if dtype == "float16":
@@ -44,6 +50,8 @@ class LeffaModel(nn.Module):
         pretrained_model_name_or_path: str = "",
         pretrained_model: str = "",
         new_in_channels: int = 12,
+        attention_processor: str = "sdpa",
+        attention_memory_budget_mb: Optional[float] = None,
     ):
         diffusion_model_type = ""
         if "stable-diffusion-inpainting" in pretrained_model_name_or_path:
@@ -116,8 +124,24 @@ class LeffaModel(nn.Module):
             self.unet_encoder.config.out_channels = self.vae.config.latent_channels
 
         # Remove Cross Attention
-        remove_cross_attention(self.unet)
-        remove_cross_attention(self.unet_encoder, model_type="unet_encoder")
+        if attention_processor == "sdpa":
+            self_attn_cls, self_attn_kwargs = None, {}
+        elif attention_processor == "chunked":
+            self_attn_cls = ChunkedAttnProcessor
+            self_attn_kwargs = {"memory_budget_mb": attention_memory_budget_mb}
+        else:
+            raise ValueError(
+                "attention_processor must be 'sdpa' or 'chunked', got {}".format(
+                    attention_processor)
+            )
+        remove_cross_attention(
+            self.unet, self_attn_cls=self_attn_cls, **self_attn_kwargs)
+        remove_cross_attention(
+            self.unet_encoder,
+            self_attn_cls=self_attn_cls,
+            model_type="unet_encoder",
+            **self_attn_kwargs,
+        )
 
         # Load pretrained model
         if pretrained_model != "" and pretrained_model is not None:
@@ -333,10 +357,7 @@ class AttnProcessor2_0(torch.nn.Module):
                            head_dim).transpose(1, 2)
 
         # the output of sdp = (batch, num_heads, seq_len, head_dim)
-        # TODO: add support for attn.scale when we move to Torch 2.1
-        hidden_states = F.scaled_dot_product_attention(
-            query, key, value, attn_mask=attention_mask, dropout_p=0.0, is_causal=False
-        )
+        hidden_states = self.attention(query, key, value, attention_mask)
 
         hidden_states = hidden_states.transpose(1, 2).reshape(
             batch_size, -1, attn.heads * head_dim
@@ -359,3 +380,171 @@ class AttnProcessor2_0(torch.nn.Module):
         hidden_states = hidden_states / attn.rescale_output_factor
 
         return hidden_states
+
+    def attention(self, query, key, value, attention_mask=None):
+        # TODO: add support for attn.scale when we move to Torch 2.1
+        return F.scaled_dot_product_attention(
+            query, key, value, attn_mask=attention_mask, dropout_p=0.0, is_causal=False
+        )
+
+
+class ChunkedAttnProcessor(AttnProcessor2_0):
+    r"""
+    Processor computing attention over query/key chunks with an online softmax.
+
+    In the generative UNet every `attn1` attends over the latent tokens concatenated with the
+    reference tokens, so a full attention matrix is (2 * h * w)^2 per head. This processor keeps
+    the live score block under `memory_budget_mb`, which matters on CPU and on GPUs where
+    `F.scaled_dot_product_attention` falls back to the math kernel.
+    """
+
+    def __init__(
+        self,
+        hidden_size=None,
+        cross_attention_dim=None,
+        layer_name=None,
+        memory_budget_mb=None,
+        query_chunk_size=None,
+        key_chunk_size=None,
+        **kwargs,
+    ):
+        super().__init__(
+            hidden_size=hidden_size,
+            cross_attention_dim=cross_attention_dim,
+            layer_name=layer_name,
+            **kwargs,
+        )
+        self.memory_budget_mb = (
+            memory_budget_mb if memory_budget_mb is not None else 256.0
+        )
+        self.query_chunk_size = query_chunk_size
+        self.key_chunk_size = key_chunk_size
+
+    def chunk_sizes(self, query, key):
+        if self.query_chunk_size is not None or self.key_chunk_size is not None:
+            return self.query_chunk_size, self.key_chunk_size
+        return attention_chunk_sizes(
+            query.shape[:-2].numel(),
+            query.shape[-2],
+            key.shape[-2],
+            self.memory_budget_mb,
+        )
+
+    def attention(self, query, key, value, attention_mask=None):
+        query_chunk_size, key_chunk_size = self.chunk_sizes(query, key)
+        return chunked_scaled_dot_product_attention(
+            query,
+            key,
+            value,
+            attn_mask=attention_mask,
+            query_chunk_size=query_chunk_size,
+            key_chunk_size=key_chunk_size,
+        )
+
+
+def attention_chunk_sizes(
+    num_rows, query_length, key_length, memory_budget_mb, min_query_chunk_size=256
+):
+    """
+    Pick (query_chunk_size, key_chunk_size) so that a float32 score block for `num_rows`
+    (batch * heads) rows fits in `memory_budget_mb`. The softmax keeps roughly two
+    block-sized temporaries alive, which is accounted for here.
+    """
+    budget_elements = int(memory_budget_mb * 1024 * 1024) // (4 * 2)
+    budget_elements = max(budget_elements // max(num_rows, 1), 1)
+    # Prefer full keys: the per-chunk softmax is then exact and handled by SDPA.
+    query_chunk_size = budget_elements // key_length
+    if query_chunk_size >= min(min_query_chunk_size, query_length):
+        return min(query_chunk_size, query_length), key_length
+    query_chunk_size = min(min_query_chunk_size, query_length)
+    key_chunk_size = max(budget_elements // query_chunk_size, 1)
+    return query_chunk_size, min(key_chunk_size, key_length)
+
+
+def chunked_scaled_dot_product_attention(
+    query, key, value, attn_mask=None, query_chunk_size=None, key_chunk_size=None
+):
+    """
+    Memory-efficient equivalent of `F.scaled_dot_product_attention` (no dropout, not causal).
+
+    Queries are split into blocks of `query_chunk_size`. If all keys fit in one block the
+    softmax is exact per query block and SDPA is used directly; otherwise keys are consumed in
+    blocks of `key_chunk_size` with a running max and normaliser (online softmax), accumulating
+    in float32.
+    """
+    query_length, key_length = query.shape[-2], key.shape[-2]
+    query_chunk_size = min(query_chunk_size or query_length, query_length)
+    key_chunk_size = min(key_chunk_size or key_length, key_length)
+
+    if attn_mask is not None and attn_mask.dtype == torch.bool:
+        attn_mask = torch.zeros_like(attn_mask, dtype=query.dtype).masked_fill(
+            ~attn_mask, torch.finfo(query.dtype).min
+        )
+
+    def mask_block(q_start, q_end, k_start, k_end):
+        if attn_mask is None:
+            return None
+        block = attn_mask
+        if block.shape[-2] != 1:
+            block = block[..., q_start:q_end, :]
+        if block.shape[-1] != 1:
+            block = block[..., k_start:k_end]
+        return block
+
+    if key_chunk_size >= key_length:
+        if query_chunk_size >= query_length:
+            return F.scaled_dot_product_attention(
+                query, key, value, attn_mask=attn_mask, dropout_p=0.0, is_causal=False
+            )
+        output = torch.empty(
+            query.shape[:-1] + value.shape[-1:], dtype=query.dtype, device=query.device
+        )
+        for q_start in range(0, query_length, query_chunk_size):
+            q_end = min(q_start + query_chunk_size, query_length)
+            output[..., q_start:q_end, :] = F.scaled_dot_product_attention(
+                query[..., q_start:q_end, :],
+                key,
+                value,
+                attn_mask=mask_block(q_start, q_end, 0, key_length),
+                dropout_p=0.0,
+                is_causal=False,
+            )
+        return output
+
+    acc_dtype = torch.float32 if query.dtype in (
+        torch.float16, torch.bfloat16) else query.dtype
+    scale = 1.0 / math.sqrt(query.shape[-1])
+    output = torch.empty(
+        query.shape[:-1] + value.shape[-1:], dtype=query.dtype, device=query.device
+    )
+    for q_start in range(0, query_length, query_chunk_size):
+        q_end = min(q_start + query_chunk_size, query_length)
+        q = query[..., q_start:q_end, :].to(acc_dtype) * scale
+        running_max = None
+        running_sum = None
+        acc = None
+        for k_start in range(0, key_length, key_chunk_size):
+            k_end = min(k_start + key_chunk_size, key_length)
+            scores = torch.matmul(
+                q, key[..., k_start:k_end, :].to(acc_dtype).transpose(-1, -2))
+            mask = mask_block(q_start, q_end, k_start, k_end)
+            if mask is not None:
+                scores = scores + mask.to(acc_dtype)
+            block_max = scores.amax(dim=-1, keepdim=True)
+            if running_max is None:
+                new_max = block_max
+            else:
+                new_max = torch.maximum(running_max, block_max)
+            scores.sub_(new_max).exp_()
+            block_out = torch.matmul(scores, value[..., k_start:k_end, :].to(acc_dtype))
+            block_sum = scores.sum(dim=-1, keepdim=True)
+            if running_max is None:
+                acc, running_sum = block_out, block_sum
+            else:
+                correction = torch.exp(running_max - new_max)
+                acc = acc * correction + block_out
+                running_sum = running_sum * correction + block_sum
+            running_max = new_max
+            del scores
+        output[..., q_start:q_end, :] = (acc / running_sum).to(query.dtype)
+    return output
@@ -1,4 +1,9 @@
 import inspect
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Union
 
 import numpy as np
 import torch
@@ -7,6 +12,10 @@ import torch.nn.functional as F
 import tqdm
 from PIL import Image, ImageFilter
 
+from leffa import tracing
+
+logger: logging.Logger = logging.getLogger(__name__)
+
 
 class LeffaPipeline(object):
     def __init__(
@@ -19,15 +28,146 @@ class LeffaPipeline(object):
         self.unet = model.unet
         self.noise_scheduler = model.noise_scheduler
         self.device = device
+        # set by `place_reference_unet` when the reference UNet runs on another device
+        self.reference_device = None
+
+        # per-step functions, replaced by compiled versions in `enable_compile`; eager mode runs
+        # the generative UNet and the guidance separately so they can be traced on their own
+        self.reference_step = self.extract_reference_features
+        self.generative_step = None
+        self.batch_buckets = None
+
+    def enable_compile(self, batch_buckets=(1,), cache_dir=None, mode=None):
+        """
+        Opt-in compiled inference: the reference UNet forward and the generative UNet forward plus
+        guidance combination are wrapped in `torch.compile` with static shapes. Batches are padded
+        up to the nearest size in `batch_buckets`, so only one graph per bucket is ever built (see
+        `warmup`). Compiled artifacts are cached under `cache_dir` (default
+        $TORCHINDUCTOR_CACHE_DIR) and reused across restarts.
+        """
+        if cache_dir is not None:
+            os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+        import torch._inductor.config as inductor_config
+
+        inductor_config.fx_graph_cache = True
+        try:
+            import torch._functorch.config as functorch_config
 
-    def prepare_extra_step_kwargs(self, generator, eta):
+            functorch_config.enable_autograd_cache = True
+        except (ImportError, AttributeError):
+            pass
+
+        self.batch_buckets = sorted(batch_buckets)
+        self.reference_step = torch.compile(
+            self.extract_reference_features, dynamic=False, mode=mode
+        )
+        self.generative_step = torch.compile(
+            self.predict_guided_noise, dynamic=False, mode=mode)
+
+    def warmup(self, height=1024, width=768, ref_acceleration=False, **kwargs):
+        """
+        Run one denoising step per batch bucket to trigger compilation ahead of the first request.
+        Returns {batch_size: seconds}.
+        """
+        timings = {}
+        for batch_size in self.batch_buckets or [1]:
+            start = time.perf_counter()
+            self(
+                src_image=torch.zeros(batch_size, 3, height, width),
+                ref_image=torch.zeros(batch_size, 3, height, width),
+                mask=torch.ones(batch_size, 1, height, width),
+                densepose=torch.zeros(batch_size, 3, height, width),
+                ref_acceleration=ref_acceleration,
+                num_inference_steps=1,
+                **kwargs,
+            )
+            timings[batch_size] = time.perf_counter() - start
+            logger.info(
+                "Warmed up batch bucket {} in {:.1f}s".format(
+                    batch_size, timings[batch_size])
+            )
+        return timings
+
+    def bucket_size(self, batch_size):
+        if self.batch_buckets is None:
+            return batch_size
+        for bucket in self.batch_buckets:
+            if bucket >= batch_size:
+                return bucket
+        raise ValueError(
+            "Batch size {} exceeds the largest compiled bucket {}".format(
+                batch_size, self.batch_buckets[-1])
+        )
+
+    def extract_reference_features(self, ref_image_latent, t):
+        _, reference_features = self.unet_encoder(
+            ref_image_latent, t, encoder_hidden_states=None, return_dict=False
+        )
+        return list(reference_features)
+
+    def predict_noise(self, latent_model_input, condition_latent, t, reference_features):
+        # prepare the input for the inpainting model
+        latent_model_input = torch.cat(
+            [latent_model_input, condition_latent], dim=1)
+
+        # predict the noise residual
+        return self.unet(
+            latent_model_input,
+            t,
+            encoder_hidden_states=None,
+            cross_attention_kwargs=None,
+            added_cond_kwargs=None,
+            reference_features=reference_features,
+            return_dict=False,
+        )[0]
+
+    def predict_guided_noise(
+        self,
+        latent_model_input,
+        condition_latent,
+        t,
+        reference_features,
+        guidance_scale,
+        do_classifier_free_guidance=True,
+        rescale_guidance=True,
+    ):
+        noise_pred = self.predict_noise(
+            latent_model_input, condition_latent, t, reference_features)
+        return self.apply_guidance(
+            noise_pred, guidance_scale, do_classifier_free_guidance, rescale_guidance)
+
+    def apply_guidance(
+        self,
+        noise_pred,
+        guidance_scale,
+        do_classifier_free_guidance=True,
+        rescale_guidance=True,
+    ):
+        # perform guidance
+        if do_classifier_free_guidance:
+            noise_pred_uncond, noise_pred_cond = noise_pred.chunk(2)
+            noise_pred = noise_pred_uncond + guidance_scale * (
+                noise_pred_cond - noise_pred_uncond
+            )
+
+        if rescale_guidance:
+            # Based on 3.4. in https://arxiv.org/pdf/2305.08891.pdf
+            noise_pred = rescale_noise_cfg(
+                noise_pred,
+                noise_pred_cond,
+                guidance_rescale=guidance_scale,
+            )
+        return noise_pred
+
+    def prepare_extra_step_kwargs(self, generator, eta, scheduler=None):
         # prepare extra kwargs for the scheduler step, since not all schedulers have the same signature
         # eta (η) is only used with the DDIMScheduler, it will be ignored for other schedulers.
         # eta corresponds to η in DDIM paper: https://arxiv.org/abs/2010.02502
         # and should be between [0, 1]
 
+        scheduler = self.noise_scheduler if scheduler is None else scheduler
         accepts_eta = "eta" in set(
-            inspect.signature(self.noise_scheduler.step).parameters.keys()
+            inspect.signature(scheduler.step).parameters.keys()
         )
         extra_step_kwargs = {}
         if accepts_eta:
@@ -35,43 +175,67 @@ class LeffaPipeline(object):
 
         # check if the scheduler accepts generator
         accepts_generator = "generator" in set(
-            inspect.signature(self.noise_scheduler.step).parameters.keys()
+            inspect.signature(scheduler.step).parameters.keys()
         )
         if accepts_generator:
             extra_step_kwargs["generator"] = generator
         return extra_step_kwargs
 
+    def place_reference_unet(self, device):
+        """
+        Run the reference UNet on `device`, e.g. a second GPU, while the generative UNet stays
+        where it is. The reference latent is moved there once per request and the reference
+        features are moved back for every reference pass (once per request with
+        `ref_acceleration`).
+        """
+        self.unet_encoder.to(device)
+        self.reference_device = torch.device(device)
+
     @torch.no_grad()
-    def __call__(
+    def prepare(
         self,
         src_image,
         ref_image,
         mask,
         densepose,
-        ref_acceleration=False,
         num_inference_steps=50,
         do_classifier_free_guidance=True,
         guidance_scale=2.5,
-        generator=None,
-        eta=1.0,
-        repaint=False,  # used for virtual try-on
-        **kwargs,
+        scheduler=None,
+        reference=None,
+        init_latent=None,
+        strength=1.0,
     ):
+        """
+        VAE encoding and conditioning of one request, up to the initial noise. `scheduler`
+        defaults to the pipeline's; requests in flight at the same time need their own copy.
+
+        `reference` is the state of an earlier request with the same reference image and batch
+        size, whose reference latent is reused instead of encoding `ref_image` (which may then
+        be None). With `init_latent`, e.g. the result of a previous video frame, the loop starts
+        from it noised to `strength` (0~1) of the schedule and runs only the remaining steps.
+        """
+        scheduler = self.noise_scheduler if scheduler is None else scheduler
         src_image = src_image.to(device=self.vae.device, dtype=self.vae.dtype)
-        ref_image = ref_image.to(device=self.vae.device, dtype=self.vae.dtype)
         mask = mask.to(device=self.vae.device, dtype=self.vae.dtype)
         densepose = densepose.to(device=self.vae.device, dtype=self.vae.dtype)
         masked_image = src_image * (mask < 0.5)
 
         # 1. VAE encoding
-        with torch.no_grad():
+        with torch.no_grad(), tracing.span("vae_encode"):
             # src_image_latent = self.vae.encode(src_image).latent_dist.sample()
             masked_image_latent = self.vae.encode(
                 masked_image).latent_dist.sample()
-            ref_image_latent = self.vae.encode(ref_image).latent_dist.sample()
+            if reference is None:
+                ref_image = ref_image.to(device=self.vae.device, dtype=self.vae.dtype)
+                ref_image_latent = self.vae.encode(ref_image).latent_dist.sample()
         # src_image_latent = src_image_latent * self.vae.config.scaling_factor
         masked_image_latent = masked_image_latent * self.vae.config.scaling_factor
-        ref_image_latent = ref_image_latent * self.vae.config.scaling_factor
+        if reference is None:
+            ref_image_latent = ref_image_latent * self.vae.config.scaling_factor
+        else:
+            # already padded and, with guidance, paired with its unconditional zeros
+            ref_image_latent = reference.ref_image_latent
         mask_latent = F.interpolate(
             mask, size=masked_image_latent.shape[-2:], mode="nearest")
         densepose_latent = F.interpolate(
@@ -79,115 +243,253 @@ class LeffaPipeline(object):
 
         # 2. prepare noise
         noise = torch.randn_like(masked_image_latent)
-        self.noise_scheduler.set_timesteps(
+        scheduler.set_timesteps(
             num_inference_steps, device=self.device)
-        timesteps = self.noise_scheduler.timesteps
-        noise = noise * self.noise_scheduler.init_noise_sigma
-        latent = noise
+        timesteps = scheduler.timesteps
+        if init_latent is None:
+            noise = noise * scheduler.init_noise_sigma
+            latent = noise
+        else:
+            # as diffusers' img2img: skip the first (1 - strength) of the steps, but run at least
+            # one, or the loop would start from an empty schedule
+            t_start = num_inference_steps - min(
+                max(int(num_inference_steps * strength), 1), num_inference_steps)
+            timesteps = timesteps[t_start * scheduler.order:]
+            num_inference_steps = num_inference_steps - t_start
+            if hasattr(scheduler, "set_begin_index"):
+                scheduler.set_begin_index(t_start * scheduler.order)
+            init_latent = init_latent.to(device=noise.device, dtype=noise.dtype)
+            latent = scheduler.add_noise(
+                init_latent, noise, timesteps[:1].repeat(init_latent.shape[0]))
+
+        # compiled steps only see bucketed batch sizes; the latent itself (and with it every
+        # random draw of the scheduler) keeps the real batch size
+        batch_size = latent.shape[0]
+        padded_batch_size = self.bucket_size(batch_size)
+        masked_image_latent, mask_latent, densepose_latent = [
+            pad_batch(x, padded_batch_size)
+            for x in (masked_image_latent, mask_latent, densepose_latent)
+        ]
+        if reference is None:
+            ref_image_latent = pad_batch(ref_image_latent, padded_batch_size)
 
         # 3. classifier-free guidance
         if do_classifier_free_guidance:
             # src_image_latent = torch.cat([src_image_latent] * 2)
             masked_image_latent = torch.cat([masked_image_latent] * 2)
-            ref_image_latent = torch.cat(
-                [torch.zeros_like(ref_image_latent), ref_image_latent])
+            if reference is None:
+                ref_image_latent = torch.cat(
+                    [torch.zeros_like(ref_image_latent), ref_image_latent])
             mask_latent = torch.cat([mask_latent] * 2)
             densepose_latent = torch.cat([densepose_latent] * 2)
+        condition_latent = torch.cat(
+            [mask_latent, masked_image_latent, densepose_latent], dim=1)
+        rescale_guidance = do_classifier_free_guidance and guidance_scale > 0.0
+        if self.batch_buckets is not None:
+            # a tensor avoids recompiling for every distinct guidance scale
+            guidance_scale = torch.tensor(
+                guidance_scale, device=latent.device, dtype=latent.dtype)
+
+        return DenoisingState(
+            src_image=src_image,
+            mask=mask,
+            latent=latent,
+            ref_image_latent=ref_image_latent,
+            condition_latent=condition_latent,
+            timesteps=timesteps,
+            scheduler=scheduler,
+            num_inference_steps=num_inference_steps,
+            batch_size=batch_size,
+            padded_batch_size=padded_batch_size,
+            do_classifier_free_guidance=do_classifier_free_guidance,
+            guidance_scale=guidance_scale,
+            rescale_guidance=rescale_guidance,
+        )
+
+    @torch.no_grad()
+    def reference_features(self, state, ref_acceleration=False):
+        """
+        Yield the reference features of a prepared request: once with `ref_acceleration`,
+        otherwise once per timestep. They depend on the reference latent and the timestep only,
+        so they can be computed ahead of the denoising loop that consumes them.
+        """
+        ref_image_latent = state.ref_image_latent
+        if self.reference_device is not None:
+            ref_image_latent = ref_image_latent.to(self.reference_device)
+        if ref_acceleration:
+            timesteps = [state.timesteps[state.num_inference_steps//2]]
+        else:
+            timesteps = state.timesteps
+        for t in timesteps:
+            with tracing.span("reference_unet"):
+                if self.reference_device is not None:
+                    features = self.reference_step(ref_image_latent, t.to(self.reference_device))
+                    features = [f.to(state.latent.device, non_blocking=True) for f in features]
+                else:
+                    features = self.reference_step(ref_image_latent, t)
+            yield features
+
+    @torch.no_grad()
+    def denoise(self, state, reference_features, ref_acceleration=False, generator=None, eta=1.0):
+        """Run the denoising loop of a prepared request; returns the final latent."""
+        scheduler = state.scheduler
+        timesteps = state.timesteps
+        num_inference_steps = state.num_inference_steps
+        do_classifier_free_guidance = state.do_classifier_free_guidance
+        latent = state.latent
+        reference_features = iter(reference_features)
 
         # 6. Denoising loop
-        extra_step_kwargs = self.prepare_extra_step_kwargs(generator, eta)
+        extra_step_kwargs = self.prepare_extra_step_kwargs(generator, eta, scheduler)
         num_warmup_steps = (
-            len(timesteps) - num_inference_steps * self.noise_scheduler.order
+            len(timesteps) - num_inference_steps * scheduler.order
         )
 
         if ref_acceleration:
-            down, reference_features = self.unet_encoder(
-                ref_image_latent, timesteps[num_inference_steps//2], encoder_hidden_states=None, return_dict=False
-            )
-            reference_features = list(reference_features)
+            features = next(reference_features)
 
         with tqdm.tqdm(total=num_inference_steps) as progress_bar:
             for i, t in enumerate(timesteps):
                 # expand the latent if we are doing classifier free guidance
+                _latent_model_input = pad_batch(latent, state.padded_batch_size)
                 _latent_model_input = (
                     torch.cat(
-                        [latent] * 2) if do_classifier_free_guidance else latent
+                        [_latent_model_input] * 2) if do_classifier_free_guidance else _latent_model_input
                 )
-                _latent_model_input = self.noise_scheduler.scale_model_input(
+                _latent_model_input = scheduler.scale_model_input(
                     _latent_model_input, t
                 )
 
-                # prepare the input for the inpainting model
-                latent_model_input = torch.cat(
-                    [
-                        _latent_model_input,
-                        mask_latent,
-                        masked_image_latent,
-                        densepose_latent,
-                    ],
-                    dim=1,
-                )
-
                 if not ref_acceleration:
-                    down, reference_features = self.unet_encoder(
-                        ref_image_latent, t, encoder_hidden_states=None, return_dict=False
-                    )
-                    reference_features = list(reference_features)
-
-                # predict the noise residual
-                noise_pred = self.unet(
-                    latent_model_input,
-                    t,
-                    encoder_hidden_states=None,
-                    cross_attention_kwargs=None,
-                    added_cond_kwargs=None,
-                    reference_features=reference_features,
-                    return_dict=False,
-                )[0]
-                # perform guidance
-                if do_classifier_free_guidance:
-                    noise_pred_uncond, noise_pred_cond = noise_pred.chunk(2)
-                    noise_pred = noise_pred_uncond + guidance_scale * (
-                        noise_pred_cond - noise_pred_uncond
-                    )
-
-                if do_classifier_free_guidance and guidance_scale > 0.0:
-                    # Based on 3.4. in https://arxiv.org/pdf/2305.08891.pdf
-                    noise_pred = rescale_noise_cfg(
-                        noise_pred,
-                        noise_pred_cond,
-                        guidance_rescale=guidance_scale,
-                    )
+                    features = next(reference_features)
+
+                if self.generative_step is not None:
+                    # compiled: generative UNet and guidance form one graph
+                    with tracing.span("gen_unet_guided"):
+                        noise_pred = self.generative_step(
+                            _latent_model_input,
+                            state.condition_latent,
+                            t,
+                            features,
+                            state.guidance_scale,
+                            do_classifier_free_guidance=do_classifier_free_guidance,
+                            rescale_guidance=state.rescale_guidance,
+                        )
+                else:
+                    with tracing.span("gen_unet"):
+                        noise_pred = self.predict_noise(
+                            _latent_model_input, state.condition_latent, t, features
+                        )
+                    with tracing.span("guidance"):
+                        noise_pred = self.apply_guidance(
+                            noise_pred,
+                            state.guidance_scale,
+                            do_classifier_free_guidance=do_classifier_free_guidance,
+                            rescale_guidance=state.rescale_guidance,
+                        )
+                noise_pred = noise_pred[:state.batch_size]
 
                 # compute the previous noisy sample x_t -> x_t-1
-                latent = self.noise_scheduler.step(
-                    noise_pred, t, latent, **extra_step_kwargs, return_dict=False
-                )[0]
+                with tracing.span("scheduler_step"):
+                    latent = scheduler.step(
+                        noise_pred, t, latent, **extra_step_kwargs, return_dict=False
+                    )[0]
                 # call the callback, if provided
                 if i == len(timesteps) - 1 or (
                     (i + 1) > num_warmup_steps
-                    and (i + 1) % self.noise_scheduler.order == 0
+                    and (i + 1) % scheduler.order == 0
                 ):
                     progress_bar.update()
+        return latent
 
+    @torch.no_grad()
+    def finish(self, state, latent, repaint=False):
+        """Decode the final latent of a request to PIL images, optionally repainted."""
         # Decode the final latent
-        gen_image = latent_to_image(latent, self.vae)
+        with tracing.span("vae_decode"):
+            gen_image = latent_to_image(latent, self.vae)
 
         if repaint:
-            src_image = (src_image / 2 + 0.5).clamp(0, 1)
-            src_image = src_image.cpu().permute(0, 2, 3, 1).float().numpy()
-            src_image = numpy_to_pil(src_image)
-            mask = mask.cpu().permute(0, 2, 3, 1).float().numpy()
-            mask = numpy_to_pil(mask)
-            mask = [i.convert("RGB") for i in mask]
-            gen_image = [
-                do_repaint(_src_image, _mask, _gen_image)
-                for _src_image, _mask, _gen_image in zip(src_image, mask, gen_image)
-            ]
+            with tracing.span("repaint"):
+                src_image = (state.src_image / 2 + 0.5).clamp(0, 1)
+                src_image = src_image.cpu().permute(0, 2, 3, 1).float().numpy()
+                src_image = numpy_to_pil(src_image)
+                mask = state.mask.cpu().permute(0, 2, 3, 1).float().numpy()
+                mask = numpy_to_pil(mask)
+                mask = [i.convert("RGB") for i in mask]
+                gen_image = [
+                    do_repaint(_src_image, _mask, _gen_image)
+                    for _src_image, _mask, _gen_image in zip(src_image, mask, gen_image)
+                ]
+        return gen_image
 
+    @torch.no_grad()
+    def __call__(
+        self,
+        src_image,
+        ref_image,
+        mask,
+        densepose,
+        ref_acceleration=False,
+        num_inference_steps=50,
+        do_classifier_free_guidance=True,
+        guidance_scale=2.5,
+        generator=None,
+        eta=1.0,
+        repaint=False,  # used for virtual try-on
+        **kwargs,
+    ):
+        state = self.prepare(
+            src_image,
+            ref_image,
+            mask,
+            densepose,
+            num_inference_steps=num_inference_steps,
+            do_classifier_free_guidance=do_classifier_free_guidance,
+            guidance_scale=guidance_scale,
+        )
+        latent = self.denoise(
+            state,
+            self.reference_features(state, ref_acceleration),
+            ref_acceleration=ref_acceleration,
+            generator=generator,
+            eta=eta,
+        )
+        gen_image = self.finish(state, latent, repaint=repaint)
         return (gen_image,)
 
 
+@dataclass
+class DenoisingState:
+    """A request between `LeffaPipeline.prepare` and `LeffaPipeline.finish`."""
+
+    src_image: torch.Tensor
+    mask: torch.Tensor
+    latent: torch.Tensor
+    ref_image_latent: torch.Tensor
+    condition_latent: torch.Tensor
+    timesteps: torch.Tensor
+    scheduler: Any
+    num_inference_steps: int
+    batch_size: int
+    padded_batch_size: int
+    do_classifier_free_guidance: bool
+    guidance_scale: Union[float, torch.Tensor]
+    rescale_guidance: bool
+
+    def tensors(self):
+        return [self.src_image, self.mask, self.latent, self.ref_image_latent,
+                self.condition_latent]
+
+
+def pad_batch(x, batch_size):
+    """Pad `x` along dim 0 to `batch_size` by repeating its last sample."""
+    if x.shape[0] == batch_size:
+        return x
+    padding = x[-1:].expand(batch_size - x.shape[0], *x.shape[1:])
+    return torch.cat([x, padding])
+
+
 def latent_to_image(latent, vae):
     latent = 1 / vae.config.scaling_factor * latent
     image = vae.decode(latent).sample
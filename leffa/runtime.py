@@ -0,0 +1,207 @@
+"""
+CPU thread budget shared by PyTorch, ONNX Runtime, OpenCV and request-level worker pools.
+
+Each of these sizes its thread pool for the whole machine by default, so models running side by
+side and concurrent requests oversubscribe the cores. `configure` divides a core budget between
+`workers` concurrent requests and applies it to PyTorch and OpenCV; ONNX Runtime sessions and
+worker pools read it through `budget()` and `onnx_session_options()`. It can first pin the
+process to one logical CPU per physical core or to a NUMA node.
+
+Entry points call `configure()` once at startup, before any thread pool is created. Defaults
+come from the environment:
+
+- LEFFA_CPU_CORES: cores in the budget (default: physical cores available to the process)
+- LEFFA_WORKERS: requests processed concurrently (default: 1)
+- LEFFA_CPU_AFFINITY: "cores" or "numa:<node>" to pin the process (default: no pinning)
+"""
+import logging
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+import torch
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ThreadBudget:
+    cores: int
+    workers: int = 1
+    cpus: Optional[List[int]] = None  # the process affinity, if it was pinned
+
+    @property
+    def threads_per_worker(self) -> int:
+        return max(self.cores // self.workers, 1)
+
+    @property
+    def torch_threads(self) -> int:
+        # OpenMP gives every calling thread its own team of this size
+        return self.threads_per_worker
+
+    @property
+    def onnx_intra_op_threads(self) -> int:
+        return self.threads_per_worker
+
+    @property
+    def onnx_inter_op_threads(self) -> int:
+        # sessions run sequentially, parallelism across requests comes from the workers
+        return 1
+
+    @property
+    def cv2_threads(self) -> int:
+        # OpenCV calls are short; with several workers their pools only add contention
+        return self.threads_per_worker if self.workers == 1 else 1
+
+
+_budget: Optional[ThreadBudget] = None
+
+
+def available_cpus() -> List[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def parse_cpu_list(text: str) -> List[int]:
+    """CPUs of a Linux cpulist such as "0-3,8,10-11"."""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def physical_core_cpus(cpus: Optional[List[int]] = None) -> List[int]:
+    """The first logical CPU of every physical core among `cpus` (default: available CPUs)."""
+    cpus = available_cpus() if cpus is None else cpus
+    selected, seen = [], set()
+    for cpu in cpus:
+        path = "/sys/devices/system/cpu/cpu{}/topology/thread_siblings_list".format(cpu)
+        try:
+            with open(path) as f:
+                siblings = tuple(parse_cpu_list(f.read()))
+        except (OSError, ValueError):
+            siblings = (cpu,)
+        if siblings not in seen:
+            seen.add(siblings)
+            selected.append(cpu)
+    return selected
+
+
+def numa_node_cpus(node: int) -> List[int]:
+    """The available CPUs of NUMA node `node`."""
+    with open("/sys/devices/system/node/node{}/cpulist".format(node)) as f:
+        node_cpus = set(parse_cpu_list(f.read()))
+    return [cpu for cpu in available_cpus() if cpu in node_cpus]
+
+
+def physical_core_count() -> int:
+    try:
+        logical = len(os.sched_getaffinity(0))
+    except AttributeError:
+        logical = os.cpu_count() or 1
+    try:
+        with open("/proc/cpuinfo") as f:
+            siblings = cores = None
+            for line in f:
+                if line.startswith("siblings") and siblings is None:
+                    siblings = int(line.split(":")[1])
+                elif line.startswith("cpu cores") and cores is None:
+                    cores = int(line.split(":")[1])
+        if siblings and cores and siblings > cores:
+            return max(logical * cores // siblings, 1)
+    except (OSError, ValueError):
+        pass
+    return logical
+
+
+def affinity_cpus(affinity: str) -> List[int]:
+    """CPUs for an affinity spec: "cores" or "numa:<node>"."""
+    if affinity == "cores":
+        return physical_core_cpus()
+    if affinity.startswith("numa:"):
+        return numa_node_cpus(int(affinity.split(":", 1)[1]))
+    raise ValueError(
+        "affinity should be 'cores' or 'numa:<node>', but got {!r}".format(affinity)
+    )
+
+
+def configure(
+    cores: Optional[int] = None,
+    workers: Optional[int] = None,
+    affinity: Optional[str] = None,
+) -> ThreadBudget:
+    """
+    Plan the thread budget, pin the process if `affinity` is given, and apply the budget to
+    PyTorch and OpenCV. Arguments left as None come from the environment (see module docstring).
+    Returns the budget, which is also what `budget()` returns from now on.
+    """
+    global _budget
+    if workers is None:
+        workers = int(os.getenv("LEFFA_WORKERS", "1"))
+    if affinity is None:
+        affinity = os.getenv("LEFFA_CPU_AFFINITY") or None
+
+    cpus = None
+    if affinity is not None:
+        cpus = affinity_cpus(affinity)
+        os.sched_setaffinity(0, cpus)
+    if cores is None:
+        cores = os.getenv("LEFFA_CPU_CORES")
+        cores = int(cores) if cores else (
+            len(physical_core_cpus(cpus)) if cpus else physical_core_count()
+        )
+    _budget = ThreadBudget(cores=cores, workers=max(workers, 1), cpus=cpus)
+
+    torch.set_num_threads(_budget.torch_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # only possible before the first inter-op parallel work
+        pass
+    try:
+        import cv2
+
+        cv2.setNumThreads(_budget.cv2_threads)
+    except ImportError:
+        pass
+
+    logger.info(
+        "Thread budget: {} cores for {} workers ({} threads each){}".format(
+            _budget.cores,
+            _budget.workers,
+            _budget.threads_per_worker,
+            ", pinned to CPUs {}".format(cpus) if cpus else "",
+        )
+    )
+    return _budget
+
+
+def budget() -> ThreadBudget:
+    """The configured budget, or the one `configure()` would plan from the environment."""
+    if _budget is not None:
+        return _budget
+    cores = os.getenv("LEFFA_CPU_CORES")
+    return ThreadBudget(
+        cores=int(cores) if cores else physical_core_count(),
+        workers=max(int(os.getenv("LEFFA_WORKERS", "1")), 1),
+    )
+
+
+def onnx_session_options():
+    """`onnxruntime.SessionOptions` sized by the budget, with all graph optimizations."""
+    import onnxruntime as ort
+
+    thread_budget = budget()
+    session_options = ort.SessionOptions()
+    session_options.intra_op_num_threads = thread_budget.onnx_intra_op_threads
+    session_options.inter_op_num_threads = thread_budget.onnx_inter_op_threads
+    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    # idle sessions must not spin on cores another model or request is using
+    session_options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+    return session_options
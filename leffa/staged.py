@@ -0,0 +1,257 @@
+"""
+Pipelined execution of try-on requests across the stages of `LeffaPipeline`.
+
+`LeffaInference` runs a request's transform, VAE encode, reference UNet passes and generative
+UNet steps strictly one after another, and the next request waits for all of them.
+`StagedExecutor` runs three stages on their own threads, connected by bounded queues:
+
+- prepare: `LeffaTransform`, VAE encode and conditioning (`LeffaPipeline.prepare`)
+- reference: reference UNet passes (`LeffaPipeline.reference_features`), streamed into a bounded
+  per-request queue, at most `feature_queue_size` steps ahead of the denoising loop
+- denoise: generative UNet steps, VAE decode and repaint (`LeffaPipeline.denoise` / `finish`)
+
+So the transform and encode of upcoming requests and the reference passes of the current and
+next request overlap with denoising. On GPUs every stage issues work on its own CUDA stream and
+hands tensors over with events; with `LeffaPipeline.place_reference_unet` the reference UNet runs
+on a second device and its features are copied to the generative UNet's device. On CPU the stages
+share the cores; size the thread budget for them (see `leffa.runtime`, e.g. LEFFA_WORKERS=2).
+
+Each request keeps its own scheduler, and random draws happen in submission order, so results
+equal those of `LeffaInference` called on the same requests in the same order.
+
+    executor = StagedExecutor(inference, transform=LeffaTransform())
+    future = executor.submit(data, num_inference_steps=30, seed=42)
+    outputs = future.result()  # as returned by `LeffaInference.__call__`
+"""
+import contextlib
+import contextvars
+import copy
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict
+
+import torch
+
+from leffa import tracing
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+_STOP = object()  # ends a stage thread
+_END = object()  # ends the reference features of one request
+
+
+class _Job(object):
+    def __init__(self, data, kwargs, feature_queue_size):
+        self.future = Future()
+        self.data = data
+        self.kwargs = kwargs
+        self.context = contextvars.copy_context()  # carries the request's trace
+        self.state = None
+        self.ready = None  # event after which `state` is usable on other streams
+        self.features = queue.Queue(feature_queue_size)
+        self.failed = False
+
+
+def _new_stream(device):
+    device = torch.device(device)
+    return torch.cuda.Stream(device) if device.type == "cuda" else None
+
+
+def _on_streams(*streams):
+    stack = contextlib.ExitStack()
+    for stream in streams:
+        if stream is not None:
+            stack.enter_context(torch.cuda.stream(stream))
+    return stack
+
+
+def _record(stream):
+    if stream is None:
+        return None
+    event = torch.cuda.Event()
+    event.record(stream)
+    return event
+
+
+def _wait(event, tensors):
+    """Make the current stream wait for `event` and keep `tensors` alive until it used them."""
+    if event is None:
+        return
+    for tensor in tensors:
+        if isinstance(tensor, torch.Tensor) and tensor.is_cuda:
+            stream = torch.cuda.current_stream(tensor.device)
+            stream.wait_event(event)
+            tensor.record_stream(stream)
+
+
+class StagedExecutor(object):
+    """
+    Runs `LeffaInference` requests as a prepare -> reference -> denoise pipeline.
+
+    :param inference: `LeffaInference` whose model and pipeline are used.
+    :param transform: Applied to submitted data in the prepare stage, e.g. `LeffaTransform()`;
+        None if submitted data is already transformed.
+    :param queue_size: Prepared requests waiting for the reference and denoise stages.
+    :param feature_queue_size: Reference passes computed ahead of the denoising loop.
+    """
+
+    def __init__(self, inference, transform=None, queue_size=2, feature_queue_size=4):
+        self.inference = inference
+        self.pipe = inference.pipe
+        self.transform = transform
+        self.feature_queue_size = feature_queue_size
+        self.inputs = queue.Queue()
+        self.to_reference = queue.Queue(queue_size)
+        self.to_denoise = queue.Queue(queue_size)
+
+        unet_device = next(self.pipe.unet.parameters()).device
+        reference_device = self.pipe.reference_device or unet_device
+        self.threads = [
+            threading.Thread(target=self._prepare_loop, args=(_new_stream(self.pipe.vae.device),),
+                             name="leffa-prepare", daemon=True),
+            threading.Thread(
+                target=self._reference_loop,
+                args=(_new_stream(reference_device),
+                      _new_stream(unet_device) if reference_device != unet_device else None),
+                name="leffa-reference",
+                daemon=True,
+            ),
+            threading.Thread(target=self._denoise_loop, args=(_new_stream(unet_device),),
+                             name="leffa-denoise", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, data: Dict[str, Any], **kwargs) -> Future:
+        """
+        Queue a request; `data` and `kwargs` are those of `LeffaInference.__call__`. Returns a
+        future of its outputs.
+        """
+        job = _Job(data, kwargs, self.feature_queue_size)
+        self.inputs.put(job)
+        return job.future
+
+    def __call__(self, data: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        return self.submit(data, **kwargs).result()
+
+    def close(self):
+        """Finish the queued requests and stop the stage threads."""
+        self.inputs.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _prepare_loop(self, stream):
+        while True:
+            job = self.inputs.get()
+            if job is _STOP:
+                self.to_reference.put(_STOP)
+                self.to_denoise.put(_STOP)
+                return
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            try:
+                job.context.copy().run(self._prepare, job, stream)
+            except BaseException as e:
+                logger.error("Failed to prepare a request: {}".format(e))
+                job.future.set_exception(e)
+                continue
+            self.to_reference.put(job)
+            self.to_denoise.put(job)
+
+    def _prepare(self, job, stream):
+        data = job.data
+        if self.transform is not None:
+            with tracing.span("leffa_transform"):
+                data = self.transform(data)
+        job.data = data = self.inference.to_gpu(data)
+        with _on_streams(stream), self.inference.autocast():
+            job.state = self.pipe.prepare(
+                src_image=data["src_image"],
+                ref_image=data["ref_image"],
+                mask=data["mask"],
+                densepose=data["densepose"],
+                num_inference_steps=job.kwargs.get("num_inference_steps", 50),
+                guidance_scale=job.kwargs.get("guidance_scale", 2.5),
+                # requests in flight each step their own scheduler
+                scheduler=copy.deepcopy(self.pipe.noise_scheduler),
+            )
+            job.ready = _record(stream)
+
+    def _reference_loop(self, stream, output_stream):
+        while True:
+            job = self.to_reference.get()
+            if job is _STOP:
+                return
+            try:
+                job.context.copy().run(self._reference, job, stream, output_stream)
+                job.features.put(_END)
+            except BaseException as e:
+                job.features.put(e)
+
+    def _reference(self, job, stream, output_stream):
+        ref_acceleration = job.kwargs.get("ref_acceleration", False)
+        with _on_streams(stream, output_stream), self.inference.autocast():
+            _wait(job.ready, job.state.tensors())
+            for features in self.pipe.reference_features(job.state, ref_acceleration):
+                if job.failed:
+                    return
+                # features end up on the generative UNet's device, copied on `output_stream`
+                job.features.put((features, _record(output_stream or stream)))
+
+    def _denoise_loop(self, stream):
+        while True:
+            job = self.to_denoise.get()
+            if job is _STOP:
+                return
+            try:
+                images = job.context.copy().run(self._denoise, job, stream)
+            except BaseException as e:
+                logger.error("Failed to denoise a request: {}".format(e))
+                job.failed = True
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(self.inference.outputs(job.data, images))
+            finally:
+                self._drain(job)
+
+    @staticmethod
+    def _drain(job):
+        # unblocks the reference stage if the loop stopped early, and waits until it is done
+        while True:
+            item = job.features.get()
+            if item is _END or isinstance(item, BaseException):
+                return
+
+    def _features(self, job):
+        while True:
+            item = job.features.get()
+            if item is _END:
+                raise RuntimeError("Reference features ended before the denoising loop")
+            if isinstance(item, BaseException):
+                job.features.put(_END)  # nothing left to drain
+                raise item
+            features, event = item
+            _wait(event, features)
+            yield features
+
+    def _denoise(self, job, stream):
+        kwargs = job.kwargs
+        ref_acceleration = kwargs.get("ref_acceleration", False)
+        generator = torch.Generator(self.pipe.device).manual_seed(kwargs.get("seed", 42))
+        with _on_streams(stream), self.inference.autocast():
+            _wait(job.ready, job.state.tensors())
+            latent = self.pipe.denoise(
+                job.state,
+                self._features(job),
+                ref_acceleration=ref_acceleration,
+                generator=generator,
+            )
+            return self.pipe.finish(job.state, latent, repaint=kwargs.get("repaint", False))
@@ -0,0 +1,191 @@
+"""
+Lightweight per-stage latency tracing.
+
+Stages are wrapped in `span(name)`. When tracing is disabled and no per-request trace is active,
+`span` returns a shared no-op context manager, so instrumented code pays one function call.
+
+    from leffa import tracing
+
+    tracing.enable()
+    with tracing.trace() as spans:
+        with tracing.span("vae_encode"):
+            ...
+    spans          # [{"name": "vae_encode", "start_ms": 0.0, "duration_ms": 12.3}]
+    tracing.render_prometheus()  # histograms of every span seen so far
+"""
+import bisect
+import contextlib
+import contextvars
+import sys
+import threading
+import time
+
+# Prometheus-style upper bounds in seconds, covering per-step (ms) to whole-request (minutes)
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 25.0, 60.0, 120.0, 300.0,
+)
+
+_enabled = False
+_synchronize_cuda = False
+_current_trace = contextvars.ContextVar("leffa_trace", default=None)
+
+
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class MetricsRegistry(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram(self.buckets))
+        histogram.observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def render_prometheus(self, metric="leffa_stage_seconds"):
+        lines = [
+            "# HELP {} Latency of try-on pipeline stages in seconds.".format(metric),
+            "# TYPE {} histogram".format(metric),
+        ]
+        for name in sorted(self.histograms):
+            histogram = self.histograms[name]
+            with histogram._lock:
+                counts = list(histogram.counts)
+                total, count = histogram.sum, histogram.count
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(
+                    '{}_bucket{{stage="{}",le="{}"}} {}'.format(
+                        metric, name, bound, cumulative)
+                )
+            lines.append('{}_sum{{stage="{}"}} {}'.format(metric, name, total))
+            lines.append('{}_count{{stage="{}"}} {}'.format(metric, name, count))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _maybe_synchronize():
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_initialized():
+        torch.cuda.synchronize()
+
+
+class Span(object):
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _synchronize_cuda:
+            _maybe_synchronize()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if _synchronize_cuda:
+            _maybe_synchronize()
+        end = time.perf_counter()
+        seconds = end - self.start
+        if _enabled:
+            registry.observe(self.name, seconds)
+        spans = _current_trace.get()
+        if spans is not None:
+            spans.append(
+                {
+                    "name": self.name,
+                    "start_ms": (self.start - spans.origin) * 1000.0,
+                    "duration_ms": seconds * 1000.0,
+                }
+            )
+        return False
+
+
+class _Trace(list):
+    def __init__(self):
+        super().__init__()
+        self.origin = time.perf_counter()
+
+
+def span(name):
+    """Context manager timing the stage `name`; a shared no-op when nothing records it."""
+    if not _enabled and _current_trace.get() is None:
+        return _NULL_SPAN
+    return Span(name)
+
+
+@contextlib.contextmanager
+def trace(enabled=True):
+    """
+    Collect every span entered in this context (thread/task) into the yielded list. With
+    `enabled=False` nothing is collected and None is yielded.
+    """
+    if not enabled:
+        yield None
+        return
+    spans = _Trace()
+    token = _current_trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+
+
+def enable(synchronize_cuda=True):
+    """
+    Start aggregating spans into `registry`. With `synchronize_cuda`, span boundaries wait for
+    queued CUDA work so GPU stages are attributed correctly.
+    """
+    global _enabled, _synchronize_cuda
+    _enabled = True
+    _synchronize_cuda = synchronize_cuda
+
+
+def disable():
+    global _enabled, _synchronize_cuda
+    _enabled = False
+    _synchronize_cuda = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def render_prometheus():
+    return registry.render_prometheus()
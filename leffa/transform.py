@@ -47,19 +47,14 @@ class LeffaTransform(nn.Module):
             densepose = batch["densepose"][i]
 
             # 3. process data
-            src_image = self.vae_processor.preprocess(
-                src_image, self.height, self.width)[0]
-            ref_image = self.vae_processor.preprocess(
-                ref_image, self.height, self.width)[0]
-            mask = self.mask_processor.preprocess(
-                mask, self.height, self.width)[0]
+            src_image = self.preprocess_image(src_image)
+            ref_image = self.preprocess_image(ref_image)
+            mask = self.preprocess_mask(mask)
             if self.dataset in ["pose_transfer"]:
                 densepose = densepose.resize(
                     (self.width, self.height), Image.NEAREST)
             else:
-                densepose = self.vae_processor.preprocess(
-                    densepose, self.height, self.width
-                )[0]
+                densepose = self.preprocess_image(densepose)
 
             src_image = self.prepare_image(src_image)
             ref_image = self.prepare_image(ref_image)
@@ -86,6 +81,26 @@ class LeffaTransform(nn.Module):
 
         return batch
 
+    def _is_model_size(self, array, channels):
+        shape = (self.height, self.width, channels) if channels else (self.height, self.width)
+        return isinstance(array, np.ndarray) and array.dtype == np.uint8 and array.shape == shape
+
+    def preprocess_image(self, image):
+        """
+        `vae_processor.preprocess`; an [H, W, 3] uint8 RGB array already at the model size (e.g.
+        `PreprocessGraph.rgb`) is normalized directly, with the same result as its PIL image.
+        """
+        if self._is_model_size(image, 3):
+            image = torch.from_numpy(image.astype(np.float32) / 255.0).permute(2, 0, 1)
+            return 2.0 * image[None] - 1.0
+        return self.vae_processor.preprocess(image, self.height, self.width)[0]
+
+    def preprocess_mask(self, mask):
+        """`mask_processor.preprocess`, directly for an [H, W] uint8 array at the model size."""
+        if self._is_model_size(mask, None):
+            return torch.from_numpy((mask >= 128).astype(np.float32))[None, None]
+        return self.mask_processor.preprocess(mask, self.height, self.width)[0]
+
     @staticmethod
     def prepare_image(image):
         if isinstance(image, torch.Tensor):
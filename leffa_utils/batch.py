@@ -0,0 +1,294 @@
+"""
+Building blocks for offline catalog try-on over a manifest of (person, garment) pairs, used by
+`batch_tryon.py`.
+
+A manifest is a CSV file with a header row or a JSONL file with one object per line. Each pair
+has a `person` and a `garment` image path and optionally:
+
+- `id`: output name (default: "<person stem>__<garment stem>")
+- `garment_type`: "upper_body", "lower_body" or "dresses" for agnostic masks (default: upper_body)
+- `mask`, `densepose`: precomputed images, used instead of computing them
+
+Relative paths are resolved against the manifest's directory. Completed pairs are appended to a
+progress log next to the outputs, so a killed run skips them when restarted, and `shard(i, n)`
+keeps every n-th pair so that several processes or machines split one manifest.
+"""
+import csv
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Set
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+
+from leffa.transform import LeffaTransform
+from leffa_utils.preprocess_graph import PreprocessGraph
+from leffa_utils.utils import get_agnostic_mask_hd, resize_and_center_array
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+GARMENT_TYPES = ("upper_body", "lower_body", "dresses")
+
+
+@dataclass
+class Pair:
+    id: str
+    person: str
+    garment: str
+    garment_type: str = "upper_body"
+    mask: Optional[str] = None
+    densepose: Optional[str] = None
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _pair(row, root):
+    def resolve(path):
+        return os.path.join(root, path) if path and not os.path.isabs(path) else (path or None)
+
+    person, garment = resolve(row["person"]), resolve(row["garment"])
+    garment_type = row.get("garment_type") or "upper_body"
+    if garment_type not in GARMENT_TYPES:
+        raise ValueError(
+            "garment_type should be one of {}, but got {!r}".format(GARMENT_TYPES, garment_type)
+        )
+    return Pair(
+        id=row.get("id") or "{}__{}".format(_stem(person), _stem(garment)),
+        person=person,
+        garment=garment,
+        garment_type=garment_type,
+        mask=resolve(row.get("mask")),
+        densepose=resolve(row.get("densepose")),
+    )
+
+
+def read_manifest(path) -> Iterator[Pair]:
+    """Pairs of a CSV or JSONL manifest, in file order."""
+    root = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        if path.endswith((".jsonl", ".json")):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            yield _pair(row, root)
+
+
+def parse_shard(text):
+    """"i/n" -> (i, n)."""
+    index, _, count = text.partition("/")
+    index, count = int(index), int(count or 1)
+    if not 0 <= index < count:
+        raise ValueError("shard should be i/n with 0 <= i < n, but got {!r}".format(text))
+    return index, count
+
+
+def shard(pairs, index, count) -> Iterator[Pair]:
+    """Every `count`-th pair starting at `index`; stable as long as the manifest is."""
+    for i, pair in enumerate(pairs):
+        if i % count == index:
+            yield pair
+
+
+class ProgressLog:
+    """
+    Append-only JSONL record of finished pairs. A line is only written after the output file is in
+    place, so every recorded pair can be skipped on restart; a line cut short by a kill is ignored.
+    Failed pairs are recorded too, but are retried on restart.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get("status") == "done":
+                        self.done.add(record["id"])
+        self.file = open(path, "a")
+
+    def record(self, pair_id, status="done", **fields):
+        with self.lock:
+            self.file.write(json.dumps(dict(id=pair_id, status=status, **fields)) + "\n")
+            self.file.flush()
+            if status == "done":
+                self.done.add(pair_id)
+
+    def close(self):
+        self.file.close()
+
+
+class _Preprocessors:
+    """Human parsing, OpenPose and DensePose for agnostic masks; created once per process."""
+
+    _instance = None
+
+    def __init__(self, ckpt_dir):
+        from preprocess.humanparsing.run_parsing import Parsing
+        from preprocess.openpose.run_openpose import OpenPose
+
+        from leffa_utils.densepose_predictor import DensePosePredictor
+
+        self.parsing = Parsing(
+            atr_path=os.path.join(ckpt_dir, "humanparsing/parsing_atr.onnx"),
+            lip_path=os.path.join(ckpt_dir, "humanparsing/parsing_lip.onnx"),
+        )
+        self.openpose = OpenPose(
+            body_model_path=os.path.join(ckpt_dir, "openpose/body_pose_model.pth"))
+        self.densepose = DensePosePredictor(
+            config_path=os.path.join(ckpt_dir, "densepose/densepose_rcnn_R_50_FPN_s1x.yaml"),
+            weights_path=os.path.join(ckpt_dir, "densepose/model_final_162be9.pkl"),
+        )
+
+    @classmethod
+    def get(cls, ckpt_dir):
+        # DataLoader workers are separate processes, each loads its own models on first use
+        if cls._instance is None:
+            cls._instance = cls(ckpt_dir)
+        return cls._instance
+
+
+class TryOnDataset(Dataset):
+    """
+    Decodes, resizes and masks one pair per item and applies `LeffaTransform`, so all CPU
+    preprocessing runs in DataLoader workers. Use with `collate`.
+
+    :param pairs: `Pair`s to process.
+    :param mask: "full" for an all-white mask and flat DensePose (as `simple_tryon.py`), or
+        "agnostic" for the garment-agnostic mask and DensePose segmentation computed with the
+        preprocessing models under `ckpt_dir`. Per-pair `mask`/`densepose` files take precedence.
+    """
+
+    def __init__(self, pairs: List[Pair], mask="full", ckpt_dir="./ckpts", width=768,
+                 height=1024):
+        assert mask in ["full", "agnostic"], mask
+        self.pairs = pairs
+        self.mask = mask
+        self.ckpt_dir = ckpt_dir
+        self.width = width
+        self.height = height
+        self.transform = LeffaTransform(height=height, width=width)
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def load_labels(self, path, fill):
+        """A precomputed mask or DensePose image at the model size, without mixing labels."""
+        image = Image.open(path)
+        if image.mode not in ("L", "RGB"):
+            image = image.convert("RGB")
+        return resize_and_center_array(image, self.width, self.height, cv2.INTER_NEAREST, fill)
+
+    def masks(self, pair, person: PreprocessGraph):
+        # the mask is padded as inpainted, DensePose with its black background
+        mask = self.load_labels(pair.mask, 255) if pair.mask else None
+        densepose = self.load_labels(pair.densepose, 0) if pair.densepose else None
+        if self.mask == "full":
+            if mask is None:
+                mask = np.full((self.height, self.width), 255, dtype=np.uint8)
+            if densepose is None:
+                densepose = np.ones((self.height, self.width, 3), dtype=np.uint8)
+            return mask, densepose
+
+        # parsing, OpenPose and DensePose share the person's buffers and run concurrently
+        models = _Preprocessors.get(self.ckpt_dir)
+        branches = {}
+        if mask is None:
+            branches["parse"] = lambda: models.parsing(person.resized_bgr(384, 512))[0]
+            branches["keypoints"] = lambda: models.openpose(person.resized(384, 512))
+        if densepose is None:
+            branches["densepose"] = lambda: models.densepose.predict_seg(person.rgb)[:, :, ::-1]
+        outputs = person.run(branches)
+        if mask is None:
+            mask = get_agnostic_mask_hd(outputs["parse"], outputs["keypoints"], pair.garment_type)
+            mask = mask.resize((self.width, self.height), Image.NEAREST)
+        if densepose is None:
+            densepose = outputs["densepose"]
+        return mask, densepose
+
+    def __getitem__(self, index):
+        pair = self.pairs[index]
+        try:
+            person = PreprocessGraph(pair.person, self.width, self.height)
+            garment = PreprocessGraph(pair.garment, self.width, self.height)
+            mask, densepose = self.masks(pair, person)
+            data = self.transform(
+                {"src_image": [person.rgb], "ref_image": [garment.rgb], "mask": [mask],
+                 "densepose": [densepose]}
+            )
+        except Exception as e:
+            # one unreadable image must not end a catalog run; the pair is logged as failed
+            return {"id": pair.id, "error": "{}: {}".format(type(e).__name__, e)}
+        data["id"] = pair.id
+        data["bytes_copied"] = person.bytes_copied + garment.bytes_copied
+        return data
+
+
+def collate(items: List[Dict]) -> Dict:
+    """Concatenate `TryOnDataset` items into one batch; failed items are listed in "failed"."""
+    ok = [item for item in items if "error" not in item]
+    batch = {
+        "id": [item["id"] for item in ok],
+        "failed": [(item["id"], item["error"]) for item in items if "error" in item],
+        "bytes_copied": sum(item["bytes_copied"] for item in ok),
+    }
+    for key in ("src_image", "ref_image", "mask", "densepose"):
+        batch[key] = torch.cat([item[key] for item in ok]) if ok else None
+    return batch
+
+
+class AsyncWriter:
+    """
+    Saves generated images on background threads and records them in a `ProgressLog` once they
+    are on disk. At most `max_pending` saves are queued; `submit` blocks beyond that.
+    """
+
+    def __init__(self, output_dir, progress: ProgressLog, num_threads=2, max_pending=64,
+                 image_format="jpg", quality=95):
+        self.output_dir = output_dir
+        self.progress = progress
+        self.image_format = image_format
+        self.quality = quality
+        self.executor = ThreadPoolExecutor(max_workers=num_threads)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.errors = 0
+
+    def path(self, pair_id):
+        return os.path.join(self.output_dir, "{}.{}".format(pair_id, self.image_format))
+
+    def _save(self, pair_id, image):
+        try:
+            path = self.path(pair_id)
+            tmp_path = path + ".tmp"
+            image.save(tmp_path, format="JPEG" if self.image_format == "jpg" else "PNG",
+                       quality=self.quality)
+            # a kill mid-save leaves only the temporary file, never a truncated output
+            os.replace(tmp_path, path)
+            self.progress.record(pair_id, output=os.path.basename(path))
+        except Exception as e:
+            self.errors += 1
+            logger.error("Failed to save {}: {}".format(pair_id, e))
+            self.progress.record(pair_id, status="failed", error=str(e))
+        finally:
+            self.slots.release()
+
+    def submit(self, pair_id, image):
+        self.slots.acquire()
+        self.executor.submit(self._save, pair_id, image)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -1,8 +1,4 @@
-import glob
 import os
-import shutil
-import time
-from random import randint
 
 import cv2
 import numpy as np
@@ -13,9 +9,15 @@ from densepose.vis.densepose_results import DensePoseResultsFineSegmentationVisu
 from densepose.vis.extractor import CompoundExtractor, create_extractor
 from detectron2.config import get_cfg
 from detectron2.data.detection_utils import read_image
-from detectron2.engine.defaults import DefaultPredictor
 from PIL import Image
 
+from leffa_utils.batched_predictor import BatchedPredictor
+from leffa_utils.densepose_single_person import (
+    configure_single_person,
+    top_person_chart,
+)
+from leffa_utils.weight_cache import resolve_weights
+
 
 class DensePose:
     """
@@ -28,8 +30,26 @@ class DensePose:
     Noted that the config file should match the model checkpoint and Base-DensePose-RCNN-FPN.yaml is also needed.
     """
 
-    def __init__(self, model_path="./checkpoints/densepose_", device="cuda"):
+    def __init__(
+        self,
+        model_path="./checkpoints/densepose_",
+        device="cuda",
+        single_person=False,
+        max_proposals=100,
+        onnx_path=None,
+        onnx_pool_size=1,
+    ):
+        """
+        With `single_person`, only the top detection (out of `max_proposals` RPN proposals) gets
+        a DensePose head pass and its labels are read straight from the head output.
+
+        With `onnx_path`, the model runs from that graph (see `leffa_utils.onnx_export`) on a pool
+        of `onnx_pool_size` ONNX Runtime sessions; the checkpoint is not loaded. Score threshold
+        and proposal/detection limits are then those the graph was exported with.
+        """
         self.device = device
+        self.single_person = single_person
+        self.max_proposals = max_proposals
         self.config_path = os.path.join(model_path, "densepose_rcnn_R_50_FPN_s1x.yaml")
         self.model_path = os.path.join(model_path, "model_final_162be9.pkl")
         self.visualizations = ["dp_segm"]
@@ -37,8 +57,16 @@ class DensePose:
         self.min_score = 0.8
 
         self.cfg = self.setup_config()
-        self.predictor = DefaultPredictor(self.cfg)
-        self.predictor.model.to(self.device)
+        if onnx_path is not None:
+            from leffa_utils.onnx_runtime import DensePoseOnnxPredictor
+
+            self.predictor = DensePoseOnnxPredictor(
+                self.cfg, onnx_path, device=device, pool_size=onnx_pool_size
+            )
+        else:
+            self.predictor = BatchedPredictor(self.cfg)
+        # visualizers and extractors do not depend on the image, build them once
+        self.context = self.create_context(self.cfg, None)
 
     def setup_config(self):
         opts = ["MODEL.ROI_HEADS.SCORE_THRESH_TEST", str(self.min_score)]
@@ -46,24 +74,13 @@ class DensePose:
         add_densepose_config(cfg)
         cfg.merge_from_file(self.config_path)
         cfg.merge_from_list(opts)
-        cfg.MODEL.WEIGHTS = self.model_path
+        cfg.MODEL.WEIGHTS = resolve_weights(self.model_path)
+        cfg.MODEL.DEVICE = self.device
+        if self.single_person:
+            configure_single_person(cfg, self.max_proposals)
         cfg.freeze()
         return cfg
 
-    @staticmethod
-    def _get_input_file_list(input_spec: str):
-        if os.path.isdir(input_spec):
-            file_list = [
-                os.path.join(input_spec, fname)
-                for fname in os.listdir(input_spec)
-                if os.path.isfile(os.path.join(input_spec, fname))
-            ]
-        elif os.path.isfile(input_spec):
-            file_list = [input_spec]
-        else:
-            file_list = glob.glob(input_spec)
-        return file_list
-
     def create_context(self, cfg, output_path):
         vis_specs = self.visualizations
         visualizers = []
@@ -89,81 +106,73 @@ class DensePose:
         }
         return context
 
-    def execute_on_outputs(self, context, entry, outputs):
-        extractor = context["extractor"]
-
-        data = extractor(outputs)
-
-        H, W, _ = entry["image"].shape
-        result = np.zeros((H, W), dtype=np.uint8)
-
-        data, box = data[0]
-        x, y, w, h = [int(_) for _ in box[0].cpu().numpy()]
-        i_array = data[0].labels[None].cpu().numpy()[0]
-        result[y : y + h, x : x + w] = i_array
-        result = Image.fromarray(result)
-        result.save(context["out_fname"])
-
     def __call__(self, image_or_path, resize=512) -> Image.Image:
         """
-        :param image_or_path: Path of the input image.
+        :param image_or_path: Path of the input image, PIL image or BGR uint8 array.
         :param resize: Resize the input image if its max size is larger than this value.
         :return: Dense pose image.
         """
-        # random tmp path with timestamp
-        tmp_path = f"./densepose_/tmp/"
-        if not os.path.exists(tmp_path):
-            os.makedirs(tmp_path)
-
-        image_path = os.path.join(
-            tmp_path, f"{int(time.time())}-{self.device}-{randint(0, 100000)}.png"
-        )
+        img, (w, h) = self.load_image(image_or_path, resize)
+        with torch.no_grad():
+            outputs = self.predictor(img)["instances"]
+        dense_gray = Image.fromarray(self.labels_image(outputs, img.shape))
+        return dense_gray.resize((w, h), Image.NEAREST)
+
+    def load_image(self, image_or_path, resize=512):
+        """BGR array of a path, PIL image or BGR array, at most `resize` large; and its size."""
         if isinstance(image_or_path, str):
             assert image_or_path.split(".")[-1] in [
                 "jpg",
                 "png",
             ], "Only support jpg and png images."
-            shutil.copy(image_or_path, image_path)
+            w, h = Image.open(image_or_path).size
+            img = read_image(image_or_path, format="BGR")
         elif isinstance(image_or_path, Image.Image):
-            image_or_path.save(image_path)
+            w, h = image_or_path.size
+            img = np.asarray(image_or_path.convert("RGB"))[:, :, ::-1]
+        elif isinstance(image_or_path, np.ndarray):
+            # e.g. `PreprocessGraph.bgr()`, shared with other models
+            h, w = image_or_path.shape[:2]
+            img = image_or_path
         else:
-            shutil.rmtree(tmp_path)
-            raise TypeError("image_path must be str or PIL.Image.Image")
-
-        output_path = image_path.replace(".png", "_dense.png").replace(
-            ".jpg", "_dense.png"
-        )
-        w, h = Image.open(image_path).size
-
-        file_list = self._get_input_file_list(image_path)
-        assert len(file_list), "No input images found!"
-        context = self.create_context(self.cfg, output_path)
-        for file_name in file_list:
-            img = read_image(file_name, format="BGR")  # predictor expects BGR image.
-            # resize
-            if (_ := max(img.shape)) > resize:
-                scale = resize / _
-                img = cv2.resize(
-                    img, (int(img.shape[1] * scale), int(img.shape[0] * scale))
-                )
-
-            with torch.no_grad():
-                outputs = self.predictor(img)["instances"]
-                try:
-                    self.execute_on_outputs(
-                        context, {"file_name": file_name, "image": img}, outputs
-                    )
-                except Exception as e:
-                    null_gray = Image.new("L", (1, 1))
-                    null_gray.save(output_path)
-
-        dense_gray = Image.open(output_path).convert("L")
-        dense_gray = dense_gray.resize((w, h), Image.NEAREST)
-        # remove image_path and output_path
-        os.remove(image_path)
-        os.remove(output_path)
-
-        return dense_gray
+            raise TypeError("image_path must be str, PIL.Image.Image or np.ndarray")
+
+        if (_ := max(img.shape)) > resize:
+            scale = resize / _
+            img = cv2.resize(img, (int(img.shape[1] * scale), int(img.shape[0] * scale)))
+        return img, (w, h)
+
+    def labels_image(self, outputs, shape):
+        """Part labels of one person pasted into an image of `shape`, zeros without a person."""
+        result = np.zeros(shape[:2], dtype=np.uint8)
+        if self.single_person:
+            chart = top_person_chart(outputs, with_uv=False)
+            if chart is not None:
+                labels, _, (x, y, box_w, box_h) = chart
+                result[y : y + box_h, x : x + box_w] = labels.cpu().numpy()
+            return result
+        try:
+            data, box = self.context["extractor"](outputs)[0]
+            x, y, w, h = [int(_) for _ in box[0].cpu().numpy()]
+            result[y : y + h, x : x + w] = data[0].labels.cpu().numpy()
+        except Exception:
+            pass  # no detection gives an empty image
+        return result
+
+    def predict_batch(self, images_or_paths, resize=512, batch_size=8):
+        """
+        `__call__` for a list of images, in memory, with `batch_size` images per model forward.
+        Not available with an ONNX graph, which takes one image per run.
+        """
+        if not isinstance(self.predictor, BatchedPredictor):
+            return [self(image_or_path, resize) for image_or_path in images_or_paths]
+        loaded = [self.load_image(image_or_path, resize) for image_or_path in images_or_paths]
+        predictions = self.predictor.predict_batch([img for img, _ in loaded], batch_size)
+        return [
+            Image.fromarray(self.labels_image(prediction["instances"], img.shape)).resize(
+                size, Image.NEAREST)
+            for (img, size), prediction in zip(loaded, predictions)
+        ]
 
 
 if __name__ == "__main__":
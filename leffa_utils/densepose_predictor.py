@@ -1,29 +1,74 @@
+from dataclasses import dataclass
+
+import cv2
 import numpy as np
 import torch
 from densepose import add_densepose_config
-from densepose.vis.densepose_results import (
-    DensePoseResultsFineSegmentationVisualizer as Visualizer,
-)
+from densepose.structures import DensePoseDataRelative
 from densepose.vis.extractor import DensePoseResultExtractor
 from detectron2.config import get_cfg
-from detectron2.engine import DefaultPredictor
+from PIL import Image
+
+from leffa_utils.batched_predictor import BatchedPredictor
+from leffa_utils.densepose_single_person import (
+    configure_single_person,
+    person_chart,
+    top_person_chart,
+)
+from leffa_utils.weight_cache import resolve_weights
+
+
+def _segmentation_colors():
+    # the colors DensePose's fine segmentation visualizer paints part labels with: PARULA of
+    # label * 255 / 24, black background
+    labels = np.arange(DensePoseDataRelative.N_PART_LABELS + 1, dtype=np.uint8)
+    scaled = labels.astype(np.float32) * (255.0 / DensePoseDataRelative.N_PART_LABELS)
+    colors = cv2.applyColorMap(scaled.clip(0, 255).astype(np.uint8)[:, None], cv2.COLORMAP_PARULA)
+    colors = colors[:, 0]
+    colors[0] = 0
+    return colors
+
+
+SEGMENTATION_COLORS = _segmentation_colors()
+
+
+@dataclass
+class DensePoseOutputs:
+    """
+    What `DensePosePredictor.predict_all` derives from one model forward, at the input image size.
+    `i_map` is the top person's part labels (0 background, 1~24 parts), the DensePose input of
+    `AutoMasker`.
+    """
+
+    iuv: np.ndarray  # [H, W, 3] as `predict_iuv`
+    seg: np.ndarray  # [H, W, 3] as `predict_seg`
+    i_map: np.ndarray  # [H, W] uint8
+
+    def i_map_image(self):
+        return Image.fromarray(self.i_map)
 
 
 class DensePosePredictor(object):
     def __init__(self,
                  config_path="./ckpts/densepose/densepose_rcnn_R_50_FPN_s1x.yaml",
-                 weights_path="./ckpts/densepose/model_final_162be9.pkl"
+                 weights_path="./ckpts/densepose/model_final_162be9.pkl",
+                 single_person=False,
+                 max_proposals=100,
                  ):
         cfg = get_cfg()
         add_densepose_config(cfg)
         cfg.merge_from_file(
             config_path)  # Use the path to the config file from densepose
-        cfg.MODEL.WEIGHTS = weights_path  # Use the path to the pre-trained model weights
+        # Use the path to the pre-trained model weights, or their pre-converted copy
+        cfg.MODEL.WEIGHTS = resolve_weights(weights_path)
         cfg.MODEL.DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
         cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5  # Adjust as needed
-        self.predictor = DefaultPredictor(cfg)
+        # single_person: top-1 detection from `max_proposals` proposals; used by predict_iuv
+        self.single_person = single_person
+        if single_person:
+            configure_single_person(cfg, max_proposals)
+        self.predictor = BatchedPredictor(cfg)
         self.extractor = DensePoseResultExtractor()
-        self.visualizer = Visualizer()
 
     def predict(self, image):
         if isinstance(image, str):
@@ -34,44 +79,94 @@ class DensePosePredictor(object):
         return outputs
 
     def predict_iuv(self, image):
-        outputs = self.predict(image)
+        if isinstance(image, str):
+            image = cv2.imread(image)
+        return self.predict_iuv_batch([image])[0]
 
-        img_i = outputs[0][0].labels[None, ...]
-        img_uv = outputs[0][0].uv
-        img_uv = (img_uv - img_uv.min()) / (img_uv.max() - img_uv.min())
-        img_uv *= 255
-        img_iuv = torch.cat([img_i, img_uv], dim=0)
-        img_iuv = img_iuv.permute(1, 2, 0)
-        img_iuv = img_iuv.cpu().numpy()
+    def predict_iuv_batch(self, images, batch_size=8):
+        """`predict_iuv` for a list of BGR images, `batch_size` images per model forward."""
+        images = [cv2.imread(image) if isinstance(image, str) else image for image in images]
+        predictions = self.predictor.predict_batch(images, batch_size)
+        return [
+            self._iuv(image, prediction["instances"])
+            for image, prediction in zip(images, predictions)
+        ]
 
+    def _iuv(self, image, instances):
+        if self.single_person:
+            chart = top_person_chart(instances)
+            if chart is None:
+                return np.zeros(image.shape, dtype=image.dtype)
+            labels, uv, position = chart
+            return self.iuv_image(image, labels, uv, position)
+
+        outputs = self.extractor(instances)
         position = [int(x) for x in outputs[1][0].cpu().numpy().tolist()]
+        return self.iuv_image(image, outputs[0][0].labels, outputs[0][0].uv, position)
+
+    @staticmethod
+    def iuv_image(image, labels, uv, position):
+        """Labels and UV min-max normalized over the box, pasted as (I, V, U) channels."""
+        img_uv = (uv - uv.min()) / (uv.max() - uv.min())
+        img_uv *= 255
+        img_uv = img_uv.cpu().numpy()
+
         x1, y1, w, h = position
-        x2 = x1 + w
-        y2 = y1 + h
         image_iuv = np.zeros(image.shape, dtype=image.dtype)
-        image_iuv[y1:y2, x1:x2, :] = img_iuv
-        image_iuv = image_iuv[:, :, [0, 2, 1]]
-
+        crop = image_iuv[y1:y1 + h, x1:x1 + w]
+        crop[..., 0] = labels.cpu().numpy()
+        crop[..., 1] = img_uv[1]
+        crop[..., 2] = img_uv[0]
         return image_iuv
 
     def predict_seg(self, image):
-        outputs = self.predict(image)
+        if isinstance(image, str):
+            image = cv2.imread(image)
+        with torch.no_grad():
+            instances = self.predictor(image)["instances"]
+        return self.seg_image(image, instances)
 
+    @staticmethod
+    def seg_image(image, instances, index=-1):
+        """
+        The fine segmentation visualizer paints on a black canvas: it clears the canvas for every
+        instance, so only the last (lowest-scoring) one is left. `index` selects another instance.
+        """
         image_seg = np.zeros(image.shape, dtype=image.dtype)
-        self.visualizer.visualize(image_seg, outputs)
-
+        chart = person_chart(instances, index, with_uv=False)
+        if chart is not None:
+            labels, _, (x, y, w, h) = chart
+            if w > 0 and h > 0:
+                image_seg[y:y + h, x:x + w] = SEGMENTATION_COLORS[labels.cpu().numpy()]
         return image_seg
 
+    def predict_all(self, image):
+        """
+        `predict_iuv`, `predict_seg` and the top person's part-label map of one BGR image (or
+        path) from a single model forward, as `DensePoseOutputs`.
+        """
+        if isinstance(image, str):
+            image = cv2.imread(image)
+        with torch.no_grad():
+            instances = self.predictor(image)["instances"]
+        i_map = np.zeros(image.shape[:2], dtype=np.uint8)
+        chart = top_person_chart(instances)
+        if chart is None:
+            iuv = np.zeros(image.shape, dtype=image.dtype)
+        else:
+            labels, uv, position = chart
+            iuv = self.iuv_image(image, labels, uv, position)
+            x, y, w, h = position
+            i_map[y:y + h, x:x + w] = iuv[y:y + h, x:x + w, 0]
+        return DensePoseOutputs(iuv=iuv, seg=self.seg_image(image, instances), i_map=i_map)
+
 
 if __name__ == "__main__":
     import sys
 
-    import cv2
-
     image_path = sys.argv[1]
     image = cv2.imread(image_path)
     predictor = DensePosePredictor()
-    image_iuv = predictor.predict_iuv(image)
-    image_seg = predictor.predict_seg(image)
-    cv2.imwrite(".".join(image_path.split(".")[:-1]) + "_iuv.jpg", image_iuv)
-    cv2.imwrite(".".join(image_path.split(".")[:-1]) + "_seg.jpg", image_seg)
+    outputs = predictor.predict_all(image)
+    cv2.imwrite(".".join(image_path.split(".")[:-1]) + "_iuv.jpg", outputs.iuv)
+    cv2.imwrite(".".join(image_path.split(".")[:-1]) + "_seg.jpg", outputs.seg)
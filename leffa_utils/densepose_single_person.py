@@ -0,0 +1,51 @@
+"""
+Single-person DensePose inference shared by `DensePosePredictor` and `DensePose`.
+
+Both only use the highest-scoring person. `configure_single_person` caps the RPN proposals and
+keeps one detection, so the box head sees `max_proposals` ROIs and the DensePose head runs on a
+single box. `top_person_chart` then resamples that box's labels (and UV) directly from the head
+outputs, without the generic extractor/visualizer path.
+"""
+from typing import Optional, Tuple
+
+import torch
+from densepose.converters import resample_fine_and_coarse_segm_to_bbox
+from densepose.converters.base import IntTupleBox, make_int_box
+from densepose.converters.chart_output_to_chart_result import resample_uv_to_bbox
+from detectron2.structures import BoxMode, Instances
+
+
+def configure_single_person(cfg, max_proposals: int = 100):
+    """Limit `cfg` (unfrozen) to `max_proposals` RPN proposals and one detection per image."""
+    cfg.MODEL.RPN.POST_NMS_TOPK_TEST = min(cfg.MODEL.RPN.POST_NMS_TOPK_TEST, max_proposals)
+    cfg.TEST.DETECTIONS_PER_IMAGE = 1
+    return cfg
+
+
+def top_person_chart(
+    instances: Instances, with_uv: bool = True
+) -> Optional[Tuple[torch.Tensor, Optional[torch.Tensor], IntTupleBox]]:
+    """
+    Labels [H, W] (long) and, with `with_uv`, UV [2, H, W] of the first (highest-scoring)
+    instance resampled to its box, and the box as integer (x, y, w, h). None if no person was
+    detected.
+    """
+    return person_chart(instances, 0, with_uv)
+
+
+def person_chart(
+    instances: Instances, index: int, with_uv: bool = True
+) -> Optional[Tuple[torch.Tensor, Optional[torch.Tensor], IntTupleBox]]:
+    """`top_person_chart` for the instance at `index` (negative counts from the end)."""
+    if len(instances) == 0 or not instances.has("pred_densepose"):
+        return None
+    index = index % len(instances)
+    predictor_output = instances.pred_densepose[index]
+    box_xywh = BoxMode.convert(
+        instances.pred_boxes.tensor[index:index + 1].clone(), BoxMode.XYXY_ABS, BoxMode.XYWH_ABS
+    )
+    box_xywh = make_int_box(box_xywh[0])
+
+    labels = resample_fine_and_coarse_segm_to_bbox(predictor_output, box_xywh).squeeze(0)
+    uv = resample_uv_to_bbox(predictor_output, labels, box_xywh) if with_uv else None
+    return labels, uv, box_xywh
@@ -8,7 +8,10 @@ from diffusers.image_processor import VaeImageProcessor
 from PIL import Image
 from SCHP import SCHP  # type: ignore
 
+from leffa import tracing
 from leffa_utils.densepose_for_mask import DensePose  # type: ignore
+from leffa_utils.preprocess_graph import PreprocessGraph
+from leffa_utils.weight_cache import resolve_weights
 
 DENSE_INDEX_MAP = {
     "background": [0],
@@ -203,20 +206,57 @@ class AutoMasker:
         densepose_path: str = "./ckpts/densepose",
         schp_path: str = "./ckpts/schp",
         device="cuda",
+        backend: str = "torch",
+        onnx_path: str = "./ckpts/onnx",
+        onnx_pool_size: int = 1,
     ):
+        """
+        `backend="onnx"` runs DensePose and SCHP from the graphs in `onnx_path` written by
+        `python -m leffa_utils.onnx_export`, each on a pool of `onnx_pool_size` sessions so that
+        up to that many requests are processed concurrently.
+        """
+        assert backend in [
+            "torch",
+            "onnx",
+        ], f"backend should be one of ['torch', 'onnx'], but got {backend}"
         np.random.seed(0)
         torch.manual_seed(0)
         torch.cuda.manual_seed(0)
 
-        self.densepose_processor = DensePose(densepose_path, device)
-        self.schp_processor_atr = SCHP(
-            ckpt_path=os.path.join(schp_path, "exp-schp-201908301523-atr.pth"),
-            device=device,
-        )
-        self.schp_processor_lip = SCHP(
-            ckpt_path=os.path.join(schp_path, "exp-schp-201908261155-lip.pth"),
-            device=device,
-        )
+        if backend == "onnx":
+            from leffa_utils.onnx_export import DENSEPOSE_ONNX, schp_onnx_name
+            from leffa_utils.onnx_runtime import SCHPOnnx
+
+            self.densepose_processor = DensePose(
+                densepose_path,
+                device,
+                onnx_path=os.path.join(onnx_path, DENSEPOSE_ONNX),
+                onnx_pool_size=onnx_pool_size,
+            )
+            self.schp_processor_atr = SCHPOnnx(
+                os.path.join(onnx_path, schp_onnx_name("atr")),
+                device=device,
+                pool_size=onnx_pool_size,
+            )
+            self.schp_processor_lip = SCHPOnnx(
+                os.path.join(onnx_path, schp_onnx_name("lip")),
+                device=device,
+                pool_size=onnx_pool_size,
+            )
+        else:
+            self.densepose_processor = DensePose(densepose_path, device)
+            self.schp_processor_atr = SCHP(
+                ckpt_path=resolve_weights(
+                    os.path.join(schp_path, "exp-schp-201908301523-atr.pth")
+                ),
+                device=device,
+            )
+            self.schp_processor_lip = SCHP(
+                ckpt_path=resolve_weights(
+                    os.path.join(schp_path, "exp-schp-201908261155-lip.pth")
+                ),
+                device=device,
+            )
 
         self.mask_processor = VaeImageProcessor(
             vae_scale_factor=8,
@@ -226,21 +266,47 @@ class AutoMasker:
         )
 
     def process_densepose(self, image_or_path):
-        return self.densepose_processor(image_or_path, resize=1024)
+        with tracing.span("densepose"):
+            return self.densepose_processor(image_or_path, resize=1024)
 
     def process_schp_lip(self, image_or_path):
-        return self.schp_processor_lip(image_or_path)
+        with tracing.span("schp_lip"):
+            return self.schp_processor_lip(image_or_path)
 
     def process_schp_atr(self, image_or_path):
-        return self.schp_processor_atr(image_or_path)
-
-    def preprocess_image(self, image_or_path):
+        with tracing.span("schp_atr"):
+            return self.schp_processor_atr(image_or_path)
+
+    def preprocess_image(self, image_or_path, densepose=None):
+        if densepose is not None:
+            # e.g. `DensePosePredictor.predict_all` outputs, already computed for this image
+            densepose = densepose.i_map_image()
+        if isinstance(image_or_path, PreprocessGraph):
+            return self.preprocess_graph(image_or_path, densepose)
         return {
-            "densepose": self.densepose_processor(image_or_path, resize=1024),
-            "schp_atr": self.schp_processor_atr(image_or_path),
-            "schp_lip": self.schp_processor_lip(image_or_path),
+            "densepose": (
+                self.process_densepose(image_or_path) if densepose is None else densepose
+            ),
+            "schp_atr": self.process_schp_atr(image_or_path),
+            "schp_lip": self.process_schp_lip(image_or_path),
         }
 
+    def preprocess_graph(self, graph: PreprocessGraph, densepose=None):
+        """
+        `preprocess_image` of a `PreprocessGraph`'s image, with DensePose and both SCHP parsers
+        run concurrently. DensePose reads the graph's BGR buffer and SCHP its RGB one, as they
+        would convert a PIL image.
+        """
+        branches = {
+            "schp_atr": lambda: self.process_schp_atr(graph.rgb),
+            "schp_lip": lambda: self.process_schp_lip(graph.rgb),
+        }
+        if densepose is None:
+            branches["densepose"] = lambda: self.process_densepose(graph.bgr())
+        results = graph.run(branches)
+        results.setdefault("densepose", densepose)
+        return results
+
     @staticmethod
     def cloth_agnostic_mask(
         densepose_mask: Image.Image,
@@ -368,9 +434,16 @@ class AutoMasker:
 
     def __call__(
         self,
-        image: Union[str, Image.Image],
+        image: Union[str, Image.Image, PreprocessGraph],
         mask_type: str = "upper",
+        densepose=None,
     ):
+        """
+        :param image: a `PreprocessGraph` shares its decoded buffers with the other consumers of
+            the image (OpenPose, `LeffaTransform`) and runs the three models concurrently.
+        :param densepose: `DensePoseOutputs` of `image` from `DensePosePredictor.predict_all`, to
+            reuse its part-label map instead of running DensePose again.
+        """
         assert mask_type in [
             "upper",
             "lower",
@@ -378,13 +451,14 @@ class AutoMasker:
             "inner",
             "outer",
         ], f"mask_type should be one of ['upper', 'lower', 'overall', 'inner', 'outer'], but got {mask_type}"
-        preprocess_results = self.preprocess_image(image)
-        mask = self.cloth_agnostic_mask(
-            preprocess_results["densepose"],
-            preprocess_results["schp_lip"],
-            preprocess_results["schp_atr"],
-            part=mask_type,
-        )
+        preprocess_results = self.preprocess_image(image, densepose)
+        with tracing.span("mask_build"):
+            mask = self.cloth_agnostic_mask(
+                preprocess_results["densepose"],
+                preprocess_results["schp_lip"],
+                preprocess_results["schp_atr"],
+                part=mask_type,
+            )
         return {
             "mask": mask,
             "densepose": preprocess_results["densepose"],
@@ -0,0 +1,103 @@
+"""
+Fast image ingest: decode an uploaded image straight to the model's canonical size.
+
+Photos from phones are commonly 12-48 megapixels, while the model sees 768x1024. Decoding them
+in full and then calling `resize_and_center` costs the whole decode plus a full-size RGB buffer.
+`ingest` reads the header first and rejects images over `max_pixels` before decoding anything.
+JPEGs are then decoded with `Image.draft`, which makes libjpeg scale the DCT blocks by 1/2, 1/4
+or 1/8 while decoding, down to the smallest size that still covers the target; other formats
+are decoded in full. Either is shrunk by Pillow (an integer box reduction, then bicubic) to the
+size `resize_and_center` would give, still in the stored orientation, and only the small image
+is rotated by its EXIF orientation. The returned RGB image at `width` x `height` is the one
+buffer every downstream consumer (mask, DensePose, transform) should use; images that need no
+downscaling come out exactly as from `resize_and_center`.
+"""
+import io
+import os
+from typing import BinaryIO, Union
+
+import numpy as np
+from PIL import Image
+
+from leffa_utils.utils import resize_and_center_array
+
+# 64 MP covers current phone cameras; LEFFA_MAX_IMAGE_PIXELS overrides it
+MAX_PIXELS = int(os.getenv("LEFFA_MAX_IMAGE_PIXELS", 64 * 1024 * 1024))
+
+_EXIF_ORIENTATION = 0x0112
+_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def _open(source):
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    try:
+        return Image.open(source)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e)) from e
+
+
+def ingest(
+    source: Union[str, bytes, BinaryIO, Image.Image],
+    width: int = 768,
+    height: int = 1024,
+    max_pixels: int = MAX_PIXELS,
+) -> Image.Image:
+    """`ingest_array` as a PIL image."""
+    return Image.fromarray(ingest_array(source, width, height, max_pixels))
+
+
+def ingest_array(
+    source: Union[str, bytes, BinaryIO, Image.Image],
+    width: int = 768,
+    height: int = 1024,
+    max_pixels: int = MAX_PIXELS,
+) -> np.ndarray:
+    """
+    Decode `source` (path, bytes, file object or PIL image) to a [`height`, `width`, 3] uint8
+    RGB array, upright and centered on white as `resize_and_center` does.
+
+    :raises ImageTooLarge: if the image has more than `max_pixels` pixels; only the header has
+        been read at that point.
+    """
+    image = _open(source)
+    if image.width * image.height > max_pixels:
+        raise ImageTooLarge(
+            "Image of {}x{} pixels exceeds the limit of {} pixels".format(
+                image.width, image.height, max_pixels)
+        )
+
+    # decode and shrink in the stored orientation, rotate the small image at the end
+    orientation = image.getexif().get(_EXIF_ORIENTATION, 1)
+    transposed = orientation in (5, 6, 7, 8)
+    upright_width, upright_height = image.size[::-1] if transposed else image.size
+    scale = min(width / upright_width, height / upright_height)
+    if scale < 1:
+        # the size resize_and_center would give the full image, in the stored orientation
+        size = (int(upright_width * scale), int(upright_height * scale))
+        size = size[::-1] if transposed else size
+        if image.format == "JPEG":
+            image.draft("RGB", size)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        # box-reduces by an integer factor first, then resamples less than 2x
+        image = image.resize(size, Image.BICUBIC, reducing_gap=2.0)
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+    if orientation in _TRANSPOSE:
+        image = image.transpose(_TRANSPOSE[orientation])
+    return resize_and_center_array(image, width, height)
@@ -0,0 +1,167 @@
+"""
+Export the mask preprocessors to ONNX for `leffa_utils.onnx_runtime`.
+
+SCHP graphs include the bilinear upsampling to the network input size and return logits as
+[N, H, W, C], the layout `transform_logits` consumes. The DensePose graph is the whole R-CNN
+traced with detectron2's `TracingAdapter`: it takes one float32 [3, H, W] image after
+`ResizeShortestEdge` (any size) and returns the detections and raw chart outputs, with the score
+threshold and detection limit of the config it was exported with.
+
+    python -m leffa_utils.onnx_export --densepose ./ckpts/densepose --schp ./ckpts/schp \\
+        --output ./ckpts/onnx
+"""
+import argparse
+import copy
+import inspect
+import math
+import os
+
+import numpy as np
+import torch
+from detectron2.export import TracingAdapter
+
+from leffa_utils.onnx_runtime import DENSEPOSE_OUTPUTS
+
+SCHP_CHECKPOINTS = {
+    "atr": "exp-schp-201908301523-atr.pth",
+    "lip": "exp-schp-201908261155-lip.pth",
+}
+DENSEPOSE_ONNX = "densepose_rcnn_R_50_FPN_s1x.onnx"
+
+
+def schp_onnx_name(dataset_type):
+    return "schp_{}.onnx".format(dataset_type)
+
+
+def _export(module, args, output_path, opset_version, **kwargs):
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # tracing-based exporter; detectron2's models are written for torch.jit tracing
+        kwargs["dynamo"] = False
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    module.eval()
+    with torch.no_grad():
+        torch.onnx.export(module, args, output_path, opset_version=opset_version, **kwargs)
+    return output_path
+
+
+class _AdaptiveAvgPool2d(torch.nn.Module):
+    """
+    `nn.AdaptiveAvgPool2d` as explicit bin means, for output sizes that do not divide the input
+    size (SCHP's pyramid pooling), which the ONNX exporter rejects. Same bins as PyTorch.
+    """
+
+    def __init__(self, output_size):
+        super().__init__()
+        self.output_size = torch.nn.modules.utils._pair(output_size)
+
+    def forward(self, x):
+        height, width = (int(n) for n in x.shape[-2:])
+        out_height, out_width = self.output_size
+        rows = []
+        for i in range(out_height):
+            top, bottom = (i * height) // out_height, math.ceil((i + 1) * height / out_height)
+            row = []
+            for j in range(out_width):
+                left, right = (j * width) // out_width, math.ceil((j + 1) * width / out_width)
+                row.append(x[:, :, top:bottom, left:right].mean(dim=(2, 3), keepdim=True))
+            rows.append(torch.cat(row, dim=3))
+        return torch.cat(rows, dim=2)
+
+
+def _exportable_pooling(module):
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.AdaptiveAvgPool2d):
+            setattr(module, name, _AdaptiveAvgPool2d(child.output_size))
+        else:
+            _exportable_pooling(child)
+    return module
+
+
+class _SCHPLogits(torch.nn.Module):
+    def __init__(self, schp):
+        super().__init__()
+        self.model = _exportable_pooling(copy.deepcopy(schp.model))
+        self.upsample = schp.upsample
+
+    def forward(self, image):
+        return self.upsample(self.model(image)).permute(0, 2, 3, 1)
+
+
+def export_schp(schp, output_path, opset_version=17):
+    """Export an `SCHP` instance; the batch dimension is dynamic."""
+    image = torch.zeros(1, 3, *schp.input_size, device=schp.device)
+    return _export(
+        _SCHPLogits(schp),
+        (image,),
+        output_path,
+        opset_version,
+        input_names=["input"],
+        output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+    )
+
+
+def _densepose_inference(model, inputs):
+    instances = model.inference(inputs, do_postprocess=False)[0]
+    densepose = instances.pred_densepose
+    return (
+        instances.pred_boxes.tensor,
+        instances.scores,
+        instances.pred_classes,
+        densepose.coarse_segm,
+        densepose.fine_segm,
+        densepose.u,
+        densepose.v,
+    )
+
+
+def export_densepose(model, output_path, opset_version=17, height=800, width=608):
+    """Export a DensePose `GeneralizedRCNN` in eval mode; image height and width are dynamic."""
+    device = next(model.parameters()).device
+    # a textured sample image, so the traced graph sees proposals and detections
+    image = np.random.RandomState(0).randint(0, 256, (3, height, width))
+    image = torch.as_tensor(image, dtype=torch.float32, device=device)
+    adapter = TracingAdapter(model, [{"image": image}], _densepose_inference)
+    output_path = _export(
+        adapter,
+        adapter.flattened_inputs,
+        output_path,
+        opset_version,
+        input_names=["image"],
+        output_names=DENSEPOSE_OUTPUTS,
+        dynamic_axes={
+            "image": {1: "height", 2: "width"},
+            **{name: {0: "detections"} for name in DENSEPOSE_OUTPUTS},
+        },
+    )
+    model.eval()  # the exporter restores the adapter's (training) mode on the whole tree
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--densepose", default="./ckpts/densepose",
+                        help="directory with the DensePose config and checkpoint")
+    parser.add_argument("--schp", default="./ckpts/schp", help="directory with the SCHP checkpoints")
+    parser.add_argument("--output", default="./ckpts/onnx")
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+
+    from SCHP import SCHP  # type: ignore
+
+    from leffa_utils.densepose_for_mask import DensePose
+
+    for dataset_type, checkpoint in SCHP_CHECKPOINTS.items():
+        schp = SCHP(ckpt_path=os.path.join(args.schp, checkpoint), device="cpu")
+        path = export_schp(
+            schp, os.path.join(args.output, schp_onnx_name(dataset_type)), args.opset)
+        print("Exported", path)
+
+    densepose = DensePose(args.densepose, device="cpu")
+    path = export_densepose(
+        densepose.predictor.model, os.path.join(args.output, DENSEPOSE_ONNX), args.opset)
+    print("Exported", path)
+
+
+if __name__ == "__main__":
+    main()
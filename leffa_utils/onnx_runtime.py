@@ -0,0 +1,123 @@
+"""
+ONNX Runtime backend for the mask preprocessors (see `leffa_utils.onnx_export`).
+
+`SessionPool` pre-creates a fixed number of `InferenceSession`s for one graph and runs them with
+IO binding, so concurrent callers never wait on session creation and outputs are allocated by
+ORT directly. `SCHPOnnx` and `DensePoseOnnxPredictor` are drop-in replacements for `SCHP` and
+detectron2's `DefaultPredictor` built on such a pool.
+"""
+import queue
+from contextlib import contextmanager
+
+import numpy as np
+import onnxruntime as ort
+import torch
+from densepose.structures import DensePoseChartPredictorOutput
+from detectron2.data import transforms as T
+from detectron2.modeling.postprocessing import detector_postprocess
+from detectron2.structures import Boxes, Instances
+from SCHP import SCHP, dataset_type_of  # type: ignore
+
+from leffa.runtime import onnx_session_options
+
+DENSEPOSE_OUTPUTS = ["boxes", "scores", "classes", "coarse_segm", "fine_segm", "u", "v"]
+
+
+def providers_for(device):
+    if str(device).startswith("cuda"):
+        return ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    return ["CPUExecutionProvider"]
+
+
+class SessionPool:
+    """
+    `size` sessions of the same graph, handed out one caller at a time.
+
+    :param model_path: Path of the .onnx file.
+    :param size: Number of sessions; the number of calls that can run concurrently.
+    :param device: "cpu" or "cuda"; selects the execution providers and where outputs are bound.
+    :param session_options: `ort.SessionOptions`; sized by the `leffa.runtime` thread budget if
+        None.
+    """
+
+    def __init__(self, model_path, size=1, device="cpu", session_options=None):
+        if session_options is None:
+            session_options = onnx_session_options()
+        providers = providers_for(device)
+        self.sessions = [
+            ort.InferenceSession(model_path, sess_options=session_options, providers=providers)
+            for _ in range(size)
+        ]
+        self.idle = queue.Queue()
+        for session in self.sessions:
+            self.idle.put(session)
+        self.input_names = [i.name for i in self.sessions[0].get_inputs()]
+        self.output_names = [o.name for o in self.sessions[0].get_outputs()]
+        uses_cuda = "CUDAExecutionProvider" in self.sessions[0].get_providers()
+        self.output_device = "cuda" if uses_cuda else "cpu"
+
+    @contextmanager
+    def session(self):
+        session = self.idle.get()
+        try:
+            yield session
+        finally:
+            self.idle.put(session)
+
+    def run(self, feeds):
+        """Run on `feeds` (input name -> numpy array); returns the outputs as numpy arrays."""
+        with self.session() as session:
+            binding = session.io_binding()
+            for name, value in feeds.items():
+                binding.bind_cpu_input(name, np.ascontiguousarray(value))
+            for name in self.output_names:
+                binding.bind_output(name, self.output_device)
+            session.run_with_iobinding(binding)
+            return binding.copy_outputs_to_cpu()
+
+
+class SCHPOnnx(SCHP):
+    """`SCHP` running an exported graph; the dataset is taken from the file name like `SCHP`."""
+
+    def __init__(self, onnx_path, device="cpu", pool_size=1, session_options=None):
+        self.device = "cpu"  # inputs are bound from host memory
+        self.setup_dataset(dataset_type_of(onnx_path))
+        self.pool = SessionPool(onnx_path, pool_size, device, session_options)
+
+    def forward(self, image):
+        return self.pool.run({self.pool.input_names[0]: image.numpy()})[0]
+
+
+class DensePoseOnnxPredictor:
+    """
+    `DefaultPredictor` for an exported DensePose R-CNN: same preprocessing and the same
+    {"instances": Instances} output, with `pred_densepose` rebuilt from the graph outputs.
+
+    Detection thresholds and limits are those of the config the graph was exported with.
+    """
+
+    def __init__(self, cfg, onnx_path, device="cpu", pool_size=1, session_options=None):
+        self.cfg = cfg.clone()
+        self.pool = SessionPool(onnx_path, pool_size, device, session_options)
+        self.aug = T.ResizeShortestEdge(
+            [cfg.INPUT.MIN_SIZE_TEST, cfg.INPUT.MIN_SIZE_TEST], cfg.INPUT.MAX_SIZE_TEST
+        )
+        self.input_format = cfg.INPUT.FORMAT
+        assert self.input_format in ["RGB", "BGR"], self.input_format
+
+    def __call__(self, original_image):
+        if self.input_format == "RGB":
+            original_image = original_image[:, :, ::-1]
+        height, width = original_image.shape[:2]
+        image = self.aug.get_transform(original_image).apply_image(original_image)
+        image = image.astype("float32").transpose(2, 0, 1)
+
+        outputs = dict(zip(DENSEPOSE_OUTPUTS, self.pool.run({"image": image})))
+        instances = Instances(image.shape[1:])
+        instances.pred_boxes = Boxes(torch.from_numpy(outputs["boxes"]))
+        instances.scores = torch.from_numpy(outputs["scores"])
+        instances.pred_classes = torch.from_numpy(outputs["classes"])
+        instances.pred_densepose = DensePoseChartPredictorOutput(
+            **{k: torch.from_numpy(outputs[k]) for k in ("coarse_segm", "fine_segm", "u", "v")}
+        )
+        return {"instances": detector_postprocess(instances, height, width)}
@@ -0,0 +1,150 @@
+"""
+One person image decoded once, and every preprocessing model's input derived from it.
+
+DensePose, SCHP, human parsing, OpenPose and `LeffaTransform` used to each open or convert the
+image themselves: a PNG round trip through a temporary file, RGB -> BGR fancy-index copies, PIL
+-> numpy conversions, a resize per consumer. A `PreprocessGraph` decodes the image once with
+`leffa_utils.ingest` into a read-only [H, W, 3] uint8 RGB buffer (`rgb`), and builds the other
+inputs from it on first use: the BGR copy, resized variants, ... Every intermediate is cached
+and shared by all consumers, so two models that need the 384x512 BGR image get the same array.
+Each buffer the graph allocates is recorded in `copies`, and `bytes_copied` is their total per
+request.
+
+`run` calls independent branches (e.g. DensePose and both SCHP parsers) concurrently; they all
+read the same cached intermediates, which are built once even when branches ask for them at the
+same time.
+
+    graph = PreprocessGraph("person.jpg")
+    outputs = graph.run({
+        "parse": lambda: parsing(graph.resized_bgr(384, 512)),
+        "pose": lambda: openpose(graph.resized(384, 512)),
+        "densepose": lambda: densepose.predict_seg(graph.rgb),
+    })
+    data = transform({"src_image": [graph.rgb], ...})
+    graph.bytes_copied
+"""
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+import numpy as np
+import torch
+from PIL import Image
+
+from leffa import tracing
+from leffa_utils.ingest import ingest_array
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _branch_executor():
+    # shared by all graphs: branches are few and mostly release the GIL in native code
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="preprocess")
+        return _executor
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    return 0
+
+
+class PreprocessGraph:
+    """
+    :param source: path, bytes, file object or PIL image, decoded by `ingest_array`; or a
+        [height, width, 3] uint8 RGB array, used as the canonical buffer as is (and made
+        read-only, like every buffer of the graph).
+    """
+
+    def __init__(self, source, width=768, height=1024):
+        self.width = width
+        self.height = height
+        self.copies: Dict[str, int] = {}
+        self._nodes: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+        if isinstance(source, np.ndarray):
+            assert source.shape == (height, width, 3) and source.dtype == np.uint8, source.shape
+            rgb = source
+        else:
+            with tracing.span("decode_image"):
+                rgb = ingest_array(source, width, height)
+            self.copies["decode"] = rgb.nbytes
+        rgb.flags.writeable = False
+        self.rgb: np.ndarray = rgb
+
+    @property
+    def bytes_copied(self) -> int:
+        return sum(self.copies.values())
+
+    def node(self, name: str, build: Callable[[], Any]) -> Any:
+        """The intermediate `name`: built by `build()` on first use, then shared."""
+        with self._lock:
+            if name in self._nodes:
+                return self._nodes[name]
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self._nodes:
+                value = build()
+                if isinstance(value, np.ndarray):
+                    value.flags.writeable = False
+                self._record(name, value)
+                with self._lock:
+                    self._nodes[name] = value
+        return self._nodes[name]
+
+    def _record(self, name, value):
+        with self._lock:
+            self.copies[name] = _nbytes(value)
+
+    def bgr(self) -> np.ndarray:
+        """Contiguous BGR copy of `rgb`, for detectron2 and OpenCV-style models."""
+        return self.node("bgr", lambda: np.ascontiguousarray(self.rgb[:, :, ::-1]))
+
+    def image(self) -> Image.Image:
+        """`rgb` as a PIL image."""
+        return self.node("image", lambda: Image.fromarray(self.rgb))
+
+    def resized(self, width: int, height: int) -> np.ndarray:
+        """RGB array at `width` x `height`, resized as `Image.resize` does (bicubic)."""
+        if (width, height) == (self.width, self.height):
+            return self.rgb
+        name = "rgb_{}x{}".format(width, height)
+
+        def build():
+            image = self.image().resize((width, height))
+            self._record(name + "_image", image)
+            return np.asarray(image)
+
+        return self.node(name, build)
+
+    def resized_bgr(self, width: int, height: int) -> np.ndarray:
+        """Contiguous BGR copy of `resized(width, height)`."""
+        if (width, height) == (self.width, self.height):
+            return self.bgr()
+        return self.node(
+            "bgr_{}x{}".format(width, height),
+            lambda: np.ascontiguousarray(self.resized(width, height)[:, :, ::-1]),
+        )
+
+    def run(self, branches: Dict[str, Callable[[], Any]]) -> Dict[str, Any]:
+        """
+        Call the independent `branches` concurrently and return their results by name. Each runs
+        in the caller's tracing context; branches must not call `run` themselves.
+        """
+        executor = _branch_executor()
+        futures = {
+            name: executor.submit(contextvars.copy_context().run, branch)
+            for name, branch in branches.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
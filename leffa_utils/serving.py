@@ -0,0 +1,526 @@
+"""
+Multi-process serving: inference workers own the model, HTTP frontends only decode and encode.
+
+A single uvicorn process keeps the model in its globals, and every extra uvicorn worker would
+load another copy of the weights. `InferencePool` instead starts one process per `WorkerSpec`,
+each building its handler (`LeffaInference`, `LeffaTransform` and optionally `AutoMasker`, see
+`TryOnHandler`) once, and any number of frontends hand requests to them:
+
+- requests go over one local queue that every idle worker takes from, so load balances itself;
+- images do not travel through the queues: a request borrows a slot of one shared-memory block
+  holding its person and garment images and its result, and only the slot index, the request id
+  and the inference arguments are pickled. Free slots come from a queue too, so frontends wait
+  for a slot when all are in use;
+- a worker can be pinned: "cpu:0-3" restricts it to those CPUs and sizes its thread budget
+  (`leffa.runtime`) to them, "cuda:1" makes it see only that GPU;
+- each worker thread records the request it runs in a shared array; when a worker process dies
+  (OOM kill, segfault), the pool fails its requests, which returns their slots, and restarts it.
+
+`InferenceClient` is the frontend side; `submit` returns a future like `StagedExecutor.submit`.
+`serve` runs the whole topology for an ASGI app: it binds the port once and starts the pool and
+`frontends` uvicorn processes that accept on the shared socket. Spans recorded inside workers
+stay there; the frontend records the whole round trip.
+
+    pool = InferencePool("server:build_handler", ["cpu:0-7", "cpu:8-15"])
+    client = pool.client()
+    result = client.submit(person, garment, num_inference_steps=30).result()  # [H, W, 3] uint8
+    pool.close()
+"""
+import importlib
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from leffa import runtime, tracing
+from leffa_utils.preprocess_graph import PreprocessGraph
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+_STOP = None  # ends a worker thread or a client thread
+
+
+@dataclass
+class WorkerSpec:
+    """Where an inference worker runs: "cpu", "cpu:<cpulist>" (e.g. "cpu:0-3,8") or "cuda:<n>"."""
+
+    device: str = "cpu"
+    cpus: Optional[List[int]] = None
+
+    @classmethod
+    def parse(cls, text: str) -> "WorkerSpec":
+        kind, _, value = text.strip().partition(":")
+        if kind == "cpu":
+            return cls("cpu", runtime.parse_cpu_list(value) if value else None)
+        if kind == "cuda" and value.isdigit():
+            return cls(text.strip())
+        raise ValueError(
+            "worker should be 'cpu', 'cpu:<cpulist>' or 'cuda:<index>', but got {!r}".format(text)
+        )
+
+
+def parse_worker_specs(text: str) -> List[WorkerSpec]:
+    """
+    Worker specs separated by spaces or semicolons, e.g. "cpu:0-7 cpu:8-15" or "cuda:0;cuda:1".
+    A number N stands for N CPU workers splitting the physical cores evenly (unpinned when there
+    are fewer cores than workers).
+    """
+    text = text.strip()
+    if text.isdigit():
+        workers, cpus = int(text), runtime.physical_core_cpus()
+        if len(cpus) < workers:
+            return [WorkerSpec() for _ in range(workers)]
+        per_worker = len(cpus) // workers
+        return [
+            WorkerSpec("cpu", cpus[i * per_worker:(i + 1) * per_worker]) for i in range(workers)
+        ]
+    return [WorkerSpec.parse(part) for part in re.split(r"[\s;]+", text) if part]
+
+
+class SharedSlots(object):
+    """
+    `num_slots` slots in one shared-memory block, each holding a uint8 array per entry of
+    `shapes`. Pickles as a reference to the block, which the receiving process attaches to.
+    """
+
+    def __init__(self, num_slots: int, shapes: Dict[str, Tuple[int, ...]], name=None):
+        self.num_slots = num_slots
+        self.shapes = dict(shapes)
+        self.slot_bytes = sum(int(np.prod(shape)) for shape in self.shapes.values())
+        self._owner = name is None
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=self._owner, size=num_slots * self.slot_bytes if self._owner else 0
+        )
+
+    def __reduce__(self):
+        return SharedSlots, (self.num_slots, self.shapes, self.shm.name)
+
+    def arrays(self, slot: int) -> Dict[str, np.ndarray]:
+        """Views of the arrays of `slot`, without copying."""
+        arrays, offset = {}, slot * self.slot_bytes
+        for name, shape in self.shapes.items():
+            arrays[name] = np.ndarray(shape, np.uint8, buffer=self.shm.buf, offset=offset)
+            offset += arrays[name].nbytes
+        return arrays
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            # views still alive in this process; the mapping goes with the process
+            pass
+        if self._owner:
+            self.shm.unlink()
+
+
+class TryOnHandler(object):
+    """
+    What an inference worker runs for a request: the try-on of `person` on `garment`, both
+    [H, W, 3] uint8 RGB arrays at the model size. Without `automasker` the whole image is
+    inpainted, as `api/server.py` does; with it, the `mask_type` agnostic mask is used.
+
+    Concurrent calls share the masks and transform; without `executor` they take turns in
+    `inference`, whose pipeline keeps one scheduler (timesteps and step state) for all requests.
+    """
+
+    def __init__(self, inference, transform, executor=None, automasker=None, mask_type="upper"):
+        self.inference = inference
+        self.transform = transform
+        self.executor = executor
+        self.automasker = automasker
+        self.mask_type = mask_type
+        self._inference_lock = threading.Lock()
+
+    def __call__(self, person: np.ndarray, garment: np.ndarray, **kwargs) -> np.ndarray:
+        height, width = person.shape[:2]
+        if self.automasker is not None:
+            graph = PreprocessGraph(person, width, height)
+            mask = self.automasker(graph, self.mask_type)["mask"]
+        else:
+            mask = np.full((height, width), 255, dtype=np.uint8)
+        data = {
+            "src_image": [person],
+            "ref_image": [garment],
+            "mask": [mask],
+            "densepose": [np.ones((height, width, 3), dtype=np.uint8)],
+        }
+        if self.executor is not None:
+            output = self.executor.submit(data, **kwargs).result()
+        else:
+            with tracing.span("leffa_transform"):
+                data = self.transform(data)
+            with self._inference_lock:
+                output = self.inference(data, **kwargs)
+        return np.asarray(output["generated_image"][0])
+
+
+def _import(path):
+    module, _, attribute = path.partition(":")
+    return getattr(importlib.import_module(module), attribute)
+
+
+def _place(spec: WorkerSpec, concurrency: int):
+    """Pin this (fresh) process as `spec` says, before anything touches CUDA or thread pools."""
+    if spec.device.startswith("cuda"):
+        index = int(spec.device.split(":", 1)[1])
+        visible = os.getenv("CUDA_VISIBLE_DEVICES")
+        os.environ["CUDA_VISIBLE_DEVICES"] = (
+            visible.split(",")[index] if visible else str(index)
+        )
+    if spec.cpus:
+        os.sched_setaffinity(0, spec.cpus)
+        # through the environment, so a `configure()` on importing the factory's module agrees
+        os.environ.pop("LEFFA_CPU_AFFINITY", None)
+        os.environ["LEFFA_CPU_CORES"] = str(len(runtime.physical_core_cpus(spec.cpus)))
+    os.environ["LEFFA_WORKERS"] = str(concurrency)
+    runtime.configure()
+
+
+def _worker_main(index, spec, factory, slots, requests, responses, ready, claims, concurrency):
+    logging.basicConfig(level=logging.INFO)
+    try:
+        _place(spec, concurrency)
+        handler = _import(factory)()
+    except Exception as e:
+        logger.exception("Inference worker {} failed to start".format(index))
+        ready.put((index, "{}: {}".format(type(e).__name__, e)))
+        return
+    ready.put((index, None))
+
+    def serve(row):
+        while True:
+            message = requests.get()
+            if message is _STOP:
+                return
+            frontend, request_id, slot, kwargs = message
+            # the claim is valid once its frontend is set, see InferencePool._fail_claims
+            claims[3 * row + 1], claims[3 * row + 2] = request_id, slot
+            claims[3 * row] = frontend
+            arrays = slots.arrays(slot)
+            start = time.perf_counter()
+            try:
+                arrays["result"][...] = handler(arrays["person"], arrays["garment"], **kwargs)
+                error = None
+            except Exception as e:
+                logger.exception("Request failed in inference worker {}".format(index))
+                error = "{}: {}".format(type(e).__name__, e)
+            responses[frontend].put((request_id, time.perf_counter() - start, error))
+            claims[3 * row] = -1
+
+    threads = [
+        threading.Thread(
+            target=serve,
+            args=(index * concurrency + i,),
+            name="inference-{}-{}".format(index, i),
+            daemon=True,
+        )
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class InferenceClient(object):
+    """
+    Frontend end of an `InferencePool`; build it with `InferencePool.client`, in any process.
+    `submit` never blocks: a dispatcher thread waits for a free slot and copies the images in,
+    and a listener thread copies results out and completes the futures.
+    """
+
+    def __init__(self, slots, free_slots, requests, responses, frontend):
+        self._slots = slots
+        self._free_slots = free_slots
+        self._requests = requests
+        self._responses = responses
+        self._frontend = frontend
+        self._pending = queue.Queue()
+        self._futures: Dict[int, Tuple[Future, int]] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._threads = [
+            threading.Thread(target=self._dispatch_loop, name="inference-dispatch", daemon=True),
+            threading.Thread(target=self._listen_loop, name="inference-listen", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, person: np.ndarray, garment: np.ndarray, **kwargs) -> Future:
+        """
+        Queue the try-on of `person` on `garment` (uint8 RGB arrays of the pool's size); the
+        future's result is the generated [H, W, 3] uint8 image.
+        """
+        future = Future()
+        self._pending.put((future, person, garment, kwargs))
+        return future
+
+    def close(self):
+        self._pending.put(_STOP)
+        self._responses.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _dispatch_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is _STOP:
+                return
+            future, person, garment, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            slot = self._free_slots.get()
+            try:
+                arrays = self._slots.arrays(slot)
+                arrays["person"][...] = person
+                arrays["garment"][...] = garment
+            except Exception as e:
+                self._free_slots.put(slot)
+                future.set_exception(e)
+                continue
+            request_id = next(self._ids)
+            with self._lock:
+                self._futures[request_id] = (future, slot)
+            self._requests.put((self._frontend, request_id, slot, kwargs))
+
+    def _listen_loop(self):
+        while True:
+            message = self._responses.get()
+            if message is _STOP:
+                return
+            request_id, _, error = message
+            with self._lock:
+                future, slot = self._futures.pop(request_id, (None, None))
+            if future is None:
+                # failed by the pool for a worker that died right after responding
+                continue
+            if error is None:
+                result = self._slots.arrays(slot)["result"].copy()
+            self._free_slots.put(slot)
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(error))
+
+
+class InferencePool(object):
+    """
+    :param factory: "module:function" returning the handler, called once in each worker; the
+        handler is called as `handler(person, garment, **kwargs)` and returns the result image
+        (e.g. `TryOnHandler`).
+    :param workers: `WorkerSpec`s or their strings, one inference process each.
+    :param frontends: number of `InferenceClient`s (one per frontend process) to serve.
+    :param concurrency: requests each worker runs at a time; above 1 only helps a handler that
+        overlaps them, e.g. one with a `StagedExecutor` (`TryOnHandler` without one only
+        overlaps masking and transforms).
+    :param num_slots: shared-memory slots, by default two per request a worker can run, so a
+        worker finds its next request already copied in.
+    """
+
+    def __init__(
+        self,
+        factory: str,
+        workers: Sequence[Union[str, WorkerSpec]] = ("cpu",),
+        frontends: int = 1,
+        height: int = 1024,
+        width: int = 768,
+        concurrency: int = 1,
+        num_slots: Optional[int] = None,
+    ):
+        context = multiprocessing.get_context("spawn")
+        specs = [WorkerSpec.parse(w) if isinstance(w, str) else w for w in workers]
+        num_slots = num_slots or 2 * len(specs) * concurrency
+        shape = (height, width, 3)
+        self.slots = SharedSlots(num_slots, {"person": shape, "garment": shape, "result": shape})
+        self._free_slots = context.Queue()
+        for slot in range(num_slots):
+            self._free_slots.put(slot)
+        self._requests = context.Queue()
+        self._responses = [context.Queue() for _ in range(frontends)]
+        # (frontend, request id, slot) of the request each worker thread runs, frontend -1 if none
+        self._claims = context.RawArray("q", [-1] * (3 * len(specs) * concurrency))
+        self._threads_per_worker = concurrency
+        self._clients: List[InferenceClient] = []
+        self._context = context
+        self._factory = factory
+        self._specs = specs
+        self._ready = context.Queue()
+        self._closing = threading.Event()
+        self._monitor = None
+
+        self.processes = [self._start_worker(i) for i in range(len(specs))]
+        errors = self._wait_ready(self._ready)
+        if errors:
+            self.close()
+            raise RuntimeError("Inference workers failed to start: {}".format("; ".join(errors)))
+        self._monitor = threading.Thread(
+            target=self._monitor_loop, name="inference-monitor", daemon=True)
+        self._monitor.start()
+        logger.info(
+            "{} inference workers {} with {} shared-memory slots of {:.1f} MB".format(
+                len(specs), specs, num_slots, self.slots.slot_bytes / 2 ** 20
+            )
+        )
+
+    def _start_worker(self, index):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self._specs[index], self._factory, self.slots, self._requests,
+                  self._responses, self._ready, self._claims, self._threads_per_worker),
+            name="leffa-inference-{}".format(index),
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def _monitor_loop(self):
+        while not self._closing.wait(1.0):
+            for index, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                failed = self._fail_claims(index, process.exitcode)
+                logger.error(
+                    "Inference worker {} exited with code {}; failed {} requests, restarting "
+                    "it".format(index, process.exitcode, failed)
+                )
+                self.processes[index] = self._start_worker(index)
+            while True:
+                try:
+                    index, error = self._ready.get_nowait()
+                except queue.Empty:
+                    break
+                if error:
+                    logger.error("Inference worker {} failed to restart: {}".format(index, error))
+
+    def _fail_claims(self, index, exitcode):
+        """Fail the requests that worker `index` was running; their frontends free the slots."""
+        failed = 0
+        for row in range(index * self._threads_per_worker, (index + 1) * self._threads_per_worker):
+            frontend = self._claims[3 * row]
+            if frontend < 0:
+                continue
+            error = "inference worker {} exited with code {}".format(index, exitcode)
+            self._responses[frontend].put((self._claims[3 * row + 1], 0.0, error))
+            self._claims[3 * row] = -1
+            failed += 1
+        return failed
+
+    def _wait_ready(self, ready):
+        """Errors of the workers that failed to build their handler, or died trying."""
+        pending, errors = set(range(len(self.processes))), []
+        while pending:
+            try:
+                index, error = ready.get(timeout=1.0)
+            except queue.Empty:
+                for index in list(pending):
+                    if not self.processes[index].is_alive():
+                        pending.discard(index)
+                        errors.append("worker {} exited with code {}".format(
+                            index, self.processes[index].exitcode))
+                continue
+            pending.discard(index)
+            if error:
+                errors.append("worker {}: {}".format(index, error))
+        return errors
+
+    def client_args(self, frontend: int = 0) -> tuple:
+        """Picklable arguments of `InferenceClient` for frontend `frontend` of the pool."""
+        return (self.slots, self._free_slots, self._requests, self._responses[frontend], frontend)
+
+    def client(self, frontend: int = 0) -> InferenceClient:
+        """An `InferenceClient` in this process, closed with the pool."""
+        client = InferenceClient(*self.client_args(frontend))
+        self._clients.append(client)
+        return client
+
+    def close(self):
+        self._closing.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        for client in self._clients:
+            client.close()
+        for _ in range(len(self.processes) * self._threads_per_worker):
+            self._requests.put(_STOP)
+        for process in self.processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+        self.slots.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _frontend_main(app, client_args, sock, log_level):
+    import uvicorn
+
+    module, _, attribute = app.partition(":")
+    module = importlib.import_module(module)
+    # the app dispatches to the pool instead of loading a model of its own
+    module.inference_client = InferenceClient(*client_args)
+    config = uvicorn.Config(getattr(module, attribute), log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(
+    app: str,
+    factory: str,
+    workers: Sequence[Union[str, WorkerSpec]],
+    frontends: int = 1,
+    host: str = "0.0.0.0",
+    port: int = 8000,
+    log_level: str = "info",
+    **pool_kwargs,
+):
+    """
+    Serve `app` ("module:attribute") from `frontends` uvicorn processes sharing one listening
+    socket, with inference in an `InferencePool` of `workers` built by `factory`. Each frontend
+    sets the app module's `inference_client` global before the app starts. Blocks until the
+    frontends exit.
+    """
+    with InferencePool(factory, workers, frontends=frontends, **pool_kwargs) as pool:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.set_inheritable(True)
+        context = multiprocessing.get_context("spawn")
+        processes = [
+            context.Process(
+                target=_frontend_main,
+                args=(app, pool.client_args(i), sock, log_level),
+                name="leffa-frontend-{}".format(i),
+            )
+            for i in range(frontends)
+        ]
+        for process in processes:
+            process.start()
+        logger.info("Serving {} on {}:{} with {} frontends".format(app, host, port, frontends))
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+                process.join()
+        finally:
+            sock.close()
@@ -3,10 +3,20 @@ import cv2
 import torch
 import numpy as np
 from numpy.linalg import lstsq
-from PIL import Image, ImageDraw
+from PIL import Image
 
 
 def resize_and_center(image, target_width, target_height):
+    return Image.fromarray(resize_and_center_array(image, target_width, target_height))
+
+
+def resize_and_center_array(
+    image, target_width, target_height, interpolation=cv2.INTER_CUBIC, fill=255
+):
+    """
+    `resize_and_center` as a [target_height, target_width, 3] uint8 RGB array. Label images
+    (masks, DensePose) take `interpolation=cv2.INTER_NEAREST` and their background as `fill`.
+    """
     img = np.array(image)
 
     if img.shape[-1] == 4:
@@ -21,17 +31,16 @@ def resize_and_center(image, target_width, target_height):
     new_width = int(original_width * scale)
 
     resized_img = cv2.resize(img, (new_width, new_height),
-                             interpolation=cv2.INTER_CUBIC)
+                             interpolation=interpolation)
 
-    padded_img = np.ones((target_height, target_width, 3),
-                         dtype=np.uint8) * 255
+    padded_img = np.full((target_height, target_width, 3), fill, dtype=np.uint8)
 
     top = (target_height - new_height) // 2
     left = (target_width - new_width) // 2
 
     padded_img[top:top + new_height, left:left + new_width] = resized_img
 
-    return Image.fromarray(padded_img)
+    return padded_img
 
 
 def list_dir(folder_path):
@@ -100,6 +109,76 @@ def refine_mask(mask):
     return refine_mask
 
 
+# bit flags of the label -> category lookup tables below
+HEAD, FIXED, CLOTH, LEFT_ARM, RIGHT_ARM, NECK = (1 << i for i in range(6))
+
+
+def _category_lut(head, fixed, cloth):
+    lut = np.zeros(256, dtype=np.uint8)
+    for flag, labels in ((HEAD, head), (FIXED, fixed), (CLOTH, cloth),
+                         (LEFT_ARM, [label_map["left_arm"]]),
+                         (RIGHT_ARM, [label_map["right_arm"]]), (NECK, [label_map["neck"]])):
+        lut[labels] |= flag
+    return lut
+
+
+# per method and category: which parse labels are head, fixed (kept), cloth (masked), arms, neck
+AGNOSTIC_MASK_LUTS = {
+    "hd": {
+        "dresses": _category_lut([1, 3, 11], [9, 10, 1, 3, 16], [7, 4, 5, 6]),
+        "upper_body": _category_lut([1, 3, 11], [9, 10, 1, 3, 16, 5, 6], [4, 7]),
+        "lower_body": _category_lut([1, 3, 11], [9, 10, 1, 3, 16, 4, 14, 15], [6, 12, 13, 5]),
+    },
+    "dc": {
+        "dresses": _category_lut([1, 2, 3, 11, 18], [2, 9, 10, 1, 3, 17, 16], [7, 12, 13]),
+        "upper_body": _category_lut([1, 2, 3, 11, 18], [2, 9, 10, 1, 3, 17, 16, 5, 6], [4]),
+        "lower_body": _category_lut(
+            [1, 2, 3, 11, 18], [2, 9, 10, 1, 3, 17, 16, 4, 14, 15], [6, 12, 13]),
+    },
+}
+
+
+def parse_flags(parse_array, category, method="hd"):
+    if category not in AGNOSTIC_MASK_LUTS[method]:
+        raise NotImplementedError
+    return AGNOSTIC_MASK_LUTS[method][category][parse_array]
+
+
+def draw_thick_polyline(canvas, points, width):
+    """
+    Draw a polyline of `width` into the uint8 `canvas` as PIL's `line(..., joint="curve")` does:
+    flat ends and rounded joints. Points are float (x, y); drawn with 1/16 pixel precision.
+    """
+    shift = 4
+    points = np.asarray(points, dtype=np.float64)
+    for start, end in zip(points[:-1], points[1:]):
+        direction = end - start
+        length = np.hypot(*direction)
+        if length == 0:
+            continue
+        # OpenCV fills every pixel the outline touches, PIL's polygon fill only the interior;
+        # one pixel less width gives the closest match
+        offset = np.array([-direction[1], direction[0]]) / length * ((width - 1) / 2)
+        corners = np.stack([start + offset, end + offset, end - offset, start - offset])
+        cv2.fillConvexPoly(canvas, np.round(corners * (1 << shift)).astype(np.int32), 1,
+                           cv2.LINE_8, shift)
+    for joint in points[1:-1]:
+        draw_disk(canvas, joint, (width - 1) / 2)
+    return canvas
+
+
+def draw_disk(canvas, center, radius):
+    shift = 4
+    center = tuple(int(v) for v in np.round(np.asarray(center) * (1 << shift)))
+    cv2.circle(canvas, center, int(round(radius * (1 << shift))), 1, -1, cv2.LINE_8, shift)
+    return canvas
+
+
+def _dilate(mask, size, iterations):
+    return cv2.dilate(mask.view(np.uint8), np.ones((size, size), np.uint8),
+                      iterations=iterations).view(bool)
+
+
 def get_agnostic_mask_hd(model_parse, keypoint, category, size=(384, 512), model_type="hd"):
     # model_type = "hd"
     ##############################
@@ -114,122 +193,55 @@ def get_agnostic_mask_hd(model_parse, keypoint, category, size=(384, 512), model
     else:
         raise ValueError("model_type must be \'hd\' or \'dc\'!")
 
-    parse_head = (parse_array == 1).astype(np.float32) + \
-                 (parse_array == 3).astype(np.float32) + \
-                 (parse_array == 11).astype(np.float32)
-
-    parser_mask_fixed = (parse_array == label_map["left_shoe"]).astype(np.float32) + \
-                        (parse_array == label_map["right_shoe"]).astype(np.float32) + \
-                        (parse_array == label_map["hat"]).astype(np.float32) + \
-                        (parse_array == label_map["sunglasses"]).astype(np.float32) + \
-                        (parse_array == label_map["bag"]).astype(np.float32)
-
-    parser_mask_changeable = (
-        parse_array == label_map["background"]).astype(np.float32)
-
-    arms_left = (parse_array == 14).astype(np.float32)
-    arms_right = (parse_array == 15).astype(np.float32)
-
-    if category == 'dresses':
-        parse_mask = (parse_array == 7).astype(np.float32) + \
-                     (parse_array == 4).astype(np.float32) + \
-                     (parse_array == 5).astype(np.float32) + \
-                     (parse_array == 6).astype(np.float32)
-
-        parser_mask_changeable += np.logical_and(
-            parse_array, np.logical_not(parser_mask_fixed))
-
-    elif category == 'upper_body':
-        parse_mask = (parse_array == 4).astype(np.float32) + \
-            (parse_array == 7).astype(np.float32)
-        parser_mask_fixed_lower_cloth = (parse_array == label_map["skirt"]).astype(np.float32) + \
-                                        (parse_array == label_map["pants"]).astype(
-                                            np.float32)
-        parser_mask_fixed += parser_mask_fixed_lower_cloth
-        parser_mask_changeable += np.logical_and(
-            parse_array, np.logical_not(parser_mask_fixed))
-    elif category == 'lower_body':
-        parse_mask = (parse_array == 6).astype(np.float32) + \
-                     (parse_array == 12).astype(np.float32) + \
-                     (parse_array == 13).astype(np.float32) + \
-                     (parse_array == 5).astype(np.float32)
-        parser_mask_fixed += (parse_array == label_map["upper_clothes"]).astype(np.float32) + \
-                             (parse_array == 14).astype(np.float32) + \
-                             (parse_array == 15).astype(np.float32)
-        parser_mask_changeable += np.logical_and(
-            parse_array, np.logical_not(parser_mask_fixed))
-    else:
-        raise NotImplementedError
+    flags = parse_flags(parse_array, category, "hd")
+    parse_head = (flags & HEAD) > 0
+    parser_mask_fixed = (flags & FIXED) > 0
+    parser_mask_changeable = ~parser_mask_fixed
+    parse_mask = (flags & CLOTH) > 0
 
     # Load pose points
     pose_data = keypoint["pose_keypoints_2d"]
     pose_data = np.array(pose_data)
     pose_data = pose_data.reshape((-1, 2))
 
-    im_arms_left = Image.new('L', (width, height))
-    im_arms_right = Image.new('L', (width, height))
-    arms_draw_left = ImageDraw.Draw(im_arms_left)
-    arms_draw_right = ImageDraw.Draw(im_arms_right)
-    if category == 'dresses' or category == 'upper_body':
-        shoulder_right = np.multiply(tuple(pose_data[2][:2]), height / 512.0)
-        shoulder_left = np.multiply(tuple(pose_data[5][:2]), height / 512.0)
-        elbow_right = np.multiply(tuple(pose_data[3][:2]), height / 512.0)
-        elbow_left = np.multiply(tuple(pose_data[6][:2]), height / 512.0)
-        wrist_right = np.multiply(tuple(pose_data[4][:2]), height / 512.0)
-        wrist_left = np.multiply(tuple(pose_data[7][:2]), height / 512.0)
+    upper = category == 'dresses' or category == 'upper_body'
+    if upper:
+        # drawn left and right arms, or the parsed arm where the wrist is missing
+        im_arms = np.zeros((2, height, width), dtype=np.uint8)
         ARM_LINE_WIDTH = int(arm_width / 512 * height)
-        size_left = [shoulder_left[0] - ARM_LINE_WIDTH // 2, shoulder_left[1] - ARM_LINE_WIDTH //
-                     2, shoulder_left[0] + ARM_LINE_WIDTH // 2, shoulder_left[1] + ARM_LINE_WIDTH // 2]
-        size_right = [shoulder_right[0] - ARM_LINE_WIDTH // 2, shoulder_right[1] - ARM_LINE_WIDTH // 2, shoulder_right[0] + ARM_LINE_WIDTH // 2,
-                      shoulder_right[1] + ARM_LINE_WIDTH // 2]
-
-        if wrist_right[0] <= 1. and wrist_right[1] <= 1.:
-            im_arms_right = arms_right
-        else:
-            wrist_right = extend_arm_mask(wrist_right, elbow_right, 1.2)
-            arms_draw_right.line(np.concatenate((shoulder_right, elbow_right, wrist_right)).astype(
-                np.uint16).tolist(), 'white', ARM_LINE_WIDTH, 'curve')
-            arms_draw_right.arc(size_right, 0, 360,
-                                'white', ARM_LINE_WIDTH // 2)
-
-        if wrist_left[0] <= 1. and wrist_left[1] <= 1.:
-            im_arms_left = arms_left
-        else:
-            wrist_left = extend_arm_mask(wrist_left, elbow_left, 1.2)
-            arms_draw_left.line(np.concatenate((wrist_left, elbow_left, shoulder_left)).astype(
-                np.uint16).tolist(), 'white', ARM_LINE_WIDTH, 'curve')
-            arms_draw_left.arc(size_left, 0, 360, 'white', ARM_LINE_WIDTH // 2)
-
-        hands_left = np.logical_and(np.logical_not(im_arms_left), arms_left)
-        hands_right = np.logical_and(np.logical_not(im_arms_right), arms_right)
-        parser_mask_fixed += hands_left + hands_right
-
-    parser_mask_fixed = cv2.erode(parser_mask_fixed, np.ones(
-        (5, 5), np.uint16), iterations=1)
-
-    parser_mask_fixed = np.logical_or(parser_mask_fixed, parse_head)
-    parse_mask = cv2.dilate(parse_mask, np.ones(
-        (10, 10), np.uint16), iterations=5)
-    if category == 'dresses' or category == 'upper_body':
-        neck_mask = (parse_array == 18).astype(np.float32)
-        neck_mask = cv2.dilate(neck_mask, np.ones(
-            (5, 5), np.uint16), iterations=1)
-        neck_mask = np.logical_and(neck_mask, np.logical_not(parse_head))
-        parse_mask = np.logical_or(parse_mask, neck_mask)
-        arm_mask = cv2.dilate(np.logical_or(im_arms_left, im_arms_right).astype(
-            'float32'), np.ones((5, 5), np.uint16), iterations=4)
-        parse_mask += np.logical_or(parse_mask, arm_mask)
-
-    parse_mask = np.logical_and(
-        parser_mask_changeable, np.logical_not(parse_mask))
-
-    parse_mask_total = np.logical_or(parse_mask, parser_mask_fixed)
-    inpaint_mask = 1 - parse_mask_total
-    img = np.where(inpaint_mask, 255, 0)
-    dst = hole_fill(img.astype(np.uint8))
+        for side, (shoulder, elbow, wrist), arm_flag in ((0, (5, 6, 7), LEFT_ARM),
+                                                         (1, (2, 3, 4), RIGHT_ARM)):
+            shoulder, elbow, wrist = (pose_data[i][:2] * (height / 512.0)
+                                      for i in (shoulder, elbow, wrist))
+            if wrist[0] <= 1. and wrist[1] <= 1.:
+                im_arms[side] = (flags & arm_flag) > 0
+            else:
+                wrist = extend_arm_mask(wrist, elbow, 1.2)
+                line = np.stack((shoulder, elbow, wrist)).astype(np.uint16)
+                draw_thick_polyline(im_arms[side], line, ARM_LINE_WIDTH)
+                draw_disk(im_arms[side], shoulder, ARM_LINE_WIDTH // 2)
+        im_arms = im_arms.view(bool)
+        hands_left = ~im_arms[0] & ((flags & LEFT_ARM) > 0)
+        hands_right = ~im_arms[1] & ((flags & RIGHT_ARM) > 0)
+        parser_mask_fixed |= hands_left | hands_right
+
+    parser_mask_fixed = cv2.erode(parser_mask_fixed.view(np.uint8), np.ones(
+        (5, 5), np.uint8), iterations=1).view(bool)
+
+    parser_mask_fixed |= parse_head
+    parse_mask = _dilate(parse_mask, 10, 5)
+    if upper:
+        neck_mask = _dilate((flags & NECK) > 0, 5, 1)
+        parse_mask |= neck_mask & ~parse_head
+        parse_mask |= _dilate(im_arms[0] | im_arms[1], 5, 4)
+
+    parse_mask = parser_mask_changeable & ~parse_mask
+
+    parse_mask_total = parse_mask | parser_mask_fixed
+    img = (~parse_mask_total).view(np.uint8) * np.uint8(255)
+    dst = hole_fill(img)
     dst = refine_mask(dst)
-    inpaint_mask = dst / 255 * 1
-    mask = Image.fromarray(inpaint_mask.astype(np.uint8) * 255)
+    mask = Image.fromarray(dst)
 
     return mask
 
@@ -240,144 +252,94 @@ def get_agnostic_mask_dc(model_parse, keypoint, category, size=(384, 512)):
     pose_data = np.array(pose_data)
     pose_data = pose_data.reshape((-1, 2))
 
-    parse_shape = (parse_array > 0).astype(np.float32)
-
-    parse_head = (parse_array == 1).astype(np.float32) + \
-        (parse_array == 2).astype(np.float32) + \
-        (parse_array == 3).astype(np.float32) + \
-        (parse_array == 11).astype(np.float32) + \
-        (parse_array == 18).astype(np.float32)
-
-    parser_mask_fixed = (parse_array == label_map["hair"]).astype(np.float32) + \
-                        (parse_array == label_map["left_shoe"]).astype(np.float32) + \
-                        (parse_array == label_map["right_shoe"]).astype(np.float32) + \
-                        (parse_array == label_map["hat"]).astype(np.float32) + \
-                        (parse_array == label_map["sunglasses"]).astype(np.float32) + \
-                        (parse_array == label_map["scarf"]).astype(np.float32) + \
-                        (parse_array == label_map["bag"]).astype(np.float32)
-
-    parser_mask_changeable = (
-        parse_array == label_map["background"]).astype(np.float32)
-
-    arms = (parse_array == 14).astype(np.float32) + \
-        (parse_array == 15).astype(np.float32)
-
-    if category == 'dresses':
-        label_cat = 7
-        parse_mask = (parse_array == 7).astype(np.float32) + \
-            (parse_array == 12).astype(np.float32) + \
-            (parse_array == 13).astype(np.float32)
-        parser_mask_changeable += np.logical_and(
-            parse_array, np.logical_not(parser_mask_fixed))
-
-    elif category == 'upper_body':
-        label_cat = 4
-        parse_mask = (parse_array == 4).astype(np.float32)
-
-        parser_mask_fixed += (parse_array == label_map["skirt"]).astype(np.float32) + \
-            (parse_array == label_map["pants"]).astype(np.float32)
-
-        parser_mask_changeable += np.logical_and(
-            parse_array, np.logical_not(parser_mask_fixed))
-    elif category == 'lower_body':
-        label_cat = 6
-        parse_mask = (parse_array == 6).astype(np.float32) + \
-            (parse_array == 12).astype(np.float32) + \
-            (parse_array == 13).astype(np.float32)
-
-        parser_mask_fixed += (parse_array == label_map["upper_clothes"]).astype(np.float32) + \
-            (parse_array == 14).astype(np.float32) + \
-            (parse_array == 15).astype(np.float32)
-        parser_mask_changeable += np.logical_and(
-            parse_array, np.logical_not(parser_mask_fixed))
-
-    parse_head = torch.from_numpy(parse_head)  # [0,1]
-    parse_mask = torch.from_numpy(parse_mask)  # [0,1]
-    parser_mask_fixed = torch.from_numpy(parser_mask_fixed)
-    parser_mask_changeable = torch.from_numpy(parser_mask_changeable)
-
-    # dilation
-    parse_without_cloth = np.logical_and(
-        parse_shape, np.logical_not(parse_mask))
-    parse_mask = parse_mask.cpu().numpy()
+    flags = parse_flags(parse_array, category, "dc")
+    parse_head = (flags & HEAD) > 0
+    parser_mask_fixed = (flags & FIXED) > 0
+    parser_mask_changeable = ~parser_mask_fixed
+    parse_mask = (flags & CLOTH) > 0
+    arms = (flags & (LEFT_ARM | RIGHT_ARM)) > 0
 
     width = size[0]
     height = size[1]
 
-    im_arms = Image.new('L', (width, height))
-    arms_draw = ImageDraw.Draw(im_arms)
-    if category == 'dresses' or category == 'upper_body':
-        shoulder_right = tuple(np.multiply(pose_data[2, :2], height / 512.0))
-        shoulder_left = tuple(np.multiply(pose_data[5, :2], height / 512.0))
-        elbow_right = tuple(np.multiply(pose_data[3, :2], height / 512.0))
-        elbow_left = tuple(np.multiply(pose_data[6, :2], height / 512.0))
-        wrist_right = tuple(np.multiply(pose_data[4, :2], height / 512.0))
-        wrist_left = tuple(np.multiply(pose_data[7, :2], height / 512.0))
+    upper = category == 'dresses' or category == 'upper_body'
+    if upper:
+        shoulder_right, elbow_right, wrist_right, shoulder_left, elbow_left, wrist_left = \
+            pose_data[2:8, :2] * (height / 512.0)
         if wrist_right[0] <= 1. and wrist_right[1] <= 1.:
             if elbow_right[0] <= 1. and elbow_right[1] <= 1.:
-                arms_draw.line(
-                    [wrist_left, elbow_left, shoulder_left, shoulder_right], 'white', 30, 'curve')
+                line = [wrist_left, elbow_left, shoulder_left, shoulder_right]
             else:
-                arms_draw.line([wrist_left, elbow_left, shoulder_left, shoulder_right, elbow_right], 'white', 30,
-                               'curve')
+                line = [wrist_left, elbow_left, shoulder_left, shoulder_right, elbow_right]
         elif wrist_left[0] <= 1. and wrist_left[1] <= 1.:
             if elbow_left[0] <= 1. and elbow_left[1] <= 1.:
-                arms_draw.line([shoulder_left, shoulder_right,
-                               elbow_right, wrist_right], 'white', 30, 'curve')
+                line = [shoulder_left, shoulder_right, elbow_right, wrist_right]
             else:
-                arms_draw.line([elbow_left, shoulder_left, shoulder_right, elbow_right, wrist_right], 'white', 30,
-                               'curve')
+                line = [elbow_left, shoulder_left, shoulder_right, elbow_right, wrist_right]
         else:
-            arms_draw.line([wrist_left, elbow_left, shoulder_left, shoulder_right, elbow_right, wrist_right], 'white',
-                           30, 'curve')
+            line = [wrist_left, elbow_left, shoulder_left, shoulder_right, elbow_right, wrist_right]
+        im_arms = draw_thick_polyline(np.zeros((height, width), dtype=np.uint8), line, 30).view(bool)
 
         if height > 512:
-            im_arms = cv2.dilate(np.float32(im_arms), np.ones(
-                (10, 10), np.uint16), iterations=5)
+            im_arms = _dilate(im_arms, 10, 5)
         elif height > 256:
-            im_arms = cv2.dilate(np.float32(im_arms), np.ones(
-                (5, 5), np.uint16), iterations=5)
-        hands = np.logical_and(np.logical_not(im_arms), arms)
-        parse_mask += im_arms
-        parser_mask_fixed += hands
-
-    # delete neck
-    parse_head_2 = torch.clone(parse_head)
-    if category == 'dresses' or category == 'upper_body':
-        points = []
-        points.append(np.multiply(pose_data[2, :2], height / 512.0))
-        points.append(np.multiply(pose_data[5, :2], height / 512.0))
-        x_coords, y_coords = zip(*points)
-        A = np.vstack([x_coords, np.ones(len(x_coords))]).T
-        m, c = lstsq(A, y_coords, rcond=None)[0]
-        for i in range(parse_array.shape[1]):
-            y = i * m + c
-            parse_head_2[int(y - 20 * (height / 512.0)):, i] = 0
-
-    parser_mask_fixed = np.logical_or(
-        parser_mask_fixed, np.array(parse_head_2, dtype=np.uint16))
-    parse_mask += np.logical_or(parse_mask, np.logical_and(np.array(parse_head, dtype=np.uint16),
-                                                           np.logical_not(np.array(parse_head_2, dtype=np.uint16))))
+            im_arms = _dilate(im_arms, 5, 5)
+        hands = ~im_arms & arms
+        parse_mask |= im_arms
+        parser_mask_fixed |= hands
+
+    # delete neck: keep the head above a line 20px (at 512) over the shoulders
+    parse_head_2 = parse_head.copy()
+    if upper:
+        points = pose_data[[2, 5], :2] * (height / 512.0)
+        A = np.vstack([points[:, 0], np.ones(len(points))]).T
+        m, c = lstsq(A, points[:, 1], rcond=None)[0]
+        y = np.arange(parse_array.shape[1]) * m + c - 20 * (height / 512.0)
+        if not np.all(np.isfinite(y)):
+            raise ValueError("shoulder keypoints do not define a line")
+        rows = parse_array.shape[0]
+        # int() truncation and negative start indices, as slicing `[int(y):, i]` treats them
+        start = np.clip(y, -rows - 1, rows + 1).astype(np.int64)
+        start = np.where(start < 0, np.maximum(start + rows, 0), start)
+        parse_head_2 &= np.arange(rows)[:, None] < start[None, :]
+
+    parser_mask_fixed |= parse_head_2
+    parse_mask |= parse_head & ~parse_head_2
 
     if height > 512:
-        parse_mask = cv2.dilate(parse_mask, np.ones(
-            (20, 20), np.uint16), iterations=5)
+        parse_mask = _dilate(parse_mask, 20, 5)
     elif height > 256:
-        parse_mask = cv2.dilate(parse_mask, np.ones(
-            (10, 10), np.uint16), iterations=5)
+        parse_mask = _dilate(parse_mask, 10, 5)
     else:
-        parse_mask = cv2.dilate(parse_mask, np.ones(
-            (5, 5), np.uint16), iterations=5)
-    parse_mask = np.logical_and(
-        parser_mask_changeable, np.logical_not(parse_mask))
-    parse_mask_total = np.logical_or(parse_mask, parser_mask_fixed)
-    inpaint_mask = 1 - parse_mask_total
-    img = np.where(inpaint_mask, 255, 0)
-    img = hole_fill(img.astype(np.uint8))
-    inpaint_mask = img / 255 * 1
-    mask = Image.fromarray(inpaint_mask.astype(np.uint8) * 255)
+        parse_mask = _dilate(parse_mask, 5, 5)
+    parse_mask = parser_mask_changeable & ~parse_mask
+    parse_mask_total = parse_mask | parser_mask_fixed
+    img = (~parse_mask_total).view(np.uint8) * np.uint8(255)
+    img = hole_fill(img)
+    mask = Image.fromarray(img)
     return mask
 
+
+def get_agnostic_masks(model_parses, keypoints, category, size=(384, 512), method="hd",
+                       num_workers=None, **kwargs):
+    """
+    Agnostic masks of many (parse, keypoint) pairs with `get_agnostic_mask_hd` (`method="hd"`)
+    or `get_agnostic_mask_dc` (`method="dc"`), on `num_workers` threads (default: the per-worker
+    share of the `leffa.runtime` thread budget). OpenCV releases the GIL, so masks are built in
+    parallel. Returns the masks in input order.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from leffa.runtime import budget
+
+    mask_fn = {"hd": get_agnostic_mask_hd, "dc": get_agnostic_mask_dc}[method]
+    num_workers = num_workers or budget().threads_per_worker
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        return list(pool.map(
+            lambda pair: mask_fn(pair[0], pair[1], category, size, **kwargs),
+            zip(model_parses, keypoints),
+        ))
+
 def preprocess_garment_image(input_path, output_path=None, save_image=False):
     """
     Preprocess a garment image by cropping to a centered square,
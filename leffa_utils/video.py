@@ -0,0 +1,293 @@
+"""
+Video try-on: one garment over every frame of a person video, used by `video_tryon.py`.
+
+Frames are read, rendered and written one at a time, so memory does not grow with the clip
+length. `VideoMasks` tracks the person across keyframes with detectron2's `BBoxIOUTracker` over
+the DensePose detections and runs DensePose (and human parsing for agnostic masks) on keyframes
+only; in between, the mask and DensePose image are carried along with dense optical flow.
+`VideoTryOn` encodes the garment and computes its reference features once for the whole clip
+(as `ref_acceleration` does for one image), and starts every frame after the first from the
+previous result warped to it, noised to `strength` of the schedule, so that frame runs only
+that fraction of the denoising steps.
+"""
+from typing import Iterable, Iterator, Optional
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+from detectron2.structures import Instances
+from detectron2.tracking.bbox_iou_tracker import BBoxIOUTracker
+from PIL import Image
+
+from leffa.transform import LeffaTransform
+from leffa_utils.densepose_predictor import DensePosePredictor
+from leffa_utils.utils import get_agnostic_mask_hd, resize_and_center
+
+
+def video_fps(path, default=25.0):
+    capture = cv2.VideoCapture(path)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    capture.release()
+    return fps if fps and fps > 0 else default
+
+
+def read_frames(path) -> Iterator[Image.Image]:
+    """Decode the frames of a video file one by one, as RGB images."""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise OSError("Cannot open video {}".format(path))
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            yield Image.fromarray(frame[:, :, ::-1])
+    finally:
+        capture.release()
+
+
+class FrameWriter:
+    """Encodes RGB images into a video file as they come; the size is taken from the first."""
+
+    def __init__(self, path, fps, fourcc="mp4v"):
+        self.path = path
+        self.fps = fps
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.writer = None
+
+    def write(self, image):
+        frame = np.ascontiguousarray(np.array(image.convert("RGB"))[:, :, ::-1])
+        if self.writer is None:
+            height, width = frame.shape[:2]
+            self.writer = cv2.VideoWriter(self.path, self.fourcc, self.fps, (width, height))
+        self.writer.write(frame)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class OpticalFlow:
+    """
+    Dense optical flow (OpenCV DIS) from a frame back to the previous one, computed at `scale`
+    of the frame size: `frame(x) ~ previous(x + flow(x))`.
+    """
+
+    def __init__(self, scale=0.5):
+        self.scale = scale
+        self.dis = cv2.DISOpticalFlow_create(cv2.DISOPTICAL_FLOW_PRESET_FAST)
+
+    def _gray(self, image):
+        image = cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+    def __call__(self, frame, previous):
+        """[H, W, 2] float32 flow in pixels for RGB uint8 frames of size [H, W]."""
+        height, width = frame.shape[:2]
+        flow = self.dis.calc(self._gray(frame), self._gray(previous), None)
+        return cv2.resize(flow, (width, height), interpolation=cv2.INTER_LINEAR) / self.scale
+
+
+def warp(image, flow, interpolation=cv2.INTER_NEAREST):
+    """Carry `image` of the previous frame over to the current one along `flow`."""
+    height, width = flow.shape[:2]
+    map_x = flow[..., 0] + np.arange(width, dtype=np.float32)[None]
+    map_y = flow[..., 1] + np.arange(height, dtype=np.float32)[:, None]
+    return cv2.remap(image, map_x, map_y, interpolation, borderMode=cv2.BORDER_REPLICATE)
+
+
+def warp_latent(latent, flow):
+    """`warp` for a [N, C, h, w] latent, with `flow` at image resolution."""
+    height, width = latent.shape[-2:]
+    scale = np.float32([width / flow.shape[1], height / flow.shape[0]])
+    flow = cv2.resize(flow, (width, height), interpolation=cv2.INTER_AREA) * scale
+    grid_x = (np.arange(width, dtype=np.float32)[None] + 0.5 + flow[..., 0]) / width * 2 - 1
+    grid_y = (np.arange(height, dtype=np.float32)[:, None] + 0.5 + flow[..., 1]) / height * 2 - 1
+    grid = torch.from_numpy(np.stack([grid_x, grid_y], axis=-1)[None])
+    grid = grid.to(device=latent.device, dtype=latent.dtype).expand(latent.shape[0], -1, -1, -1)
+    return F.grid_sample(latent, grid, mode="bilinear", padding_mode="border", align_corners=False)
+
+
+class PersonTrack:
+    """
+    The person to dress, followed across keyframes by IoU tracking of the DensePose detections.
+    The top-scoring detection of the first keyframe is followed; when it is lost, the top-scoring
+    detection of that keyframe is followed from then on.
+    """
+
+    def __init__(self, height, width, iou_threshold=0.3):
+        self.tracker = BBoxIOUTracker(
+            video_height=height, video_width=width, track_iou_threshold=iou_threshold)
+        self.id = None
+
+    def update(self, instances: Instances) -> Optional[int]:
+        """Index of the followed person in `instances` (sorted by score), None if there is none."""
+        detections = Instances(
+            instances.image_size,
+            pred_boxes=instances.pred_boxes.to("cpu"),
+            scores=instances.scores.cpu(),
+            pred_classes=instances.pred_classes.cpu(),
+        )
+        ids = list(self.tracker.update(detections).ID[:len(instances)])
+        if self.id in ids:
+            return ids.index(self.id)
+        if not ids:
+            return None
+        self.id = ids[0]
+        return 0
+
+
+class VideoMasks:
+    """
+    Inpainting mask and DensePose image of each frame (RGB uint8, already at model size).
+
+    Keyframes, every `keyframe_interval` frames and whenever no person was found on the last one,
+    run `densepose` on the whole frame and follow the person with `PersonTrack`. The mask is then
+    the garment-agnostic mask from `parsing` and `openpose` limited to the person's box, or the
+    box itself without them. Other frames warp the previous frame's mask and DensePose image
+    along the optical flow.
+
+    :param densepose: multi-person `DensePosePredictor`, the tracker needs every detection.
+    :param box_margin: the person's box is grown by this fraction of its size on every side.
+    """
+
+    def __init__(
+        self,
+        densepose: DensePosePredictor,
+        parsing=None,
+        openpose=None,
+        garment_type="upper_body",
+        keyframe_interval=8,
+        box_margin=0.1,
+        flow_scale=0.5,
+    ):
+        self.densepose = densepose
+        self.parsing = parsing
+        self.openpose = openpose
+        self.garment_type = garment_type
+        self.keyframe_interval = keyframe_interval
+        self.box_margin = box_margin
+        self.flow = OpticalFlow(flow_scale)
+        self.track = None
+        self.index = 0
+        self.previous = None  # (frame, mask, densepose, person found)
+
+    def keyframe(self, frame):
+        height, width = frame.shape[:2]
+        if self.track is None:
+            self.track = PersonTrack(height, width)
+        image = np.ascontiguousarray(frame[:, :, ::-1])
+        with torch.no_grad():
+            instances = self.densepose.predictor(image)["instances"]
+        index = self.track.update(instances)
+        if index is None:
+            return np.zeros((height, width), np.uint8), np.zeros_like(frame), False
+
+        densepose = DensePosePredictor.seg_image(image, instances, index)[:, :, ::-1]
+        x1, y1, x2, y2 = instances.pred_boxes.tensor[index].tolist()
+        dx, dy = (x2 - x1) * self.box_margin, (y2 - y1) * self.box_margin
+        box = np.zeros((height, width), np.uint8)
+        box[max(int(y1 - dy), 0):int(y2 + dy) + 1, max(int(x1 - dx), 0):int(x2 + dx) + 1] = 255
+        if self.parsing is None:
+            return box, np.ascontiguousarray(densepose), True
+
+        small = Image.fromarray(frame).resize((384, 512))
+        model_parse, _ = self.parsing(small)
+        keypoints = self.openpose(small)
+        mask = get_agnostic_mask_hd(model_parse, keypoints, self.garment_type)
+        mask = np.array(mask.convert("L").resize((width, height), Image.NEAREST))
+        return np.minimum(mask, box), np.ascontiguousarray(densepose), True
+
+    def __call__(self, frame):
+        """(mask [H, W], DensePose [H, W, 3], flow to the previous frame or None) of `frame`."""
+        flow = None if self.previous is None else self.flow(frame, self.previous[0])
+        if (
+            self.previous is None
+            or self.index % self.keyframe_interval == 0
+            or not self.previous[3]
+        ):
+            mask, densepose, found = self.keyframe(frame)
+        else:
+            _, mask, densepose, found = self.previous
+            mask, densepose = warp(mask, flow), warp(densepose, flow)
+        self.previous = (frame, mask, densepose, found)
+        self.index += 1
+        return mask, densepose, flow
+
+
+class VideoTryOn:
+    """
+    Renders a garment over a stream of frames with `LeffaInference`'s pipeline.
+
+    The first frame runs `num_inference_steps` from noise; later frames start from the previous
+    result warped along the optical flow and run `strength` of them. Every frame draws the same
+    initial noise (`seed`), which keeps the texture from flickering.
+    """
+
+    def __init__(
+        self,
+        inference,
+        masks: VideoMasks,
+        height=1024,
+        width=768,
+        num_inference_steps=30,
+        strength=0.5,
+        guidance_scale=2.5,
+        seed=42,
+        repaint=False,
+    ):
+        if not 0 < strength <= 1:
+            raise ValueError("strength should be in (0, 1], but got {}".format(strength))
+        self.inference = inference
+        self.masks = masks
+        self.height = height
+        self.width = width
+        self.num_inference_steps = num_inference_steps
+        self.strength = strength
+        self.guidance_scale = guidance_scale
+        self.seed = seed
+        self.repaint = repaint
+        self.transform = LeffaTransform(height=height, width=width)
+
+    def __call__(self, frames: Iterable[Image.Image], garment: Image.Image):
+        """Yield the generated image of each frame, at the model's size."""
+        pipe = self.inference.pipe
+        garment = resize_and_center(garment, self.width, self.height)
+        reference = features = latent = None
+        for frame in frames:
+            person = resize_and_center(frame, self.width, self.height)
+            mask, densepose, flow = self.masks(np.array(person))
+            data = self.transform(
+                {"src_image": [person], "ref_image": [garment], "mask": [Image.fromarray(mask)],
+                 "densepose": [Image.fromarray(densepose)]}
+            )
+            data = self.inference.to_gpu(data)
+            generator = torch.Generator(pipe.device).manual_seed(self.seed)
+            devices = [torch.device(pipe.device)] if torch.device(pipe.device).type == "cuda" else []
+            with self.inference.autocast(), torch.random.fork_rng(devices):
+                torch.manual_seed(self.seed)
+                state = pipe.prepare(
+                    data["src_image"],
+                    data["ref_image"],
+                    data["mask"],
+                    data["densepose"],
+                    num_inference_steps=self.num_inference_steps,
+                    guidance_scale=self.guidance_scale,
+                    reference=reference,
+                    init_latent=None if latent is None else warp_latent(latent, flow),
+                    strength=self.strength,
+                )
+                if features is None:
+                    reference = state
+                    features = next(pipe.reference_features(state, ref_acceleration=True))
+                latent = pipe.denoise(state, [features], ref_acceleration=True,
+                                      generator=generator)
+                image = pipe.finish(state, latent, repaint=self.repaint)[0]
+            yield image
@@ -0,0 +1,94 @@
+"""
+Pre-converted DensePose and SCHP weights.
+
+The DensePose checkpoint is a pickle that detectron2 unpickles and matches to the model's
+parameter names on every start, and SCHP checkpoints are training checkpoints whose keys are
+renamed on every load. This writes the model-ready state dicts once, as `.safetensors` files next
+to the originals; `resolve_weights` picks them up wherever the original checkpoint is loaded.
+
+    python -m leffa_utils.weight_cache --densepose ./ckpts/densepose --schp ./ckpts/schp
+"""
+import argparse
+import os
+
+import torch
+from safetensors.torch import save_file
+
+DENSEPOSE_CONFIG = "densepose_rcnn_R_50_FPN_s1x.yaml"
+DENSEPOSE_WEIGHTS = "model_final_162be9.pkl"
+SCHP_CHECKPOINTS = ("exp-schp-201908301523-atr.pth", "exp-schp-201908261155-lip.pth")
+
+
+def cached_weights_path(path):
+    return os.path.splitext(path)[0] + ".safetensors"
+
+
+def resolve_weights(path):
+    """
+    The converted weights of checkpoint `path` if they exist and are not older than it, else
+    `path` itself.
+    """
+    if not path:
+        return path
+    cached = cached_weights_path(path)
+    if cached == path or not os.path.isfile(cached):
+        return path
+    if os.path.isfile(path) and os.path.getmtime(cached) < os.path.getmtime(path):
+        return path
+    return cached
+
+
+def save_state_dict(state_dict, path, source=None):
+    """Write `state_dict` to `path` as safetensors, atomically."""
+    tensors = {name: tensor.detach().cpu().contiguous() for name, tensor in state_dict.items()}
+    metadata = {"source": os.path.basename(source)} if source else None
+    tmp_path = path + ".tmp"
+    save_file(tensors, tmp_path, metadata=metadata)
+    os.replace(tmp_path, path)
+    return path
+
+
+def convert_densepose(config_path, weights_path):
+    """Load the DensePose checkpoint into its model once and save the resulting state dict."""
+    from densepose import add_densepose_config
+    from detectron2.checkpoint import DetectionCheckpointer
+    from detectron2.config import get_cfg
+    from detectron2.modeling import build_model
+
+    cfg = get_cfg()
+    add_densepose_config(cfg)
+    cfg.merge_from_file(config_path)
+    cfg.MODEL.DEVICE = "cpu"
+    model = build_model(cfg)
+    DetectionCheckpointer(model).load(weights_path)
+    return save_state_dict(
+        model.state_dict(), cached_weights_path(weights_path), source=weights_path)
+
+
+def convert_schp(ckpt_path):
+    """Save the renamed state dict of an SCHP training checkpoint."""
+    from SCHP import SCHP  # type: ignore
+
+    return save_state_dict(
+        SCHP.state_dict_from_ckpt(ckpt_path), cached_weights_path(ckpt_path), source=ckpt_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--densepose", default="./ckpts/densepose",
+                        help="directory with the DensePose config and checkpoint")
+    parser.add_argument("--schp", default="./ckpts/schp", help="directory with the SCHP checkpoints")
+    args = parser.parse_args()
+
+    with torch.no_grad():
+        path = convert_densepose(
+            os.path.join(args.densepose, DENSEPOSE_CONFIG),
+            os.path.join(args.densepose, DENSEPOSE_WEIGHTS),
+        )
+    print("Converted", path)
+    for checkpoint in SCHP_CHECKPOINTS:
+        print("Converted", convert_schp(os.path.join(args.schp, checkpoint)))
+
+
+if __name__ == "__main__":
+    main()
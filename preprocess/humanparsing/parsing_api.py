@@ -9,10 +9,8 @@ import torch
 import numpy as np
 import cv2
 import torchvision.transforms as transforms
-from torch.utils.data import DataLoader
-from datasets.simple_extractor_dataset import SimpleFolderDataset
-from utils.transforms import transform_logits
-from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+from utils.transforms import get_affine_transform, transform_logits
 from PIL import Image
 
 
@@ -118,62 +116,85 @@ def refine_hole(parsing_result_filled, parsing_result, arm_mask):
             cv2.drawContours(refine_hole_mask, contours, i, color=255, thickness=-1)
     return refine_hole_mask + arm_mask
 
-def onnx_inference(session, lip_session, input_dir):
-    transform = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.406, 0.456, 0.485], std=[0.225, 0.224, 0.229])
-    ])
-    dataset = SimpleFolderDataset(root=input_dir, input_size=[512, 512], transform=transform)
-    dataloader = DataLoader(dataset)
+ATR_INPUT_SIZE = [512, 512]
+LIP_INPUT_SIZE = [473, 473]
+TRANSFORM = transforms.Compose([
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.406, 0.456, 0.485], std=[0.225, 0.224, 0.229])
+])
+
+
+def list_inputs(input_dir):
+    """Images to parse, as SimpleFolderDataset lists them: an image, a file or a folder."""
+    if isinstance(input_dir, (Image.Image, np.ndarray)):
+        return [input_dir]
+    if os.path.isfile(input_dir):
+        return [input_dir]
+    return [os.path.join(input_dir, name) for name in os.listdir(input_dir)]
+
+
+def load_image(item):
+    """BGR uint8 array of a PIL image, an image file or a BGR array (used as is)."""
+    if isinstance(item, np.ndarray):
+        return item
+    if isinstance(item, Image.Image):
+        return np.asarray(item)[:, :, [2, 1, 0]]
+    return cv2.imread(item, cv2.IMREAD_COLOR)
+
+
+def crop_input(img, input_size):
+    """Network input and meta for `img`, as SimpleFolderDataset.__getitem__ computes them."""
+    h, w, _ = img.shape
+    aspect_ratio = input_size[1] * 1.0 / input_size[0]
+    center = np.array([(w - 1) * 0.5, (h - 1) * 0.5], dtype=np.float32)
+    box_w, box_h = w - 1, h - 1
+    if box_w > aspect_ratio * box_h:
+        box_h = box_w * 1.0 / aspect_ratio
+    elif box_w < aspect_ratio * box_h:
+        box_w = box_h * aspect_ratio
+    scale = np.array([box_w, box_h], dtype=np.float32)
+    trans = get_affine_transform(center, scale, 0, np.asarray(input_size))
+    input = cv2.warpAffine(img, trans, (int(input_size[1]), int(input_size[0])),
+                           flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT,
+                           borderValue=(0, 0, 0))
+    input = TRANSFORM(input).unsqueeze(0).numpy()
+    return input, {'center': center, 'scale': scale, 'width': w, 'height': h}
+
+
+def run_logits(session, input, meta, input_size):
+    """Fusion logits of `session` on `input`, warped back to the image ([H, W, C])."""
+    output = session.run(None, {"input.1": input})
+    upsample = torch.nn.Upsample(size=input_size, mode='bilinear', align_corners=True)
     with torch.no_grad():
-        for _, batch in enumerate(tqdm(dataloader)):
-            image, meta = batch
-            c = meta['center'].numpy()[0]
-            s = meta['scale'].numpy()[0]
-            w = meta['width'].numpy()[0]
-            h = meta['height'].numpy()[0]
-            output = session.run(None, {"input.1": image.numpy().astype(np.float32)})
-            upsample = torch.nn.Upsample(size=[512, 512], mode='bilinear', align_corners=True)
-            upsample_output = upsample(torch.from_numpy(output[1][0]).unsqueeze(0))
-            upsample_output = upsample_output.squeeze()
-            upsample_output = upsample_output.permute(1, 2, 0)  # CHW -> HWC
-            logits_result = transform_logits(upsample_output.data.cpu().numpy(), c, s, w, h, input_size=[512, 512])
-            parsing_result = np.argmax(logits_result, axis=2)
-            parsing_result = np.pad(parsing_result, pad_width=1, mode='constant', constant_values=0)
-            # try holefilling the clothes part
-            arm_mask = (parsing_result == 14).astype(np.float32) \
-                       + (parsing_result == 15).astype(np.float32)
-            upper_cloth_mask = (parsing_result == 4).astype(np.float32) + arm_mask
-            img = np.where(upper_cloth_mask, 255, 0)
-            dst = hole_fill(img.astype(np.uint8))
-            parsing_result_filled = dst / 255 * 4
-            parsing_result_woarm = np.where(parsing_result_filled == 4, parsing_result_filled, parsing_result)
-            # add back arm and refined hole between arm and cloth
-            refine_hole_mask = refine_hole(parsing_result_filled.astype(np.uint8), parsing_result.astype(np.uint8),
-                                           arm_mask.astype(np.uint8))
-            parsing_result = np.where(refine_hole_mask, parsing_result, parsing_result_woarm)
-            # remove padding
-            parsing_result = parsing_result[1:-1, 1:-1]
-
-        dataset_lip = SimpleFolderDataset(root=input_dir, input_size=[473, 473], transform=transform)
-        dataloader_lip = DataLoader(dataset_lip)
-        with torch.no_grad():
-            for _, batch in enumerate(tqdm(dataloader_lip)):
-                image, meta = batch
-                c = meta['center'].numpy()[0]
-                s = meta['scale'].numpy()[0]
-                w = meta['width'].numpy()[0]
-                h = meta['height'].numpy()[0]
-
-                output_lip = lip_session.run(None, {"input.1": image.numpy().astype(np.float32)})
-                upsample = torch.nn.Upsample(size=[473, 473], mode='bilinear', align_corners=True)
-                upsample_output_lip = upsample(torch.from_numpy(output_lip[1][0]).unsqueeze(0))
-                upsample_output_lip = upsample_output_lip.squeeze()
-                upsample_output_lip = upsample_output_lip.permute(1, 2, 0)  # CHW -> HWC
-                logits_result_lip = transform_logits(upsample_output_lip.data.cpu().numpy(), c, s, w, h,
-                                                     input_size=[473, 473])
-                parsing_result_lip = np.argmax(logits_result_lip, axis=2)
-    # add neck parsing result
+        upsample_output = upsample(torch.from_numpy(output[1][0]).unsqueeze(0))
+    upsample_output = upsample_output.squeeze()
+    upsample_output = upsample_output.permute(1, 2, 0)  # CHW -> HWC
+    return transform_logits(upsample_output.numpy(), meta['center'], meta['scale'], meta['width'],
+                            meta['height'], input_size=input_size)
+
+
+def refine_atr(logits_result):
+    """ATR labels with the holes of the upper clothes filled, keeping arms and large holes."""
+    parsing_result = np.argmax(logits_result, axis=2)
+    parsing_result = np.pad(parsing_result, pad_width=1, mode='constant', constant_values=0)
+    # try holefilling the clothes part
+    arm_mask = (parsing_result == 14).astype(np.float32) \
+               + (parsing_result == 15).astype(np.float32)
+    upper_cloth_mask = (parsing_result == 4).astype(np.float32) + arm_mask
+    img = np.where(upper_cloth_mask, 255, 0)
+    dst = hole_fill(img.astype(np.uint8))
+    parsing_result_filled = dst / 255 * 4
+    parsing_result_woarm = np.where(parsing_result_filled == 4, parsing_result_filled, parsing_result)
+    # add back arm and refined hole between arm and cloth
+    refine_hole_mask = refine_hole(parsing_result_filled.astype(np.uint8), parsing_result.astype(np.uint8),
+                                   arm_mask.astype(np.uint8))
+    parsing_result = np.where(refine_hole_mask, parsing_result, parsing_result_woarm)
+    # remove padding
+    return parsing_result[1:-1, 1:-1]
+
+
+def fuse_neck(parsing_result, parsing_result_lip):
+    """Label 18 (neck) where ATR sees face but LIP does not; returns the image and face mask."""
     neck_mask = np.logical_and(np.logical_not((parsing_result_lip == 13).astype(np.float32)),
                                (parsing_result == 11).astype(np.float32))
     parsing_result = np.where(neck_mask, 18, parsing_result)
@@ -181,8 +202,39 @@ def onnx_inference(session, lip_session, input_dir):
     output_img = Image.fromarray(np.asarray(parsing_result, dtype=np.uint8))
     output_img.putpalette(palette)
     face_mask = torch.from_numpy((parsing_result == 11).astype(np.float32))
-
     return output_img, face_mask
 
 
+def parse_image(session, lip_session, img, executor):
+    """ATR and LIP crops of one decoded image, run concurrently, fused into the final parsing."""
+    atr_input, meta = crop_input(img, ATR_INPUT_SIZE)
+    lip_input, _ = crop_input(img, LIP_INPUT_SIZE)
+    lip_logits = executor.submit(run_logits, lip_session, lip_input, meta, LIP_INPUT_SIZE)
+    parsing_result = refine_atr(run_logits(session, atr_input, meta, ATR_INPUT_SIZE))
+    parsing_result_lip = np.argmax(lip_logits.result(), axis=2)
+    return fuse_neck(parsing_result, parsing_result_lip)
+
 
+def stream_onnx_inference(session, lip_session, input_dir):
+    """
+    Parse a PIL image, an image file or every image of a folder, yielding
+    (input, parsed_image, face_mask) per image in listing order. Each image is decoded once for
+    both models, the next one is decoded while the current one runs, and the ATR and LIP sessions
+    run concurrently.
+    """
+    items = list_inputs(input_dir)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        next_img = executor.submit(load_image, items[0]) if items else None
+        for index, item in enumerate(items):
+            img = next_img.result()
+            if index + 1 < len(items):
+                next_img = executor.submit(load_image, items[index + 1])
+            output_img, face_mask = parse_image(session, lip_session, img, executor)
+            yield item, output_img, face_mask
+
+
+def onnx_inference(session, lip_session, input_dir):
+    """Parsed image and face mask of a single image (the last one for a folder)."""
+    for _, output_img, face_mask in stream_onnx_inference(session, lip_session, input_dir):
+        pass
+    return output_img, face_mask
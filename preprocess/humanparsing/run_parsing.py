@@ -1,19 +1,16 @@
 from pathlib import Path
-import os
 import sys
 import onnxruntime as ort
 PROJECT_ROOT = Path(__file__).absolute().parents[0].absolute()
 sys.path.insert(0, str(PROJECT_ROOT))
-from parsing_api import onnx_inference
+from parsing_api import onnx_inference, stream_onnx_inference
+from leffa.runtime import onnx_session_options
 
 
 class Parsing:
     def __init__(self, atr_path, lip_path):
-        session_options = ort.SessionOptions()
-        session_options.inter_op_num_threads = os.cpu_count() // 2
-        session_options.intra_op_num_threads = os.cpu_count() // 2
-        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
-        session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        # threads from the shared budget instead of half the machine per session
+        session_options = onnx_session_options()
         self.session = ort.InferenceSession(atr_path,
                                             sess_options=session_options, providers=['CPUExecutionProvider'])
         self.lip_session = ort.InferenceSession(lip_path,
@@ -23,3 +20,7 @@ class Parsing:
         parsed_image, face_mask = onnx_inference(
             self.session, self.lip_session, input_image)
         return parsed_image, face_mask
+
+    def stream(self, input_dir):
+        """Yield (input, parsed_image, face_mask) for each image of a folder, decoding each once."""
+        return stream_onnx_inference(self.session, self.lip_session, input_dir)
@@ -42,8 +42,18 @@ def draw_pose(pose, H, W, draw_body=True, draw_hand=True, draw_face=True):
     return canvas
 
 
+def body_pose(candidate, subset, H, W, hands=None, faces=None):
+    """The pose dict of `OpenposeDetector`, with candidate coordinates normalized by the image size."""
+    if candidate.ndim == 2 and candidate.shape[1] == 4:
+        candidate = candidate[:, :2]
+        candidate[:, 0] /= float(W)
+        candidate[:, 1] /= float(H)
+    bodies = dict(candidate=candidate.tolist(), subset=subset.tolist())
+    return dict(bodies=bodies, hands=hands or [], faces=faces or [])
+
+
 class OpenposeDetector:
-    def __init__(self, body_modelpath):
+    def __init__(self, body_modelpath, fast=False):
         # body_modelpath = os.path.join(annotator_ckpts_path, "body_pose_model.pth")
         # hand_modelpath = os.path.join(annotator_ckpts_path, "hand_pose_model.pth")
         # face_modelpath = os.path.join(annotator_ckpts_path, "facenet.pth")
@@ -60,7 +70,7 @@ class OpenposeDetector:
         #     from basicsr.utils.download_util import load_file_from_url
         #     load_file_from_url(face_model_path, model_dir=annotator_ckpts_path)
 
-        self.body_estimation = Body(body_modelpath)
+        self.body_estimation = Body(body_modelpath, fast=fast)
         # self.hand_estimation = Hand(hand_modelpath)
         # self.face_estimation = Face(face_modelpath)
 
@@ -90,12 +100,7 @@ class OpenposeDetector:
                         peaks[:, 0] = np.where(peaks[:, 0] < 1e-6, -1, peaks[:, 0] + x) / float(W)
                         peaks[:, 1] = np.where(peaks[:, 1] < 1e-6, -1, peaks[:, 1] + y) / float(H)
                         faces.append(peaks.tolist())
-            if candidate.ndim == 2 and candidate.shape[1] == 4:
-                candidate = candidate[:, :2]
-                candidate[:, 0] /= float(W)
-                candidate[:, 1] /= float(H)
-            bodies = dict(candidate=candidate.tolist(), subset=subset.tolist())
-            pose = dict(bodies=bodies, hands=hands, faces=faces)
+            pose = body_pose(candidate, subset, H, W, hands=hands, faces=faces)
             if return_is_index:
                 return pose
             else:
@@ -18,7 +18,9 @@ from .model import bodypose_model
 
 
 class Body(object):
-    def __init__(self, model_path):
+    def __init__(self, model_path, fast=False):
+        # fast: decode at network-output stride instead of on image-size maps
+        self.fast = fast
         self.model = bodypose_model()
         if torch.cuda.is_available():
             self.model = self.model.cuda()
@@ -28,193 +30,355 @@ class Body(object):
 
 
     def __call__(self, oriImg):
+        return self.decode(oriImg.shape, *self.forward([oriImg])[0])
+
+    def prepare(self, oriImg, boxsize=368, stride=8, padValue=128):
+        """Resize to the single search scale and pad right/down to a multiple of `stride`."""
         # scale_search = [0.5, 1.0, 1.5, 2.0]
-        scale_search = [0.5]
-        boxsize = 368
-        stride = 8
-        padValue = 128
-        thre1 = 0.1
-        thre2 = 0.05
-        multiplier = [x * boxsize / oriImg.shape[0] for x in scale_search]
-        heatmap_avg = np.zeros((oriImg.shape[0], oriImg.shape[1], 19))
-        paf_avg = np.zeros((oriImg.shape[0], oriImg.shape[1], 38))
-
-        for m in range(len(multiplier)):
-            scale = multiplier[m]
-            imageToTest = util.smart_resize_k(oriImg, fx=scale, fy=scale)
-            imageToTest_padded, pad = util.padRightDownCorner(imageToTest, stride, padValue)
-            im = np.transpose(np.float32(imageToTest_padded[:, :, :, np.newaxis]), (3, 2, 0, 1)) / 256 - 0.5
-            im = np.ascontiguousarray(im)
-
-            data = torch.from_numpy(im).float()
-            if torch.cuda.is_available():
-                data = data.cuda()
-            # data = data.permute([2, 0, 1]).unsqueeze(0).float()
-            with torch.no_grad():
-                Mconv7_stage6_L1, Mconv7_stage6_L2 = self.model(data)
-
-            Mconv7_stage6_L1 = Mconv7_stage6_L1.cpu().numpy()
-            Mconv7_stage6_L2 = Mconv7_stage6_L2.cpu().numpy()
-
-            # extract outputs, resize, and remove padding
-            # heatmap = np.transpose(np.squeeze(net.blobs[output_blobs.keys()[1]].data), (1, 2, 0))  # output 1 is heatmaps
-            heatmap = np.transpose(np.squeeze(Mconv7_stage6_L2), (1, 2, 0))  # output 1 is heatmaps
-            heatmap = util.smart_resize_k(heatmap, fx=stride, fy=stride)
-            heatmap = heatmap[:imageToTest_padded.shape[0] - pad[2], :imageToTest_padded.shape[1] - pad[3], :]
-            heatmap = util.smart_resize(heatmap, (oriImg.shape[0], oriImg.shape[1]))
-
-            # paf = np.transpose(np.squeeze(net.blobs[output_blobs.keys()[0]].data), (1, 2, 0))  # output 0 is PAFs
-            paf = np.transpose(np.squeeze(Mconv7_stage6_L1), (1, 2, 0))  # output 0 is PAFs
-            paf = util.smart_resize_k(paf, fx=stride, fy=stride)
-            paf = paf[:imageToTest_padded.shape[0] - pad[2], :imageToTest_padded.shape[1] - pad[3], :]
-            paf = util.smart_resize(paf, (oriImg.shape[0], oriImg.shape[1]))
-
-            heatmap_avg += heatmap_avg + heatmap / len(multiplier)
-            paf_avg += + paf / len(multiplier)
-
-        all_peaks = []
-        peak_counter = 0
-
-        for part in range(18):
-            map_ori = heatmap_avg[:, :, part]
-            one_heatmap = gaussian_filter(map_ori, sigma=3)
-
-            map_left = np.zeros(one_heatmap.shape)
-            map_left[1:, :] = one_heatmap[:-1, :]
-            map_right = np.zeros(one_heatmap.shape)
-            map_right[:-1, :] = one_heatmap[1:, :]
-            map_up = np.zeros(one_heatmap.shape)
-            map_up[:, 1:] = one_heatmap[:, :-1]
-            map_down = np.zeros(one_heatmap.shape)
-            map_down[:, :-1] = one_heatmap[:, 1:]
-
-            peaks_binary = np.logical_and.reduce(
-                (one_heatmap >= map_left, one_heatmap >= map_right, one_heatmap >= map_up, one_heatmap >= map_down,
-                 one_heatmap > thre1))
-            peaks = list(zip(np.nonzero(peaks_binary)[1], np.nonzero(peaks_binary)[0]))  # note reverse
-            peaks_with_score = [x + (map_ori[x[1], x[0]],) for x in peaks]
-            peak_id = range(peak_counter, peak_counter + len(peaks))
-            peaks_with_score_and_id = [peaks_with_score[i] + (peak_id[i],) for i in range(len(peak_id))]
-
-            all_peaks.append(peaks_with_score_and_id)
-            peak_counter += len(peaks)
-
-        # find connection in the specified sequence, center 29 is in the position 15
-        limbSeq = [[2, 3], [2, 6], [3, 4], [4, 5], [6, 7], [7, 8], [2, 9], [9, 10], \
-                   [10, 11], [2, 12], [12, 13], [13, 14], [2, 1], [1, 15], [15, 17], \
-                   [1, 16], [16, 18], [3, 17], [6, 18]]
-        # the middle joints heatmap correpondence
-        mapIdx = [[31, 32], [39, 40], [33, 34], [35, 36], [41, 42], [43, 44], [19, 20], [21, 22], \
-                  [23, 24], [25, 26], [27, 28], [29, 30], [47, 48], [49, 50], [53, 54], [51, 52], \
-                  [55, 56], [37, 38], [45, 46]]
-
-        connection_all = []
-        special_k = []
-        mid_num = 10
-
-        for k in range(len(mapIdx)):
-            score_mid = paf_avg[:, :, [x - 19 for x in mapIdx[k]]]
-            candA = all_peaks[limbSeq[k][0] - 1]
-            candB = all_peaks[limbSeq[k][1] - 1]
-            nA = len(candA)
-            nB = len(candB)
-            indexA, indexB = limbSeq[k]
-            if (nA != 0 and nB != 0):
-                connection_candidate = []
-                for i in range(nA):
-                    for j in range(nB):
-                        vec = np.subtract(candB[j][:2], candA[i][:2])
-                        norm = math.sqrt(vec[0] * vec[0] + vec[1] * vec[1])
-                        norm = max(0.001, norm)
-                        vec = np.divide(vec, norm)
-
-                        startend = list(zip(np.linspace(candA[i][0], candB[j][0], num=mid_num), \
-                                            np.linspace(candA[i][1], candB[j][1], num=mid_num)))
-
-                        vec_x = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 0] \
-                                          for I in range(len(startend))])
-                        vec_y = np.array([score_mid[int(round(startend[I][1])), int(round(startend[I][0])), 1] \
-                                          for I in range(len(startend))])
-
-                        score_midpts = np.multiply(vec_x, vec[0]) + np.multiply(vec_y, vec[1])
-                        score_with_dist_prior = sum(score_midpts) / len(score_midpts) + min(
-                            0.5 * oriImg.shape[0] / norm - 1, 0)
-                        criterion1 = len(np.nonzero(score_midpts > thre2)[0]) > 0.8 * len(score_midpts)
-                        criterion2 = score_with_dist_prior > 0
-                        if criterion1 and criterion2:
-                            connection_candidate.append(
-                                [i, j, score_with_dist_prior, score_with_dist_prior + candA[i][2] + candB[j][2]])
-
-                connection_candidate = sorted(connection_candidate, key=lambda x: x[2], reverse=True)
-                connection = np.zeros((0, 5))
-                for c in range(len(connection_candidate)):
-                    i, j, s = connection_candidate[c][0:3]
-                    if (i not in connection[:, 3] and j not in connection[:, 4]):
-                        connection = np.vstack([connection, [candA[i][3], candB[j][3], s, i, j]])
-                        if (len(connection) >= min(nA, nB)):
-                            break
-
-                connection_all.append(connection)
-            else:
-                special_k.append(k)
-                connection_all.append([])
-
-        # last number in each row is the total parts number of that person
-        # the second last number in each row is the score of the overall configuration
-        subset = -1 * np.ones((0, 20))
-        candidate = np.array([item for sublist in all_peaks for item in sublist])
-
-        for k in range(len(mapIdx)):
-            if k not in special_k:
-                partAs = connection_all[k][:, 0]
-                partBs = connection_all[k][:, 1]
-                indexA, indexB = np.array(limbSeq[k]) - 1
-
-                for i in range(len(connection_all[k])):  # = 1:size(temp,1)
-                    found = 0
-                    subset_idx = [-1, -1]
-                    for j in range(len(subset)):  # 1:size(subset,1):
-                        if subset[j][indexA] == partAs[i] or subset[j][indexB] == partBs[i]:
-                            subset_idx[found] = j
-                            found += 1
-
-                    if found == 1:
-                        j = subset_idx[0]
-                        if subset[j][indexB] != partBs[i]:
-                            subset[j][indexB] = partBs[i]
-                            subset[j][-1] += 1
-                            subset[j][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
-                    elif found == 2:  # if found 2 and disjoint, merge them
-                        j1, j2 = subset_idx
-                        membership = ((subset[j1] >= 0).astype(int) + (subset[j2] >= 0).astype(int))[:-2]
-                        if len(np.nonzero(membership == 2)[0]) == 0:  # merge
-                            subset[j1][:-2] += (subset[j2][:-2] + 1)
-                            subset[j1][-2:] += subset[j2][-2:]
-                            subset[j1][-2] += connection_all[k][i][2]
-                            subset = np.delete(subset, j2, 0)
-                        else:  # as like found == 1
-                            subset[j1][indexB] = partBs[i]
-                            subset[j1][-1] += 1
-                            subset[j1][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
-
-                    # if find no partA in the subset, create a new subset
-                    elif not found and k < 17:
-                        row = -1 * np.ones(20)
-                        row[indexA] = partAs[i]
-                        row[indexB] = partBs[i]
-                        row[-1] = 2
-                        row[-2] = sum(candidate[connection_all[k][i, :2].astype(int), 2]) + connection_all[k][i][2]
-                        subset = np.vstack([subset, row])
-        # delete some rows of subset which has few parts occur
-        deleteIdx = []
-        for i in range(len(subset)):
-            if subset[i][-1] < 4 or subset[i][-2] / subset[i][-1] < 0.4:
-                deleteIdx.append(i)
-        subset = np.delete(subset, deleteIdx, axis=0)
-
-        # subset: n*20 array, 0-17 is the index in candidate, 18 is the total score, 19 is the total parts
-        # candidate: x, y, score, id
-        return candidate, subset
+        scale = 0.5 * boxsize / oriImg.shape[0]
+        imageToTest = util.smart_resize_k(oriImg, fx=scale, fy=scale)
+        return util.padRightDownCorner(imageToTest, stride, padValue)
+
+    def forward(self, images, stride=8, padValue=128):
+        """
+        Run the network once over a batch of BGR images. Prepared images are padded with
+        `padValue` to a shared size; returns per image (paf, heatmap, padded_shape, pad) with the
+        (C, h, w) outputs cropped to that image's own padded size.
+        """
+        prepared = [self.prepare(oriImg, stride=stride, padValue=padValue) for oriImg in images]
+        height = max(padded.shape[0] for padded, _ in prepared)
+        width = max(padded.shape[1] for padded, _ in prepared)
+        batch = np.full((len(prepared), height, width, 3), padValue, dtype=np.float32)
+        for i, (padded, _) in enumerate(prepared):
+            batch[i, :padded.shape[0], :padded.shape[1]] = padded
+        im = np.transpose(batch, (0, 3, 1, 2)) / 256 - 0.5
+        im = np.ascontiguousarray(im)
+
+        data = torch.from_numpy(im).float()
+        if torch.cuda.is_available():
+            data = data.cuda()
+        with torch.no_grad():
+            Mconv7_stage6_L1, Mconv7_stage6_L2 = self.model(data)
+        Mconv7_stage6_L1 = Mconv7_stage6_L1.cpu().numpy()
+        Mconv7_stage6_L2 = Mconv7_stage6_L2.cpu().numpy()
+
+        outputs = []
+        for i, (padded, pad) in enumerate(prepared):
+            rows, cols = padded.shape[0] // stride, padded.shape[1] // stride
+            outputs.append((
+                Mconv7_stage6_L1[i, :, :rows, :cols],
+                Mconv7_stage6_L2[i, :, :rows, :cols],
+                padded.shape,
+                pad,
+            ))
+        return outputs
+
+    def decode(self, image_shape, paf, heatmap, padded_shape, pad, stride=8):
+        """(candidate, subset) for one image from its `forward` outputs."""
+        if self.fast:
+            heatmap, paf, map_scale = lowres_maps(paf, heatmap, image_shape, padded_shape, pad, stride)
+            return decode_body_pose_lowres(heatmap, paf, map_scale, image_shape[0])
+        heatmap_avg, paf_avg = image_size_maps(paf, heatmap, image_shape, padded_shape, pad, stride)
+        return decode_body_pose(heatmap_avg, paf_avg, image_shape[0])
+
+    def predict_maps_lowres(self, oriImg, stride=8):
+        """
+        Run the network and return the heatmaps (h, w, 19) and PAFs (h, w, 38) at output stride
+        with the padding removed, plus the (x, y) size of one map cell in image pixels.
+        """
+        paf, heatmap, padded_shape, pad = self.forward([oriImg], stride=stride)[0]
+        return lowres_maps(paf, heatmap, oriImg.shape, padded_shape, pad, stride)
+
+    def predict_maps(self, oriImg, stride=8):
+        """Run the network and return the heatmaps (H, W, 19) and PAFs (H, W, 38) at image size."""
+        paf, heatmap, padded_shape, pad = self.forward([oriImg], stride=stride)[0]
+        return image_size_maps(paf, heatmap, oriImg.shape, padded_shape, pad, stride)
+
+
+def image_size_maps(paf, heatmap, image_shape, padded_shape, pad, stride=8):
+    """Upsample (C, h, w) network outputs by `stride`, remove the padding and resize to the image."""
+    # extract outputs, resize, and remove padding
+    heatmap = np.transpose(heatmap, (1, 2, 0))  # output 1 is heatmaps
+    heatmap = util.smart_resize_k(heatmap, fx=stride, fy=stride)
+    heatmap = heatmap[:padded_shape[0] - pad[2], :padded_shape[1] - pad[3], :]
+    heatmap = util.smart_resize(heatmap, (image_shape[0], image_shape[1]))
+
+    paf = np.transpose(paf, (1, 2, 0))  # output 0 is PAFs
+    paf = util.smart_resize_k(paf, fx=stride, fy=stride)
+    paf = paf[:padded_shape[0] - pad[2], :padded_shape[1] - pad[3], :]
+    paf = util.smart_resize(paf, (image_shape[0], image_shape[1]))
+
+    # a single search scale, accumulated in float64 as the multi-scale average was
+    return heatmap.astype(np.float64), paf.astype(np.float64)
+
+
+def lowres_maps(paf, heatmap, image_shape, padded_shape, pad, stride=8):
+    """Crop the padding off (C, h, w) network outputs at stride resolution; see `predict_maps_lowres`."""
+    resized_height = padded_shape[0] - pad[2]
+    resized_width = padded_shape[1] - pad[3]
+    rows = -(-resized_height // stride)
+    cols = -(-resized_width // stride)
+    heatmap = np.transpose(heatmap[:, :rows, :cols], (1, 2, 0))
+    paf = np.transpose(paf[:, :rows, :cols], (1, 2, 0))
+    map_scale = (
+        image_shape[1] * stride / resized_width,
+        image_shape[0] * stride / resized_height,
+    )
+    return heatmap, paf, map_scale
+
+
+# find connection in the specified sequence, center 29 is in the position 15
+LIMB_SEQ = [[2, 3], [2, 6], [3, 4], [4, 5], [6, 7], [7, 8], [2, 9], [9, 10], \
+            [10, 11], [2, 12], [12, 13], [13, 14], [2, 1], [1, 15], [15, 17], \
+            [1, 16], [16, 18], [3, 17], [6, 18]]
+# the middle joints heatmap correpondence
+MAP_IDX = [[31, 32], [39, 40], [33, 34], [35, 36], [41, 42], [43, 44], [19, 20], [21, 22], \
+           [23, 24], [25, 26], [27, 28], [29, 30], [47, 48], [49, 50], [53, 54], [51, 52], \
+           [55, 56], [37, 38], [45, 46]]
+
+
+def find_peaks(heatmap_avg, thre1=0.1):
+    """Per-part lists of (x, y, score, id) local maxima of the smoothed heatmaps."""
+    all_peaks = []
+    peak_counter = 0
+
+    for part in range(18):
+        map_ori = heatmap_avg[:, :, part]
+        one_heatmap = gaussian_filter(map_ori, sigma=3)
+
+        map_left = np.zeros(one_heatmap.shape)
+        map_left[1:, :] = one_heatmap[:-1, :]
+        map_right = np.zeros(one_heatmap.shape)
+        map_right[:-1, :] = one_heatmap[1:, :]
+        map_up = np.zeros(one_heatmap.shape)
+        map_up[:, 1:] = one_heatmap[:, :-1]
+        map_down = np.zeros(one_heatmap.shape)
+        map_down[:, :-1] = one_heatmap[:, 1:]
+
+        peaks_binary = np.logical_and.reduce(
+            (one_heatmap >= map_left, one_heatmap >= map_right, one_heatmap >= map_up, one_heatmap >= map_down,
+             one_heatmap > thre1))
+        peaks = list(zip(np.nonzero(peaks_binary)[1], np.nonzero(peaks_binary)[0]))  # note reverse
+        peaks_with_score = [x + (map_ori[x[1], x[0]],) for x in peaks]
+        peak_id = range(peak_counter, peak_counter + len(peaks))
+        peaks_with_score_and_id = [peaks_with_score[i] + (peak_id[i],) for i in range(len(peak_id))]
+
+        all_peaks.append(peaks_with_score_and_id)
+        peak_counter += len(peaks)
+    return all_peaks
+
+
+def score_limb_candidates(candA, candB, score_mid, image_height, thre2=0.05, mid_num=10, map_scale=None):
+    """
+    Score every (candA[i], candB[j]) pair of one limb by sampling its PAF at `mid_num` points.
+
+    `candA`/`candB` are (n, 4) arrays of (x, y, score, id). Returns the (i, j) indices and the
+    distance-penalized scores of the pairs passing both criteria, in row-major pair order. The
+    arithmetic mirrors the original per-pair loop, so scores are bit-identical. With `map_scale`
+    (image pixels per map cell) the PAF is a stride-resolution map and samples are rescaled.
+    """
+    nA, nB = len(candA), len(candB)
+    ai, bj = np.divmod(np.arange(nA * nB), nB)
+    start = candA[ai, :2]
+    end = candB[bj, :2]
+
+    vec = end - start
+    norm = np.sqrt(vec[:, 0] * vec[:, 0] + vec[:, 1] * vec[:, 1])
+    norm = np.maximum(0.001, norm)
+    vec = vec / norm[:, None]
+
+    # np.linspace(start, end, num=mid_num) per pair, endpoint pinned to `end`
+    steps = np.arange(mid_num, dtype=np.float64)
+    step = (end - start) / (mid_num - 1)
+    samples = steps[None, :, None] * step[:, None, :] + start[:, None, :]
+    samples[:, -1] = end
+
+    if map_scale is not None:
+        # image coordinates -> stride-resolution map cells, bilinearly sampled like the
+        # upsampled maps of the full-size path
+        samples = (samples + 0.5) / np.asarray(map_scale) - 0.5
+        samples = np.clip(samples, 0, [score_mid.shape[1] - 1, score_mid.shape[0] - 1])
+        x0 = np.minimum(samples[..., 0].astype(np.intp), score_mid.shape[1] - 2)
+        y0 = np.minimum(samples[..., 1].astype(np.intp), score_mid.shape[0] - 2)
+        wx = (samples[..., 0] - x0)[..., None]
+        wy = (samples[..., 1] - y0)[..., None]
+        sampled = (
+            score_mid[y0, x0] * (1 - wx) * (1 - wy) + score_mid[y0, x0 + 1] * wx * (1 - wy)
+            + score_mid[y0 + 1, x0] * (1 - wx) * wy + score_mid[y0 + 1, x0 + 1] * wx * wy
+        )
+        vec_x, vec_y = sampled[..., 0], sampled[..., 1]
+    else:
+        samples = np.rint(samples).astype(np.intp)
+        vec_x = score_mid[samples[..., 1], samples[..., 0], 0]
+        vec_y = score_mid[samples[..., 1], samples[..., 0], 1]
+    score_midpts = vec_x * vec[:, 0:1] + vec_y * vec[:, 1:2]
+
+    # left-to-right sum, as the builtin `sum` over the samples
+    total = np.zeros(len(score_midpts))
+    for I in range(mid_num):
+        total = total + score_midpts[:, I]
+    score_with_dist_prior = total / mid_num + np.minimum(0.5 * image_height / norm - 1, 0)
+
+    criterion1 = np.count_nonzero(score_midpts > thre2, axis=1) > 0.8 * mid_num
+    criterion2 = score_with_dist_prior > 0
+    valid = np.nonzero(criterion1 & criterion2)[0]
+    return ai[valid], bj[valid], score_with_dist_prior[valid]
+
+
+def connect_limbs(all_peaks, paf_avg, image_height, thre2=0.05, map_scale=None):
+    """Greedy one-to-one limb matching; returns per-limb (n, 5) connections and the limbs without candidates."""
+    connection_all = []
+    special_k = []
+
+    for k in range(len(MAP_IDX)):
+        score_mid = paf_avg[:, :, [x - 19 for x in MAP_IDX[k]]]
+        candA = all_peaks[LIMB_SEQ[k][0] - 1]
+        candB = all_peaks[LIMB_SEQ[k][1] - 1]
+        nA = len(candA)
+        nB = len(candB)
+        if (nA != 0 and nB != 0):
+            candA = np.array(candA, dtype=np.float64)
+            candB = np.array(candB, dtype=np.float64)
+            ai, bj, scores = score_limb_candidates(
+                candA, candB, score_mid, image_height, thre2, map_scale=map_scale)
+
+            # stable descending sort keeps equal scores in pair order, like `sorted(reverse=True)`
+            order = np.argsort(-scores, kind="stable")
+            usedA = np.zeros(nA, dtype=bool)
+            usedB = np.zeros(nB, dtype=bool)
+            connection = np.zeros((min(nA, nB), 5))
+            num_connections = 0
+            for c in order:
+                i, j = ai[c], bj[c]
+                if not usedA[i] and not usedB[j]:
+                    connection[num_connections] = [candA[i, 3], candB[j, 3], scores[c], i, j]
+                    num_connections += 1
+                    usedA[i] = usedB[j] = True
+                    if num_connections >= min(nA, nB):
+                        break
+
+            connection_all.append(connection[:num_connections])
+        else:
+            special_k.append(k)
+            connection_all.append([])
+    return connection_all, special_k
+
+
+def find_peaks_lowres(heatmap, map_scale, thre1=0.1):
+    """
+    `find_peaks` on stride-resolution heatmaps: 4-neighbour NMS per map cell, then a quadratic
+    fit over each peak's neighbours for a sub-cell offset, returned in image coordinates.
+    """
+    maps = np.ascontiguousarray(heatmap[:, :, :18].transpose(2, 0, 1))
+    # zero border for NMS, as `find_peaks`; replicated border for the sub-cell fit
+    padded = np.pad(maps, ((0, 0), (1, 1), (1, 1)))
+    center = padded[:, 1:-1, 1:-1]
+    peaks_binary = (
+        (center >= padded[:, :-2, 1:-1]) & (center >= padded[:, 2:, 1:-1])
+        & (center >= padded[:, 1:-1, :-2]) & (center >= padded[:, 1:-1, 2:])
+        & (center > thre1)
+    )
+    part, y, x = np.nonzero(peaks_binary)
+
+    edge = np.pad(maps, ((0, 0), (1, 1), (1, 1)), mode="edge")
+    c = edge[part, y + 1, x + 1]
+    offsets = []
+    for before, after in (
+        (edge[part, y + 1, x], edge[part, y + 1, x + 2]),
+        (edge[part, y, x + 1], edge[part, y + 2, x + 1]),
+    ):
+        curvature = before - 2 * c + after
+        offset = np.where(curvature < 0, 0.5 * (before - after) / np.where(curvature < 0, curvature, -1), 0)
+        offsets.append(np.clip(offset, -0.5, 0.5))
+    peak_x = (x + offsets[0] + 0.5) * map_scale[0] - 0.5
+    peak_y = (y + offsets[1] + 0.5) * map_scale[1] - 0.5
+
+    all_peaks = [[] for _ in range(18)]
+    for peak_id, (p, px, py, score) in enumerate(zip(part, peak_x, peak_y, c)):
+        all_peaks[p].append((px, py, score, peak_id))
+    return all_peaks
+
+
+def assemble_people(connection_all, special_k, candidate):
+    """Group limb connections into people; see `decode_body_pose` for the subset layout."""
+    num_connections = sum(len(connection) for connection in connection_all)
+    subset = -1 * np.ones((num_connections, 20))
+    num_people = 0
+
+    for k in range(len(MAP_IDX)):
+        if k not in special_k:
+            partAs = connection_all[k][:, 0]
+            partBs = connection_all[k][:, 1]
+            indexA, indexB = np.array(LIMB_SEQ[k]) - 1
+
+            for i in range(len(connection_all[k])):
+                people = subset[:num_people]
+                subset_idx = np.nonzero(
+                    (people[:, indexA] == partAs[i]) | (people[:, indexB] == partBs[i]))[0]
+                found = len(subset_idx)
+
+                if found == 1:
+                    j = subset_idx[0]
+                    if subset[j][indexB] != partBs[i]:
+                        subset[j][indexB] = partBs[i]
+                        subset[j][-1] += 1
+                        subset[j][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
+                elif found == 2:  # if found 2 and disjoint, merge them
+                    j1, j2 = subset_idx
+                    membership = ((subset[j1] >= 0).astype(int) + (subset[j2] >= 0).astype(int))[:-2]
+                    if len(np.nonzero(membership == 2)[0]) == 0:  # merge
+                        subset[j1][:-2] += (subset[j2][:-2] + 1)
+                        subset[j1][-2:] += subset[j2][-2:]
+                        subset[j1][-2] += connection_all[k][i][2]
+                        subset[j2:num_people - 1] = subset[j2 + 1:num_people]
+                        num_people -= 1
+                        subset[num_people] = -1
+                    else:  # as like found == 1
+                        subset[j1][indexB] = partBs[i]
+                        subset[j1][-1] += 1
+                        subset[j1][-2] += candidate[partBs[i].astype(int), 2] + connection_all[k][i][2]
+
+                # if find no partA in the subset, create a new subset
+                elif not found and k < 17:
+                    row = subset[num_people]
+                    row[indexA] = partAs[i]
+                    row[indexB] = partBs[i]
+                    row[-1] = 2
+                    row[-2] = candidate[int(partAs[i]), 2] + candidate[int(partBs[i]), 2] + connection_all[k][i][2]
+                    num_people += 1
+
+    # delete some rows of subset which has few parts occur
+    subset = subset[:num_people]
+    keep = ~((subset[:, -1] < 4) | (subset[:, -2] / subset[:, -1] < 0.4))
+    return subset[keep]
+
+
+def decode_body_pose(heatmap_avg, paf_avg, image_height, thre1=0.1, thre2=0.05):
+    """
+    Peaks, limb matching and person assembly from image-size heatmaps and PAFs.
+
+    Returns (candidate, subset). subset: n*20 array, 0-17 is the index in candidate, 18 is the
+    total score, 19 is the total parts. candidate: x, y, score, id.
+    """
+    all_peaks = find_peaks(heatmap_avg, thre1)
+    connection_all, special_k = connect_limbs(all_peaks, paf_avg, image_height, thre2)
+    candidate = np.array([item for sublist in all_peaks for item in sublist])
+    subset = assemble_people(connection_all, special_k, candidate)
+    return candidate, subset
+
+
+
+def decode_body_pose_lowres(heatmap, paf, map_scale, image_height, thre1=0.1, thre2=0.05):
+    """
+    `decode_body_pose` on the stride-resolution network outputs of `Body.predict_maps_lowres`;
+    `map_scale` is the (x, y) size of one map cell in image pixels. Keypoints are in image
+    coordinates with sub-cell precision.
+    """
+    all_peaks = find_peaks_lowres(heatmap, map_scale, thre1)
+    connection_all, special_k = connect_limbs(all_peaks, paf, image_height, thre2, map_scale)
+    candidate = np.array([item for sublist in all_peaks for item in sublist])
+    subset = assemble_people(connection_all, special_k, candidate)
+    return candidate, subset
 
 
 # if __name__ == "__main__":
@@ -10,10 +10,12 @@ import numpy as np
 import random
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 # from pytorch_lightning import seed_everything
 from preprocess.openpose.annotator.util import resize_image, HWC3
-from preprocess.openpose.annotator.openpose import OpenposeDetector
+from preprocess.openpose.annotator.openpose import OpenposeDetector, body_pose
+from leffa.runtime import budget
 
 from PIL import Image
 import torch
@@ -22,52 +24,96 @@ import pdb
 # os.environ['CUDA_VISIBLE_DEVICES'] = '0,1,2,3'
 
 class OpenPose:
-    def __init__(self, body_model_path):
-        self.preprocessor = OpenposeDetector(body_model_path)
+    def __init__(self, body_model_path, fast=False):
+        # fast: peak detection and PAF scoring at network-output stride (sub-pixel refined)
+        self.preprocessor = OpenposeDetector(body_model_path, fast=fast)
 
-    def __call__(self, input_image, resolution=384):
+    def load_image(self, input_image, resolution=384):
         if isinstance(input_image, Image.Image):
             input_image = np.asarray(input_image)
         elif type(input_image) == str:
             input_image = np.asarray(Image.open(input_image))
-        else:
+        elif not isinstance(input_image, np.ndarray):
             raise ValueError
-        with torch.no_grad():
-            input_image = HWC3(input_image)
+        input_image = HWC3(input_image)
+        if input_image.shape[:2] != (512, 384) or resolution != 384:
             input_image = resize_image(input_image, resolution)
-            H, W, C = input_image.shape
-            assert (H == 512 and W == 384), 'Incorrect input image shape'
-            pose, detected_map = self.preprocessor(input_image, hand_and_face=False)
-
-            candidate = pose['bodies']['candidate']
-            subset = pose['bodies']['subset'][0][:18]
-            for i in range(18):
-                if subset[i] == -1:
-                    candidate.insert(i, [0, 0])
-                    for j in range(i, 18):
-                        if(subset[j]) != -1:
-                            subset[j] += 1
-                elif subset[i] != i:
-                    candidate.pop(i)
-                    for j in range(i, 18):
-                        if(subset[j]) != -1:
-                            subset[j] -= 1
-
-            candidate = candidate[:18]
-
-            for i in range(18):
-                candidate[i][0] *= 384
-                candidate[i][1] *= 512
-
-            keypoints = {"pose_keypoints_2d": candidate}
-            # with open("/home/aigc/ProjectVTON/OpenPose/keypoints/keypoints.json", "w") as f:
-            #     json.dump(keypoints, f)
-            #
-            # # print(candidate)
-            # output_image = cv2.resize(cv2.cvtColor(detected_map, cv2.COLOR_BGR2RGB), (768, 1024))
-            # cv2.imwrite('/home/aigc/ProjectVTON/OpenPose/keypoints/out_pose.jpg', output_image)
-
-        return keypoints
+        H, W, C = input_image.shape
+        assert (H == 512 and W == 384), 'Incorrect input image shape'
+        return input_image
+
+    def __call__(self, input_image, resolution=384):
+        # an RGB array at 384x512 (e.g. from `PreprocessGraph.resized`) is used without a copy
+        if not isinstance(input_image, (Image.Image, str, np.ndarray)):
+            raise ValueError
+        with torch.no_grad():
+            input_image = self.load_image(input_image, resolution)
+            # the pose canvas is not used, so skip drawing it
+            pose = self.preprocessor(input_image, hand_and_face=False, return_is_index=True)
+        return pose_keypoints(pose)
+
+    def predict_batch(self, input_images, resolution=384, batch_size=16, num_workers=None):
+        """
+        `__call__` over a list (or N x H x W x C array) of images. Each batch of `batch_size`
+        images runs one padded forward pass under inference mode, and peak finding / person
+        assembly fan out to `num_workers` threads (default: the per-worker share of the
+        `leffa.runtime` thread budget) while the next batch runs. Returns one
+        `pose_keypoints_2d` dict per image, in input order.
+        """
+        body = self.preprocessor.body_estimation
+        num_workers = num_workers or budget().threads_per_worker
+        futures = []
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            for start in range(0, len(input_images), batch_size):
+                images = [
+                    self.load_image(image, resolution)
+                    for image in input_images[start:start + batch_size]
+                ]
+                # RGB -> BGR, as OpenposeDetector does
+                images = [image[:, :, ::-1].copy() for image in images]
+                with torch.inference_mode():
+                    outputs = body.forward(images)
+                for image, output in zip(images, outputs):
+                    futures.append(pool.submit(self._decode, body, image.shape, output))
+            return [future.result() for future in futures]
+
+    @staticmethod
+    def _decode(body, image_shape, output):
+        candidate, subset = body.decode(image_shape, *output)
+        H, W = image_shape[:2]
+        return pose_keypoints(body_pose(candidate, subset, H, W))
+
+
+def pose_keypoints(pose):
+    """First person's 18 keypoints in 384x512 pixels, with [0, 0] for missing parts."""
+    candidate = pose['bodies']['candidate']
+    subset = pose['bodies']['subset'][0][:18]
+    for i in range(18):
+        if subset[i] == -1:
+            candidate.insert(i, [0, 0])
+            for j in range(i, 18):
+                if(subset[j]) != -1:
+                    subset[j] += 1
+        elif subset[i] != i:
+            candidate.pop(i)
+            for j in range(i, 18):
+                if(subset[j]) != -1:
+                    subset[j] -= 1
+
+    candidate = candidate[:18]
+
+    for i in range(18):
+        candidate[i][0] *= 384
+        candidate[i][1] *= 512
+
+    keypoints = {"pose_keypoints_2d": candidate}
+    # with open("/home/aigc/ProjectVTON/OpenPose/keypoints/keypoints.json", "w") as f:
+    #     json.dump(keypoints, f)
+    #
+    # # print(candidate)
+    # output_image = cv2.resize(cv2.cvtColor(detected_map, cv2.COLOR_BGR2RGB), (768, 1024))
+    # cv2.imwrite('/home/aigc/ProjectVTON/OpenPose/keypoints/out_pose.jpg', output_image)
+    return keypoints
 
 
 if __name__ == '__main__':
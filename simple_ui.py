@@ -66,6 +66,7 @@ def virtual_tryon(human_image, garment_image, save_output=True):
         from leffa.inference import LeffaInference
         from leffa.transform import LeffaTransform
         from leffa_utils.utils import resize_and_center
+        from leffa import runtime
         
         from PIL import Image
         import numpy as np
@@ -76,6 +77,9 @@ def virtual_tryon(human_image, garment_image, save_output=True):
         dtype = "float16" if device == "cuda" else "float32"
         print(f"Using device: {device}, dtype: {dtype}")
         
+        # Size the PyTorch/OpenCV thread pools from the CPU budget (LEFFA_CPU_CORES, ...)
+        runtime.configure()
+        
         # Load the model
         print("Loading Leffa model...")
         model = LeffaModel(
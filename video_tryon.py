@@ -0,0 +1,103 @@
+"""
+Video try-on: dress the person of a short video in one garment.
+
+Frames are streamed from the input video to the output one, so memory stays flat whatever the
+clip length. DensePose and human parsing run on keyframes only, the person is tracked between
+them, and frames after the first start from the previous result and run `--strength` of the
+`--steps` denoising steps. See `leffa_utils.video`.
+
+    python video_tryon.py person.mp4 garment.jpg --output tryon.mp4 --mask agnostic \\
+        --keyframe-interval 8 --steps 30 --strength 0.5
+"""
+import argparse
+import itertools
+import logging
+import os
+import time
+
+from PIL import Image
+
+from batch_tryon import load_inference
+from leffa import runtime
+from leffa_utils.batch import GARMENT_TYPES
+from leffa_utils.video import (
+    FrameWriter,
+    VideoMasks,
+    VideoTryOn,
+    read_frames,
+    video_fps,
+)
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def load_masks(args):
+    if args.mask == "agnostic":
+        from leffa_utils.batch import _Preprocessors
+
+        models = _Preprocessors.get(args.ckpts)
+        densepose, parsing, openpose = models.densepose, models.parsing, models.openpose
+    else:
+        from leffa_utils.densepose_predictor import DensePosePredictor
+
+        densepose = DensePosePredictor(
+            config_path=os.path.join(args.ckpts, "densepose/densepose_rcnn_R_50_FPN_s1x.yaml"),
+            weights_path=os.path.join(args.ckpts, "densepose/model_final_162be9.pkl"),
+        )
+        parsing = openpose = None
+    return VideoMasks(
+        densepose,
+        parsing=parsing,
+        openpose=openpose,
+        garment_type=args.garment_type,
+        keyframe_interval=args.keyframe_interval,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("video", help="video of the person")
+    parser.add_argument("garment", help="garment image")
+    parser.add_argument("--output", default="./tryon.mp4")
+    parser.add_argument("--ckpts", default="./ckpts")
+    parser.add_argument("--mask", choices=["box", "agnostic"], default="agnostic",
+                        help="garment-agnostic mask, or the tracked person's whole box")
+    parser.add_argument("--garment-type", choices=GARMENT_TYPES, default="upper_body")
+    parser.add_argument("--keyframe-interval", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--strength", type=float, default=0.5,
+                        help="fraction of the steps run for frames after the first")
+    parser.add_argument("--guidance-scale", type=float, default=2.5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repaint", action="store_true")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--cpu-optimize", action="store_true",
+                        help="int8/bf16 CPU optimizations, see leffa.cpu_inference")
+    args = parser.parse_args()
+    if not 0 < args.strength <= 1:
+        parser.error("--strength should be in (0, 1], but got {}".format(args.strength))
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    runtime.configure()
+    inference = load_inference(args.ckpts, args.cpu_optimize)
+    tryon = VideoTryOn(
+        inference,
+        load_masks(args),
+        num_inference_steps=args.steps,
+        strength=args.strength,
+        guidance_scale=args.guidance_scale,
+        seed=args.seed,
+        repaint=args.repaint,
+    )
+
+    frames = itertools.islice(read_frames(args.video), args.max_frames)
+    start = time.perf_counter()
+    with FrameWriter(args.output, video_fps(args.video)) as writer:
+        for count, image in enumerate(tryon(frames, Image.open(args.garment)), 1):
+            writer.write(image)
+            logger.info("{} frames, {:.2f} s/frame".format(
+                count, (time.perf_counter() - start) / count))
+
+
+if __name__ == "__main__":
+    main()